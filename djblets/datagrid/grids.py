@@ -24,22 +24,58 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+from __future__ import with_statement
+
+import copy
+import csv
+import datetime
 import logging
+import os
+import Queue
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from cStringIO import StringIO
+from decimal import Decimal
+from HTMLParser import HTMLParser
+
 import pytz
 
 from django.conf import settings
 from django.contrib.auth.models import SiteProfileNotAvailable
-from django.core.exceptions import ObjectDoesNotExist
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import FieldError, ObjectDoesNotExist, \
+                                   ValidationError
+from django.core.signals import request_finished
 from django.core.paginator import InvalidPage, QuerySetPaginator
-from django.http import Http404, HttpResponse
+from django.db import connections, transaction, DatabaseError, \
+                      DEFAULT_DB_ALIAS
+from django.db.models import get_models, Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.constants import LHS_ALIAS, RHS_JOIN_COL, \
+                                           TABLE_NAME
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.http import Http404, HttpResponse, QueryDict
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext, Context
-from django.template.defaultfilters import date, timesince
-from django.template.loader import render_to_string, get_template
+from django.template.defaultfilters import date, slugify, timesince
+from django.template import loader as template_loader
+from django.template.loader import get_template
 from django.utils.cache import patch_cache_control
+from django.utils.encoding import force_unicode
+from django.utils import simplejson
+from django.utils.datastructures import SortedDict
+from django.utils.html import conditional_escape, strip_tags
+from django.utils.http import urlencode, urlquote
 from django.utils.safestring import mark_safe
 from django.utils.timezone import is_aware
-from django.utils.translation import ugettext as _
+from django.utils.translation import get_language, ugettext as _
+
+from djblets.datagrid.templatetags.datagrid import paginator
+from djblets.util.misc import DEFAULT_EXPIRATION_TIME, make_cache_key, new_md5
 
 
 class Column(object):
@@ -55,16 +91,46 @@ class Column(object):
     Columns can have an image, text, or both in the column header. The
     contents of the cells can be instructed to link to the object on the
     row or the data in the cell.
+
+    Columns are defined on the DataGrid class, and are shared by every
+    instance of that grid. Each grid instance works with its own bound copy
+    of the column (see bind()), which holds the state for that grid, such
+    as whether the column is active, its width, and its caches. Accessing a
+    column through a grid instance returns the bound copy.
+
+    Columns can declare the model fields they need in order to render
+    (required_fields) and the relations that should be fetched along with
+    each object (required_relations). When every active column declares
+    its fields, the datagrid will only fetch those fields. Relations are
+    passed to select_related(), rather than joining every related table.
+
+    Columns can also be used to filter the grid, by setting filter_type to
+    one of FILTER_EXACT (the field equals the value), FILTER_RANGE (the
+    value is in the form "min..max", where either end may be left out) or
+    FILTER_PREFIX (the field starts with the value). The filter is applied
+    to db_field in the database query, so that field should be indexed on
+    large tables. See DataGrid.load_state() for how filters are specified.
     """
     SORT_DESCENDING = 0
     SORT_ASCENDING = 1
 
+    FILTER_EXACT = 'exact'
+    FILTER_RANGE = 'range'
+    FILTER_PREFIX = 'prefix'
+
+    # Whether the rendered cells can be cached across requests, for grids
+    # that cache rows. This should be False for columns whose contents can
+    # change without the object changing.
+    cacheable = True
+
     def __init__(self, label=None, detailed_label=None,
                  field_name=None, db_field=None,
                  image_url=None, image_width=None, image_height=None,
                  image_alt="", shrink=False, expand=False, sortable=False,
                  default_sort_dir=SORT_DESCENDING, link=False,
-                 link_func=None, cell_clickable=False, css_class=""):
+                 link_func=None, cell_clickable=False, css_class="",
+                 required_fields=None, required_relations=None,
+                 filter_type=None):
         self.id = None
         self.datagrid = None
         self.field_name = field_name
@@ -81,17 +147,41 @@ class Column(object):
         self.default_sort_dir = default_sort_dir
         self.cell_clickable = False
         self.link = link
-        self.link_func = link_func or \
-            (lambda x, y: self.datagrid.link_to_object(x, y))
+        self.link_func = link_func
         self.css_class = css_class
+        self.required_fields = required_fields
+        self.required_relations = required_relations
+        self.filter_type = filter_type
 
         self.reset()
 
+    def __get__(self, datagrid, owner):
+        if datagrid is None:
+            return self
+
+        return datagrid.get_column(self.id)
+
+    def bind(self, datagrid):
+        """
+        Returns a copy of this column bound to a datagrid.
+
+        The copy holds all per-request state for the column, so that the
+        column definition itself is never modified. This allows several
+        instances of the same DataGrid class to be used at once, including
+        from different threads.
+        """
+        column = copy.copy(self)
+        column.datagrid = datagrid
+        column.reset()
+
+        return column
+
     def reset(self):
         # State
         self.active = False
         self.last = False
         self.width = 0
+        self.filter_value = None
         self.data_cache = {}
         self.cell_render_cache = {}
 
@@ -114,6 +204,20 @@ class Column(object):
                                   ",".join(columns))
     toggle_url = property(get_toggle_url)
 
+    def get_filter_url(self, value):
+        """
+        Returns the URL of the current page filtered by this column.
+
+        An empty value removes this column's filter. The page, and any
+        keyset pagination cursor, are reset, since they're unlikely to make
+        sense once the results have changed.
+        """
+        param = self.datagrid.FILTER_URL_PARAM_PREFIX + self.id
+
+        return "?%s%s=%s" % (
+            self.get_url_params_except(param, "page", "after", "before"),
+            param, urlquote(value))
+
     def get_header(self):
         """
         Displays a sortable column header.
@@ -121,6 +225,19 @@ class Column(object):
         The column header will include the current sort indicator, if it
         belongs in the sort list. It will also be made clickable in order
         to modify the sort order appropriately, if sortable.
+
+        The headers for all active columns are rendered together the first
+        time one is needed. See DataGrid.get_column_header.
+        """
+        return self.datagrid.get_column_header(self)
+    header = property(get_header)
+
+    def get_header_context(self):
+        """
+        Returns the sort state used to render the column header.
+
+        This is a dictionary containing 'in_sort', 'sort_ascending',
+        'sort_primary', 'sort_url' and 'unsort_url'.
         """
         in_sort = False
         sort_direction = self.SORT_DESCENDING
@@ -180,35 +297,21 @@ class Column(object):
             unsort_url = url_prefix + ','.join(sort_list[1:])
             sort_url   = url_prefix + ','.join(sort_list)
 
-        if not self.datagrid.column_header_template_obj:
-            self.datagrid.column_header_template_obj = \
-                get_template(self.datagrid.column_header_template)
-
-        ctx = Context({
-            'STATIC_URL': settings.STATIC_URL,
-            'column': self,
+        return {
             'in_sort': in_sort,
             'sort_ascending': sort_direction == self.SORT_ASCENDING,
             'sort_primary': sort_primary,
             'sort_url': sort_url,
             'unsort_url': unsort_url,
-        })
-
-        return mark_safe(self.datagrid.column_header_template_obj.render(ctx))
-    header = property(get_header)
+        }
 
     def get_url_params_except(self, *params):
         """
         Utility function to return a string containing URL parameters to
-        this page with the specified parameter filtered out.
+        this page with the specified parameter filtered out. The parameters
+        used to request just the grid are always filtered out.
         """
-        s = ""
-
-        for key in self.datagrid.request.GET:
-            if key not in params:
-                s += "%s=%s&" % (key, self.datagrid.request.GET[key])
-
-        return s
+        return self.datagrid.get_url_params_except(*params)
 
     def render_cell(self, obj):
         """
@@ -219,8 +322,10 @@ class Column(object):
         css_class = ''
 
         if self.link:
+            link_func = self.link_func or self.datagrid.link_to_object
+
             try:
-                url = self.link_func(obj, rendered_data)
+                url = link_func(obj, rendered_data)
             except AttributeError:
                 pass
 
@@ -232,10 +337,18 @@ class Column(object):
 
         key = "%s:%s:%s:%s" % (self.last, rendered_data, url, css_class)
 
-        if key not in self.cell_render_cache:
+        if key in self.cell_render_cache:
+            return self.cell_render_cache[key]
+
+        if self.datagrid.cell_template == self.datagrid.DEFAULT_CELL_TEMPLATE:
+            # This is the standard cell template, so we can skip the template
+            # engine and the context processors and build the HTML directly.
+            self.cell_render_cache[key] = \
+                self.render_default_cell(rendered_data, url, css_class)
+        else:
             if not self.datagrid.cell_template_obj:
                 self.datagrid.cell_template_obj = \
-                    get_template(self.datagrid.cell_template)
+                    get_cached_template(self.datagrid.cell_template)
 
                 if not self.datagrid.cell_template_obj:
                     logging.error("Unable to load template '%s' for datagrid "
@@ -254,6 +367,36 @@ class Column(object):
 
         return self.cell_render_cache[key]
 
+    def render_default_cell(self, rendered_data, url, css_class):
+        """
+        Renders a cell the same way as the default 'datagrid/cell.html'.
+
+        This is used in place of the template when the grid uses the default
+        cell template, and produces the same HTML. The data is treated as
+        safe, while the URL and CSS class are escaped.
+        """
+        attrs = []
+
+        if css_class:
+            attrs.append(u' class="%s"' % conditional_escape(css_class))
+
+        if self.last:
+            attrs.append(u' colspan="2"')
+
+        if url:
+            url = conditional_escape(url)
+
+            if self.cell_clickable:
+                attrs.append(u' onclick="javascript:window.location = \'%s\'; '
+                             u'return false;"' % url)
+
+            content = u'\n <a href="%s">%s</a>\n' % (
+                url, force_unicode(mark_safe(rendered_data)))
+        else:
+            content = u'\n %s\n' % force_unicode(mark_safe(rendered_data))
+
+        return mark_safe(u'<td%s>\n%s\n</td>\n' % (u''.join(attrs), content))
+
     def render_data(self, obj):
         """
         Renders the column data to a string. This may contain HTML.
@@ -279,6 +422,38 @@ class Column(object):
             else:
                 return value
 
+    def render_text(self, obj):
+        """
+        Renders the column data as plain text.
+
+        This is used when exporting the grid. By default, this renders the
+        data using render_data(), with any HTML tags removed.
+        """
+        value = self.render_data(obj)
+
+        if value is None:
+            return u''
+
+        value = force_unicode(value)
+
+        if '<' in value or '&' in value:
+            value = HTMLParser().unescape(strip_tags(value))
+
+        return value
+
+    def prefetch(self, objects):
+        """
+        Prefetches any data needed to render the column for a page of objects.
+
+        This is called once for each page, with the list of objects that
+        are about to be rendered, before any cells are rendered.
+
+        Subclasses can override this to fetch related data for all of the
+        objects in a single query, rather than one query per row, storing
+        it in data_cache (or elsewhere) for use in render_data().
+        """
+        pass
+
     def augment_queryset(self, queryset):
         """Augments a queryset with new queries.
 
@@ -292,6 +467,168 @@ class Column(object):
         """
         return queryset
 
+    def clean_filter_value(self, value):
+        """
+        Validates a filter value for the column's filter_type.
+
+        Each value compared against db_field is checked using the model
+        field's to_python(), if the field can be found on the grid's model.
+        This returns the value, or raises ValueError if it isn't valid.
+        Subclasses that support other kinds of filters should override
+        this along with filter_queryset().
+        """
+        if self.filter_type == self.FILTER_EXACT:
+            values = [value]
+        elif self.filter_type == self.FILTER_PREFIX:
+            values = []
+        elif self.filter_type == self.FILTER_RANGE:
+            if '..' not in value:
+                raise ValueError('"%s" is not a valid range' % value)
+
+            values = [part for part in value.split('..', 1) if part]
+        else:
+            raise ValueError('Column "%s" cannot be filtered' % self.id)
+
+        field = self._get_filter_field()
+
+        if field is not None:
+            for part in values:
+                try:
+                    field.to_python(part)
+                except ValidationError, e:
+                    raise ValueError('"%s" is not a valid value for column '
+                                     '"%s": %s'
+                                     % (part, self.id, '; '.join(e.messages)))
+
+        return value
+
+    def _get_filter_field(self):
+        """
+        Returns the model field that db_field refers to.
+
+        If db_field names a relation, the field it references is returned.
+        This returns None if the field can't be found, such as for raw
+        table.column references or names added through extra().
+        """
+        queryset = self.datagrid.queryset
+
+        if queryset is None or '.' in self.db_field:
+            return None
+
+        opts = queryset.model._meta
+        field = None
+
+        for part in self.db_field.split('__'):
+            if field is not None:
+                if not field.rel:
+                    return None
+
+                opts = field.rel.to._meta
+
+            if part == 'pk':
+                field = opts.pk
+            else:
+                try:
+                    field, field_model, direct, m2m = \
+                        opts.get_field_by_name(part)
+                except FieldDoesNotExist:
+                    return None
+
+                if m2m or not direct:
+                    return None
+
+        while field.rel:
+            field = field.rel.get_related_field()
+
+        return field
+
+    def filter_queryset(self, queryset, value):
+        """
+        Filters a queryset by a value, based on the column's filter_type.
+
+        This raises ValueError if the value isn't valid for the filter.
+        Subclasses can override this to support other kinds of filters.
+        """
+        if self.filter_type == self.FILTER_EXACT:
+            return queryset.filter(**{self.db_field: value})
+        elif self.filter_type == self.FILTER_PREFIX:
+            return queryset.filter(**{self.db_field + '__startswith': value})
+        elif self.filter_type == self.FILTER_RANGE:
+            if '..' not in value:
+                raise ValueError('"%s" is not a valid range' % value)
+
+            range_start, range_end = value.split('..', 1)
+            q = {}
+
+            if range_start:
+                q[self.db_field + '__gte'] = range_start
+
+            if range_end:
+                q[self.db_field + '__lte'] = range_end
+
+            return queryset.filter(**q)
+        else:
+            raise ValueError('Column "%s" cannot be filtered' % self.id)
+
+
+class ForeignKeyColumn(Column):
+    """
+    A column that renders an object referenced through a ForeignKey.
+
+    The related objects for all rows on a page are fetched in a single
+    query, rather than once per row. If the related_field keyword argument
+    is specified, that attribute of the related object will be rendered
+    instead of the object itself.
+    """
+    def __init__(self, *args, **kwargs):
+        self.related_field = kwargs.pop('related_field', None)
+        Column.__init__(self, *args, **kwargs)
+
+    def prefetch(self, objects):
+        field = objects[0]._meta.get_field(self.field_name)
+        to_field = field.rel.get_related_field()
+        cache_name = field.get_cache_name()
+        ids = set()
+
+        for obj in objects:
+            related_id = getattr(obj, field.attname)
+
+            if hasattr(obj, cache_name):
+                # This was already fetched, likely through select_related().
+                self.data_cache[related_id] = getattr(obj, cache_name)
+            elif related_id is not None:
+                ids.add(related_id)
+
+        missing_ids = [pk for pk in ids if pk not in self.data_cache]
+
+        if missing_ids:
+            related_objects = field.rel.to._default_manager.filter(**{
+                '%s__in' % to_field.name: missing_ids,
+            })
+
+            for related_obj in related_objects:
+                self.data_cache[getattr(related_obj, to_field.attname)] = \
+                    related_obj
+
+        # Populate each object's cache for the relation, so that accessing
+        # it elsewhere (such as in link_to_value) won't trigger a query.
+        for obj in objects:
+            related_id = getattr(obj, field.attname)
+
+            if related_id in self.data_cache:
+                setattr(obj, cache_name, self.data_cache[related_id])
+
+    def render_data(self, obj):
+        value = Column.render_data(self, obj)
+
+        if value is not None and self.related_field:
+            value = getattr(value, self.related_field)
+
+            if callable(value):
+                value = value()
+
+        return value
+
 
 class DateTimeColumn(Column):
     """
@@ -317,6 +654,8 @@ class DateTimeSinceColumn(Column):
     """
     A column that renders a date or time relative to now.
     """
+    cacheable = False
+
     def __init__(self, label, sortable=True, timezone=pytz.utc,
                  *args, **kwargs):
         Column.__init__(self, label, sortable=sortable, *args, **kwargs)
@@ -332,338 +671,2020 @@ class DateTimeSinceColumn(Column):
             return _("%s ago") % timesince(getattr(obj, self.field_name))
 
 
-class DataGrid(object):
+class KeysetPage(object):
     """
-    A representation of a list of objects, sorted and organized by
-    columns. The sort order and column lists can be customized. allowing
-    users to view this data however they prefer.
-
-    This is meant to be subclassed for specific uses. The subclasses are
-    responsible for defining one or more column types. It can also set
-    one or more of the following optional variables:
+    A page of results in a datagrid using keyset pagination.
 
-        * 'title':                  The title of the grid.
-        * 'profile_sort_field':     The variable name in the user profile
-                                    where the sort order can be loaded and
-                                    saved.
-        * 'profile_columns_field":  The variable name in the user profile
-                                    where the columns list can be loaded and
-                                    saved.
-        * 'paginate_by':            The number of items to show on each page
-                                    of the grid. The default is 50.
-        * 'paginate_orphans':       If this number of objects or fewer are
-                                    on the last page, it will be rolled into
-                                    the previous page. The default is 3.
-        * 'page':                   The page to display. If this is not
-                                    specified, the 'page' variable passed
-                                    in the URL will be used, or 1 if that is
-                                    not specified.
-        * 'listview_template':      The template used to render the list view.
-                                    The default is 'datagrid/listview.html'
-        * 'column_header_template': The template used to render each column
-                                    header. The default is
-                                    'datagrid/column_header.html'
-        * 'cell_template':          The template used to render a cell of
-                                    data. The default is 'datagrid/cell.html'
-        * 'optimize_sorts':         Whether or not to optimize queries when
-                                    using multiple sorts. This can offer a
-                                    speed improvement, but may need to be
-                                    turned off for more advanced querysets
-                                    (such as when using extra()).
-                                    The default is True.
+    Unlike a standard Page, this doesn't know its own page number or the
+    total number of pages. Instead, it provides opaque cursors that can be
+    passed back as the 'after' or 'before' URL parameters in order to load
+    the next or previous page.
     """
-    def __init__(self, request, queryset=None, title="", extra_context={},
-                 optimize_sorts=True):
-        self.request = request
-        self.queryset = queryset
-        self.rows = []
-        self.columns = []
-        self.all_columns = []
-        self.db_field_map = {}
-        self.id_list = []
-        self.paginator = None
-        self.page = None
-        self.sort_list = None
-        self.state_loaded = False
-        self.page_num = 0
-        self.id = None
-        self.extra_context = dict(extra_context)
-        self.optimize_sorts = optimize_sorts
-        self.cell_template_obj = None
-        self.column_header_template_obj = None
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
 
-        if not hasattr(request, "datagrid_count"):
-            request.datagrid_count = 0
+    def has_next(self):
+        return self.next_cursor is not None
 
-        self.id = "datagrid-%s" % request.datagrid_count
-        request.datagrid_count += 1
+    def has_previous(self):
+        return self.previous_cursor is not None
 
-        # Customizable variables
-        self.title = title
-        self.profile_sort_field = None
-        self.profile_columns_field = None
-        self.paginate_by = 50
-        self.paginate_orphans = 3
-        self.listview_template = 'datagrid/listview.html'
-        self.column_header_template = 'datagrid/column_header.html'
-        self.cell_template = 'datagrid/cell.html'
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
 
-        for attr in dir(self):
-            column = getattr(self, attr)
-            if isinstance(column, Column):
-                self.all_columns.append(column)
-                column.datagrid = self
-                column.id = attr
 
-                # Reset the column.
-                column.reset()
+class UncountedPage(object):
+    """
+    A page of results in a datagrid that doesn't know the total hit count.
 
-                if not column.field_name:
-                    column.field_name = column.id
+    This is used with DataGrid.COUNT_NONE. Whether there's a next page is
+    determined by fetching one more row than is shown.
+    """
+    def __init__(self, object_list, number, per_page, num_objects, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.per_page = per_page
+        self.num_objects = num_objects
+        self._has_next = has_next
 
-                if not column.db_field:
-                    column.db_field = column.field_name
+    def has_next(self):
+        return self._has_next
 
-                self.db_field_map[column.id] = column.db_field
+    def has_previous(self):
+        return self.number > 1
 
-        self.all_columns.sort(key=lambda x: x.label)
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
 
+    def next_page_number(self):
+        return self.number + 1
 
-    def load_state(self):
-        """
-        Loads the state of the datagrid.
+    def previous_page_number(self):
+        return self.number - 1
 
-        This will retrieve the user-specified or previously stored
-        sorting order and columns list, as well as any state a subclass
-        may need.
-        """
-        if self.state_loaded:
-            return
+    def start_index(self):
+        if self.num_objects == 0:
+            return 0
 
-        profile_sort_list = None
-        profile_columns_list = None
-        profile = None
-        profile_dirty = False
+        return (self.number - 1) * self.per_page + 1
 
-        # Get the saved settings for this grid in the profile. These will
-        # work as defaults and allow us to determine if we need to save
-        # the profile.
-        if self.request.user.is_authenticated():
-            try:
-                profile = self.request.user.get_profile()
+    def end_index(self):
+        return (self.number - 1) * self.per_page + self.num_objects
 
-                if self.profile_sort_field:
-                    profile_sort_list = \
-                        getattr(profile, self.profile_sort_field, None)
 
-                if self.profile_columns_field:
-                    profile_columns_list = \
-                        getattr(profile, self.profile_columns_field, None)
-            except SiteProfileNotAvailable:
-                pass
-            except ObjectDoesNotExist:
-                pass
+class DataGridPaginator(QuerySetPaginator):
+    """
+    A paginator that can get its hit count from a DataGrid's count strategy.
 
+    If count_func is provided, it will be called with the queryset and must
+    return a tuple of (count, is_estimate). If it returns a count of None,
+    an exact count will be performed as usual.
 
-        # Figure out the columns we're going to display
-        # We're also going to calculate the column widths based on the
-        # shrink and expand values.
-        colnames_str = self.request.GET.get('columns', profile_columns_list)
+    If the count is only an estimate, page numbers past the estimated last
+    page are allowed, and will simply be empty. The estimate should only be
+    used as a hint when displaying the number of pages. DataGrid works out
+    whether there's a next page by fetching an extra row instead.
+    """
+    def __init__(self, object_list, per_page, orphans=0, count_func=None):
+        QuerySetPaginator.__init__(self, object_list, per_page, orphans)
+        self.count_func = count_func
+        self.count_is_estimate = False
 
-        if colnames_str:
-            colnames = colnames_str.split(',')
-        else:
-            colnames = self.default_columns
-            colnames_str = ",".join(colnames)
+    def validate_number(self, number):
+        if self.count_is_estimate:
+            try:
+                number = int(number)
+            except (TypeError, ValueError):
+                pass
+            else:
+                if number >= 1:
+                    return number
 
-        expand_columns = []
-        normal_columns = []
+        return QuerySetPaginator.validate_number(self, number)
 
-        for colname in colnames:
-            try:
-                column = getattr(self, colname)
-            except AttributeError:
-                # The user specified a column that doesn't exist. Skip it.
-                continue
+    def _get_count(self):
+        if self._count is None and self.count_func:
+            self._count, self.count_is_estimate = \
+                self.count_func(self.object_list)
 
-            self.columns.append(column)
-            column.active = True
+        return QuerySetPaginator._get_count(self)
+    count = property(_get_count)
 
-            if column.expand:
-                # This column is requesting all remaining space. Save it for
-                # later so we can tell how much to give it. Each expanded
-                # column will count as two normal columns when calculating
-                # the normal sized columns.
-                expand_columns.append(column)
-            elif column.shrink:
-                # Make this as small as possible.
-                column.width = 0
-            else:
-                # We'll divide the column widths equally after we've built
-                # up the lists of expanded and normal sized columns.
-                normal_columns.append(column)
+    def set_count(self, count, is_estimate=False):
+        """
+        Sets the hit count, when it's been computed elsewhere.
+        """
+        self._count = count
+        self.count_is_estimate = is_estimate
 
-        self.columns[-1].last = True
 
-        # Try to figure out the column widths for each column.
-        # We'll start with the normal sized columns.
-        total_pct = 100
+class QueryTimeoutError(Exception):
+    pass
 
-        # Each expanded column counts as two normal columns.
-        normal_column_width = total_pct / (len(self.columns) +
-                                           len(expand_columns))
 
-        for column in normal_columns:
-            column.width = normal_column_width
-            total_pct -= normal_column_width
+class QueryTask(object):
+    """
+    A function call queued on a QueryThreadPool.
+
+    The result can be retrieved using wait(), which blocks until the call
+    has finished, and re-raises any exception it raised.
+    """
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self._finished = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._result = self.func(*self.args, **self.kwargs)
+        except:
+            self._exc_info = sys.exc_info()
+
+        self._finished.set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the call to finish, and returns its result.
+
+        If timeout is given and the call hasn't finished within that many
+        seconds, QueryTimeoutError is raised.
+        """
+        self._finished.wait(timeout)
+
+        if not self._finished.isSet():
+            raise QueryTimeoutError('The query did not finish within %s '
+                                    'seconds' % timeout)
+
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+        return self._result
+
+
+class QueryThreadPool(object):
+    """
+    A small pool of threads for running database queries in the background.
+
+    Django gives each thread its own database connections, so queries run
+    in the pool use separate connections from the thread submitting them.
+    Those connections are kept open between calls, but each call's
+    transaction is rolled back afterward, so that later calls see new data.
+    If a call fails with a database error, the thread's connections are
+    closed, in case they've been lost.
+    As they're separate connections, they won't see any uncommitted changes
+    made by the submitting thread, so this must only be used for read-only
+    queries.
+
+    Calls are never queued behind other calls. If every thread is busy,
+    the caller is expected to make the call itself.
+    """
+    def __init__(self, num_threads):
+        self.num_threads = num_threads
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._num_idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Hands a function to a free thread in the pool to be called.
+
+        This returns a QueryTask for retrieving the result, or None if
+        every thread is busy.
+        """
+        self._lock.acquire()
+
+        try:
+            if self._num_idle > 0:
+                self._num_idle -= 1
+            elif len(self._threads) < self.num_threads:
+                thread = threading.Thread(target=self._run_tasks)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+            else:
+                return None
+
+            # There's now a thread reserved for this task.
+            task = QueryTask(func, args, kwargs)
+            self._queue.put(task)
+        finally:
+            self._lock.release()
+
+        return task
+
+    def _run_tasks(self):
+        while True:
+            task = self._queue.get()
+
+            try:
+                task.run()
+
+                failed = (task._exc_info is not None and
+                          issubclass(task._exc_info[0], DatabaseError))
+
+                # Connections shared between threads belong to another
+                # thread, which is responsible for them.
+                for connection in connections.all():
+                    if connection.allow_thread_sharing:
+                        continue
+
+                    if failed:
+                        # The connection may have been lost. A new one
+                        # will be opened by the next call.
+                        connection.close()
+                    else:
+                        try:
+                            transaction.rollback_unless_managed(
+                                using=connection.alias)
+                        except Exception:
+                            connection.close()
+            finally:
+                self._lock.acquire()
+
+                try:
+                    self._num_idle += 1
+                finally:
+                    self._lock.release()
+
+
+_query_thread_pool = None
+_query_thread_pool_lock = threading.Lock()
+
+
+def get_query_thread_pool():
+    """
+    Returns the QueryThreadPool shared by all datagrids.
+
+    The number of threads is set by settings.DATAGRID_QUERY_THREADS, and
+    defaults to 4.
+    """
+    global _query_thread_pool
+
+    if _query_thread_pool is None:
+        _query_thread_pool_lock.acquire()
+
+        try:
+            if _query_thread_pool is None:
+                _query_thread_pool = QueryThreadPool(
+                    getattr(settings, 'DATAGRID_QUERY_THREADS', 4))
+        finally:
+            _query_thread_pool_lock.release()
+
+    return _query_thread_pool
+
+
+_template_cache = {}
+
+
+def get_cached_template(template_name):
+    """
+    Returns a compiled template, shared by all datagrids in the process.
+
+    Datagrids render the same few templates for every grid on every
+    request. Unless Django's cached template loader is in use, loading
+    them normally means reading and parsing them each time. This keeps
+    each template once it's been loaded.
+
+    When settings.DEBUG is on, the template is reloaded whenever its file
+    changes.
+    """
+    try:
+        template, path, mtime = _template_cache[template_name]
+    except KeyError:
+        template = None
+    else:
+        if settings.DEBUG and path and _get_mtime(path) != mtime:
+            template = None
+
+    if template is None:
+        template = get_template(template_name)
+        path = _find_template_path(template_name)
+        mtime = _get_mtime(path)
+        _template_cache[template_name] = (template, path, mtime)
+
+    return template
+
+
+def clear_template_cache():
+    """
+    Clears the compiled templates shared by all datagrids.
+    """
+    _template_cache.clear()
+
+
+def _find_template_path(template_name, loaders=None):
+    """
+    Returns the path to the file a template is loaded from, if any.
+    """
+    if loaders is None:
+        loaders = template_loader.template_source_loaders or []
+
+    for loader in loaders:
+        if hasattr(loader, 'loaders'):
+            # This is the cached loader, which wraps other loaders.
+            path = _find_template_path(template_name, loader.loaders)
+
+            if path:
+                return path
+        elif hasattr(loader, 'get_template_sources'):
+            for path in loader.get_template_sources(template_name):
+                if os.path.isfile(path):
+                    return path
+
+    return None
+
+
+def _get_mtime(path):
+    if not path:
+        return None
+
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+# Maps the table name of each model to its primary key column.
+_table_pk_columns = {}
+
+
+def _get_table_pk_column(table_name):
+    """
+    Returns the primary key column of the model using a table.
+
+    The table names are looked up once and then kept, unless a table
+    that hasn't been seen is requested, in which case they're looked up
+    again in case the model was loaded since. This returns None if no
+    model uses the table.
+    """
+    try:
+        return _table_pk_columns[table_name]
+    except KeyError:
+        pass
+
+    pk_columns = dict([
+        (model._meta.db_table, model._meta.pk.column)
+        for model in get_models(include_auto_created=True)
+    ])
+    pk_columns.setdefault(table_name, None)
+    _table_pk_columns.update(pk_columns)
+
+    return pk_columns[table_name]
+
+
+_timing_stats = {}
+_timing_stats_lock = threading.Lock()
+
+
+def get_timing_stats():
+    """
+    Returns the phase timings aggregated for each datagrid class.
+
+    This returns a dictionary mapping the full class name of each grid to a
+    dictionary of its phases. Each phase has a 'count' of the times it ran,
+    the 'total_time' and 'max_time' in seconds, and the 'total_queries'
+    (for the runs where queries were counted).
+
+    Comparing these over time can point out which part of a grid has
+    regressed.
+    """
+    _timing_stats_lock.acquire()
+
+    try:
+        return copy.deepcopy(_timing_stats)
+    finally:
+        _timing_stats_lock.release()
+
+
+def reset_timing_stats():
+    """
+    Clears the phase timings aggregated for all datagrid classes.
+    """
+    _timing_stats_lock.acquire()
+
+    try:
+        _timing_stats.clear()
+    finally:
+        _timing_stats_lock.release()
+
+
+def _add_timing_stats(grid_class, phase, elapsed, queries):
+    _timing_stats_lock.acquire()
+
+    try:
+        class_stats = _timing_stats.setdefault(
+            '%s.%s' % (grid_class.__module__, grid_class.__name__), {})
+        stats = class_stats.setdefault(phase, {
+            'count': 0,
+            'total_time': 0.0,
+            'max_time': 0.0,
+            'total_queries': 0,
+        })
+        stats['count'] += 1
+        stats['total_time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+
+        if queries is not None:
+            stats['total_queries'] += queries
+    finally:
+        _timing_stats_lock.release()
+
+
+def get_count_generation_key(model):
+    """
+    Returns the default cache key storing the count generation for a model.
+
+    This is the generation key used by datagrids with a COUNT_CACHED
+    count strategy, unless the grid specifies its own.
+    """
+    return 'datagrid-count-generation:%s.%s' % (model._meta.app_label,
+                                                model._meta.object_name)
+
+
+def invalidate_cached_counts(generation_key):
+    """
+    Invalidates all cached hit counts stored under a generation key.
+
+    Applications using DataGrid.COUNT_CACHED should call this whenever
+    objects that may be shown in those datagrids are added, removed or
+    modified. The key can be a model, in which case the default generation
+    key for that model will be used.
+    """
+    if not isinstance(generation_key, basestring):
+        generation_key = get_count_generation_key(generation_key)
+
+    key = make_cache_key(generation_key)
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The generation isn't in the cache. Start a new one based on the
+        # current time, so we won't collide with any older generation that
+        # may have been evicted.
+        cache.set(key, int(time.time()),
+                  getattr(settings, 'CACHE_EXPIRATION_TIME',
+                          DEFAULT_EXPIRATION_TIME))
+
+
+# Profiles with deferred changes waiting to be written, mapping the cache
+# key for the changes to a tuple of (model, pk, window, fields, retry_at).
+_deferred_profile_saves = {}
+_deferred_profile_saves_lock = threading.Lock()
+
+
+def _get_deferred_profile_state_key(profile):
+    return make_cache_key('datagrid-profile-state:%s.%s:%s' % (
+        profile._meta.app_label, profile._meta.object_name, profile.pk))
+
+
+def flush_deferred_profile_saves(**kwargs):
+    """
+    Writes deferred datagrid state to the user profiles.
+
+    This is called when each request finishes, after the response has
+    been sent. Each profile is written at most once per save window (see
+    DataGrid.defer_profile_saves). Changes made within the window are held
+    until it has passed, and then written when the next request handled by
+    this process finishes, whichever user or page it's for. Only the
+    changed fields are updated.
+
+    The changes are also kept in the cache until they're written. If this
+    process exits before then, or writing them fails, the next request to
+    load the profile in a datagrid schedules them again.
+
+    Django's own request_finished handler closes the database connections
+    before this runs, so any connection opened to write the changes is
+    closed again afterward, rather than sitting idle until the end of the
+    next request. Connections that were already open, such as in tests or
+    manually managed transactions, are left alone.
+    """
+    if not _deferred_profile_saves:
+        return
+
+    now = time.time()
+    _deferred_profile_saves_lock.acquire()
+
+    try:
+        due = [(key, entry)
+               for key, entry in _deferred_profile_saves.iteritems()
+               if entry[4] <= now]
+
+        for key, entry in due:
+            del _deferred_profile_saves[key]
+    finally:
+        _deferred_profile_saves_lock.release()
+
+    opened_dbs = set()
+
+    for key, (model, pk, window, fields, retry_at) in due:
+        flushed_key = '%s:flushed' % key
+
+        if not cache.add(flushed_key, now, window):
+            # This profile was written recently. Try again once the window
+            # has passed, unless a newer change has been deferred since.
+            flushed_at = cache.get(flushed_key) or now
+
+            _deferred_profile_saves_lock.acquire()
+
+            try:
+                _deferred_profile_saves.setdefault(
+                    key, (model, pk, window, fields, flushed_at + window))
+            finally:
+                _deferred_profile_saves_lock.release()
+
+            continue
+
+        # Another process may have deferred newer changes.
+        fields = cache.get(key) or fields
+        queryset = model._default_manager.filter(pk=pk)
+
+        if connections[queryset.db].connection is None:
+            opened_dbs.add(queryset.db)
+
+        try:
+            queryset.update(**fields)
+        except Exception, e:
+            logging.exception('Unable to save deferred datagrid state for '
+                              '%s.%s %s: %s',
+                              model._meta.app_label, model._meta.object_name,
+                              pk, e)
+            continue
+
+        # Only remove the changes if another request hasn't made more
+        # in the meantime.
+        if cache.get(key) == fields:
+            cache.delete(key)
+
+    for db in opened_dbs:
+        connections[db].close()
+
+request_finished.connect(flush_deferred_profile_saves)
+
+
+class DataGrid(object):
+    """
+    A representation of a list of objects, sorted and organized by
+    columns. The sort order and column lists can be customized. allowing
+    users to view this data however they prefer.
+
+    This is meant to be subclassed for specific uses. The subclasses are
+    responsible for defining one or more column types. It can also set
+    one or more of the following optional variables:
+
+        * 'title':                  The title of the grid.
+        * 'profile_sort_field':     The variable name in the user profile
+                                    where the sort order can be loaded and
+                                    saved.
+        * 'profile_columns_field":  The variable name in the user profile
+                                    where the columns list can be loaded and
+                                    saved.
+        * 'profile_filters_field':  The variable name in the user profile
+                                    where the column filters can be loaded
+                                    and saved.
+        * 'defer_profile_saves':    Whether or not to defer saving a changed
+                                    sort order or columns list to the
+                                    profile (along with the filters). The
+                                    changes are stored in the cache and
+                                    written (updating only those fields)
+                                    after the response is sent, at most
+                                    once per profile_save_window. Any state
+                                    changed by load_extra_state() is still
+                                    saved immediately. The default is False.
+        * 'profile_save_window':    The number of seconds within which
+                                    deferred profile changes are coalesced
+                                    into a single write. The default is 30.
+        * 'paginate_by':            The number of items to show on each page
+                                    of the grid. The default is 50.
+        * 'paginate_orphans':       If this number of objects or fewer are
+                                    on the last page, it will be rolled into
+                                    the previous page. The default is 3.
+        * 'page':                   The page to display. If this is not
+                                    specified, the 'page' variable passed
+                                    in the URL will be used, or 1 if that is
+                                    not specified.
+        * 'listview_template':      The template used to render the list view.
+                                    The default is 'datagrid/listview.html'
+        * 'column_header_template': The template used to render each column
+                                    header. The default is
+                                    'datagrid/column_header.html'
+        * 'cell_template':          The template used to render a cell of
+                                    data. The default is 'datagrid/cell.html'
+                                    which is rendered directly in Python
+                                    rather than through the template engine.
+                                    Grids that need different markup for
+                                    cells must set this to a custom template.
+        * 'optimize_sorts':         Whether or not to optimize queries when
+                                    using multiple sorts. This can offer a
+                                    speed improvement, but may need to be
+                                    turned off for more advanced querysets
+                                    (such as when using extra()).
+                                    The default is True.
+        * 'count_strategy':         How the total number of hits is
+                                    computed for pagination. This can be
+                                    one of COUNT_EXACT (always perform a
+                                    COUNT query), COUNT_CACHED (cache the
+                                    exact count until the count generation
+                                    is bumped through
+                                    invalidate_cached_counts()),
+                                    COUNT_ESTIMATED (use the database
+                                    planner's estimate, where supported),
+                                    or COUNT_NONE (skip the count, and only
+                                    check whether there's a next page).
+                                    The default is COUNT_EXACT.
+        * 'count_generation_key':   The cache key holding the count
+                                    generation when using COUNT_CACHED.
+                                    The default is based on the queryset's
+                                    model. See get_count_generation_key().
+        * 'count_cache_expiration': The expiration time for cached counts.
+                                    The default is
+                                    settings.CACHE_EXPIRATION_TIME, or 30
+                                    days.
+        * 'concurrent_count':       Whether or not to count the results on
+                                    a separate database connection, using
+                                    a small thread pool, while the page is
+                                    being fetched. This hides the time
+                                    spent counting, for grids where that's
+                                    slow. It applies to the COUNT_EXACT and
+                                    COUNT_CACHED strategies. The count won't
+                                    see uncommitted changes made in the
+                                    request's transaction, so this is only
+                                    safe for read-only querysets. If all
+                                    the threads are busy, the count is
+                                    done in the request thread instead.
+                                    The default is False.
+        * 'concurrent_count_timeout':
+                                    The number of seconds to wait for a
+                                    concurrent count before counting in the
+                                    request thread instead. The default is
+                                    10.
+        * 'count_queries':          Whether or not to count the queries
+                                    performed in each phase of loading and
+                                    rendering the grid (see timings), even
+                                    when settings.DEBUG is off. The default
+                                    is False.
+        * 'log_timings':            Whether or not to log the timings for
+                                    each phase once the grid has been
+                                    rendered. The default is False.
+        * 'use_server_timing':      Whether or not to add the timings to
+                                    responses rendered by the grid, in a
+                                    Server-Timing header. The default is
+                                    False.
+        * 'use_keyset_pagination':  Whether or not to paginate by seeking
+                                    past the sort values of the last row
+                                    shown, rather than by offset. This keeps
+                                    deep pages fast, but only supports
+                                    next/previous/first/last navigation.
+                                    It requires that the sorted fields be
+                                    non-NULL model fields, and that each
+                                    object appear only once in the results.
+                                    Otherwise, the grid is paginated by
+                                    offset. The default is False.
+        * 'row_cache_version_field': The name of a field on each object
+                                    that changes whenever the object does,
+                                    such as a modification timestamp. If
+                                    set, the rendered rows will be cached
+                                    across requests until this changes. The
+                                    number of cached rows used and rendered
+                                    are available as row_cache_hits and
+                                    row_cache_misses. The default is None.
+        * 'row_cache_expiration':   The expiration time for cached rows.
+                                    The default is the same as
+                                    count_cache_expiration.
+        * 'use_header_cache':       Whether or not to cache the rendered
+                                    column headers across requests. They're
+                                    keyed on the column, the sort order and
+                                    the URL parameters. The default is
+                                    False.
+        * 'header_cache_expiration': The expiration time for cached column
+                                    headers. The default is the same as
+                                    count_cache_expiration.
+        * 'required_fields':        Model fields that must always be fetched
+                                    when the active columns declare the
+                                    fields they need, such as fields used by
+                                    link functions. The default is empty.
+        * 'stream_chunk_size':      The number of rows rendered at a time
+                                    when streaming the grid (see
+                                    render_listview_to_response() and
+                                    render_to_response()). The default is
+                                    50.
+        * 'export_chunk_size':      The number of objects fetched at a time
+                                    when exporting the grid (see
+                                    render_export_to_response()). The
+                                    default is 500.
+
+    The time spent in each phase of loading and rendering the grid is
+    available in the timings attribute, a dictionary mapping phase names
+    (such as 'state', 'profile_save', 'count', 'ids', 'objects',
+    'render_rows' and 'listview') to the 'time' in seconds and the number
+    of 'queries' performed (or None, if queries weren't counted). These are
+    also aggregated for each grid class. See get_timing_stats().
+    """
+    COUNT_EXACT = 'exact'
+    COUNT_CACHED = 'cached'
+    COUNT_ESTIMATED = 'estimated'
+    COUNT_NONE = 'none'
+
+    KEYSET_CURSOR_SALT = 'djblets.datagrid.keyset'
+
+    DEFAULT_CELL_TEMPLATE = 'datagrid/cell.html'
+
+    # The prefix for URL parameters filtering the grid by a column.
+    FILTER_URL_PARAM_PREFIX = 'filter-'
+
+    # URL parameters used to request just the grid. These are left out of
+    # the URLs generated by the grid.
+    GRID_ONLY_URL_PARAMS = ('gridonly', 'gridformat', 'gridcolumns',
+                            'datagrid-id')
+
+    EXPORT_CSV = 'csv'
+    EXPORT_NDJSON = 'ndjson'
+
+    EXPORT_MIMETYPES = {
+        EXPORT_CSV: 'text/csv',
+        EXPORT_NDJSON: 'application/x-ndjson',
+    }
+
+    def __init__(self, request, queryset=None, title="", extra_context={},
+                 optimize_sorts=True):
+        self.request = request
+        self.queryset = queryset
+        self.rows = []
+        self.columns = []
+        self._bound_columns = {}
+        self.db_field_map = {}
+        self.id_list = []
+        self.page_objects = []
+        self.paginator = None
+        self.page = None
+        self.query_plan = None
+        self.sort_list = None
+        self.filters = {}
+        self.state_loaded = False
+        self.page_num = 0
+        self.id = None
+        self.extra_context = dict(extra_context)
+        self.optimize_sorts = optimize_sorts
+        self.cell_template_obj = None
+        self.column_header_template_obj = None
+        self._url_params_cache = {}
+        self._column_headers = None
+        self.streaming = False
+        self.exporting = False
+        self.timings = SortedDict()
+        self.json_column_ids = None
+
+        if not hasattr(request, "datagrid_count"):
+            request.datagrid_count = 0
+
+        self.id = "datagrid-%s" % request.datagrid_count
+        request.datagrid_count += 1
+
+        # Marks where the rows go in the rendered grid when streaming.
+        self.rows_placeholder = mark_safe('<!-- %s-rows -->' % self.id)
+
+        # Customizable variables
+        self.title = title
+        self.profile_sort_field = None
+        self.profile_columns_field = None
+        self.profile_filters_field = None
+        self.defer_profile_saves = False
+        self.profile_save_window = 30
+        self.paginate_by = 50
+        self.paginate_orphans = 3
+        self.count_strategy = self.COUNT_EXACT
+        self.count_generation_key = None
+        self.count_cache_expiration = getattr(settings,
+                                              'CACHE_EXPIRATION_TIME',
+                                              DEFAULT_EXPIRATION_TIME)
+        self.concurrent_count = False
+        self.concurrent_count_timeout = 10
+        self.count_queries = False
+        self.log_timings = False
+        self.use_server_timing = False
+        self.use_keyset_pagination = False
+        self.required_fields = []
+        self.row_cache_version_field = None
+        self.row_cache_expiration = self.count_cache_expiration
+        self.row_cache_hits = 0
+        self.row_cache_misses = 0
+        self.use_header_cache = False
+        self.header_cache_expiration = self.count_cache_expiration
+        self.listview_template = 'datagrid/listview.html'
+        self.column_header_template = 'datagrid/column_header.html'
+        self.cell_template = self.DEFAULT_CELL_TEMPLATE
+        self.stream_chunk_size = 50
+        self.export_chunk_size = 500
+
+        self._populate_columns()
+
+        # The column definitions are shared by all instances of this grid.
+        # They'll be bound to this grid as they're needed.
+        self.db_field_map = dict(self._db_field_map)
+
+    @classmethod
+    def _populate_columns(cls):
+        """
+        Builds the registry of columns defined on this class.
+
+        This is done once per DataGrid subclass, the first time it's
+        instantiated, rather than scanning the class's attributes every
+        time a grid is constructed. Columns must therefore be defined on
+        the class itself.
+        """
+        if '_column_map' in cls.__dict__:
+            return
+
+        all_columns = []
+        column_map = {}
+        db_field_map = {}
+
+        for attr in dir(cls):
+            column = getattr(cls, attr)
+
+            if isinstance(column, Column):
+                column.id = attr
+
+                if not column.field_name:
+                    column.field_name = column.id
+
+                if not column.db_field:
+                    column.db_field = column.field_name
+
+                all_columns.append(column)
+                column_map[column.id] = column
+                db_field_map[column.id] = column.db_field
+
+        all_columns.sort(key=lambda x: x.label)
+
+        cls._all_columns = all_columns
+        cls._db_field_map = db_field_map
+        cls._column_map = column_map
+
+    def get_column(self, column_id):
+        """
+        Returns the column with the given ID, or None if there isn't one.
+
+        The column will be bound to this grid.
+        """
+        try:
+            return self._bound_columns[column_id]
+        except KeyError:
+            column = self._column_map.get(column_id, None)
+
+            if column is not None:
+                column = column.bind(self)
+                self._bound_columns[column_id] = column
+
+            return column
+
+    def get_all_columns(self):
+        """
+        Returns all columns in the grid, sorted by label.
+
+        The columns will be bound to this grid.
+        """
+        return [self.get_column(column.id) for column in self._all_columns]
+    all_columns = property(get_all_columns)
+
+    def load_state(self):
+        """
+        Loads the state of the datagrid.
+
+        This will retrieve the user-specified or previously stored
+        sorting order, columns list and filters, as well as any state a
+        subclass may need.
+
+        Filters are specified by passing 'filter-<column id>' URL
+        parameters for columns with a filter_type. If any are passed, they
+        replace the stored filters. An empty value removes the filter.
+        """
+        if self.state_loaded:
+            return
+
+        phase = self._start_phase('state')
+        profile_sort_list = None
+        profile_columns_list = None
+        profile_filters_str = None
+        profile = None
+        profile_dirty = False
+
+        # Get the saved settings for this grid in the profile. These will
+        # work as defaults and allow us to determine if we need to save
+        # the profile.
+        if self.request.user.is_authenticated():
+            try:
+                profile = self.request.user.get_profile()
+
+                if self.profile_sort_field:
+                    profile_sort_list = \
+                        getattr(profile, self.profile_sort_field, None)
+
+                if self.profile_columns_field:
+                    profile_columns_list = \
+                        getattr(profile, self.profile_columns_field, None)
+
+                if self.profile_filters_field:
+                    profile_filters_str = \
+                        getattr(profile, self.profile_filters_field, None)
+            except SiteProfileNotAvailable:
+                pass
+            except ObjectDoesNotExist:
+                pass
+
+        # Changes that haven't been written to the profile yet take
+        # precedence over what's stored there.
+        deferred_state = {}
+
+        if profile and self.defer_profile_saves:
+            deferred_state = cache.get(
+                _get_deferred_profile_state_key(profile)) or {}
+
+            if self.profile_sort_field in deferred_state:
+                profile_sort_list = deferred_state[self.profile_sort_field]
+
+            if self.profile_columns_field in deferred_state:
+                profile_columns_list = \
+                    deferred_state[self.profile_columns_field]
+
+            if self.profile_filters_field in deferred_state:
+                profile_filters_str = \
+                    deferred_state[self.profile_filters_field]
+
+        # Figure out the columns we're going to display
+        # We're also going to calculate the column widths based on the
+        # shrink and expand values.
+        colnames_str = self.request.GET.get('columns', profile_columns_list)
+
+        if colnames_str:
+            colnames = colnames_str.split(',')
+        else:
+            colnames = self.default_columns
+            colnames_str = ",".join(colnames)
+
+        expand_columns = []
+        normal_columns = []
+
+        for colname in colnames:
+            column = self.get_column(colname)
+
+            if not column:
+                # The user specified a column that doesn't exist. Skip it.
+                continue
+
+            self.columns.append(column)
+            column.active = True
+
+            if column.expand:
+                # This column is requesting all remaining space. Save it for
+                # later so we can tell how much to give it. Each expanded
+                # column will count as two normal columns when calculating
+                # the normal sized columns.
+                expand_columns.append(column)
+            elif column.shrink:
+                # Make this as small as possible.
+                column.width = 0
+            else:
+                # We'll divide the column widths equally after we've built
+                # up the lists of expanded and normal sized columns.
+                normal_columns.append(column)
+
+        self.columns[-1].last = True
+
+        # Try to figure out the column widths for each column.
+        # We'll start with the normal sized columns.
+        total_pct = 100
+
+        # Each expanded column counts as two normal columns.
+        normal_column_width = total_pct / (len(self.columns) +
+                                           len(expand_columns))
+
+        for column in normal_columns:
+            column.width = normal_column_width
+            total_pct -= normal_column_width
 
         if len(expand_columns) > 0:
             expanded_column_width = total_pct / len(expand_columns)
         else:
-            expanded_column_width = 0
+            expanded_column_width = 0
+
+        for column in expand_columns:
+            column.width = expanded_column_width
+
+
+        # Now get the sorting order for the columns.
+        sort_str = self.request.GET.get('sort', profile_sort_list)
+
+        if sort_str:
+            self.sort_list = sort_str.split(',')
+        else:
+            self.sort_list = self.default_sort
+            sort_str = ",".join(self.sort_list)
+
+
+        # And the filters.
+        prefix_len = len(self.FILTER_URL_PARAM_PREFIX)
+        filter_params = [
+            (key[prefix_len:], value)
+            for key, value in self.request.GET.iteritems()
+            if key.startswith(self.FILTER_URL_PARAM_PREFIX)
+        ]
+
+        if not filter_params:
+            filter_params = QueryDict(profile_filters_str or '').items()
+
+        for column_id, value in filter_params:
+            column = self.get_column(column_id)
+
+            if value and column and column.filter_type:
+                # Invalid values are dropped here, so that they're neither
+                # applied nor saved to the profile.
+                try:
+                    value = column.clean_filter_value(value)
+                except ValueError, e:
+                    logging.debug('Ignoring invalid filter "%s" for column '
+                                  '"%s" in datagrid %r: %s',
+                                  value, column_id, self.__class__, e)
+                    continue
+
+                column.filter_value = value
+                self.filters[column_id] = value
+
+        filters_str = urlencode(sorted(self.filters.items()))
+
+
+        # A subclass might have some work to do for loading and saving
+        # as well.
+        if self.load_extra_state(profile):
+            profile_dirty = True
+
+        self._end_phase(phase)
+
+
+        # Now that we have all that, figure out if we need to save new
+        # settings back to the profile. Exports only read the settings,
+        # since they're downloads rather than views of the grid.
+        if profile and not self.exporting:
+            phase = self._start_phase('profile_save')
+            changed_fields = {}
+
+            if self.profile_columns_field and \
+               colnames_str != profile_columns_list:
+                changed_fields[self.profile_columns_field] = colnames_str
+
+            if self.profile_sort_field and sort_str != profile_sort_list:
+                changed_fields[self.profile_sort_field] = sort_str
+
+            if self.profile_filters_field and \
+               filters_str != (profile_filters_str or ''):
+                changed_fields[self.profile_filters_field] = filters_str
+
+            deferred_state.update(changed_fields)
+
+            for field, value in deferred_state.iteritems():
+                setattr(profile, field, value)
+
+            if profile_dirty or (changed_fields and
+                                 not self.defer_profile_saves):
+                profile.save()
+
+                if self.defer_profile_saves:
+                    # Everything deferred has now been saved.
+                    cache.delete(_get_deferred_profile_state_key(profile))
+            elif deferred_state:
+                self.defer_profile_save(profile, deferred_state)
+
+            self._end_phase(phase)
+
+        self.state_loaded = True
+
+        # Fetch the list of objects and have it ready. Exports fetch all
+        # the objects themselves, rather than a page. JSON requests that
+        # only remove or reorder columns don't need the objects at all.
+        if not self.exporting and self.json_column_ids != []:
+            self.precompute_objects()
+
+
+    def defer_profile_save(self, profile, fields):
+        """
+        Schedules fields to be written to a profile after the response.
+
+        The fields replace any earlier deferred changes to the profile, and
+        are written by flush_deferred_profile_saves(). Until then, they're
+        stored in the cache, so that other requests will see them. They're
+        kept there until they're written, rather than expiring.
+        """
+        key = _get_deferred_profile_state_key(profile)
+        cache.set(key, fields, getattr(settings, 'CACHE_EXPIRATION_TIME',
+                                       DEFAULT_EXPIRATION_TIME))
+
+        _deferred_profile_saves_lock.acquire()
+
+        try:
+            _deferred_profile_saves[key] = (profile.__class__, profile.pk,
+                                            self.profile_save_window,
+                                            fields, 0)
+        finally:
+            _deferred_profile_saves_lock.release()
+
+    def load_extra_state(self, profile):
+        """
+        Loads any extra state needed for this grid.
+
+        This is used by subclasses that may have additional data to load
+        and save. This should return True if any profile-stored state has
+        changed, or False otherwise.
+        """
+        return False
+
+    def filter_queryset(self, queryset):
+        """
+        Returns a queryset filtered by the grid's column filters.
+
+        Filters that fail to apply, such as those on a column whose
+        db_field doesn't exist, are ignored and removed.
+        """
+        for column_id, value in sorted(self.filters.iteritems()):
+            column = self.get_column(column_id)
+
+            try:
+                queryset = column.filter_queryset(queryset, value)
+            except (FieldError, ValueError, TypeError, ValidationError), e:
+                logging.debug('Ignoring invalid filter "%s" for column "%s" '
+                              'in datagrid %r: %s',
+                              value, column_id, self.__class__, e)
+                column.filter_value = None
+                del self.filters[column_id]
+
+        return queryset
+
+    def get_sorted_queryset(self):
+        """
+        Returns the grid's queryset, filtered and ordered by the current
+        filters and sort.
+
+        This returns a tuple of the queryset, the list of database fields
+        it's sorted by, and the active sort columns whose fields span
+        tables.
+        """
+        query = self.filter_queryset(self.queryset)
+        related_sort_columns = []
+
+        # Generate the actual list of fields we'll be sorting by
+        sort_list = []
+        for sort_item in self.sort_list:
+            if sort_item[0] == "-":
+                base_sort_item = sort_item[1:]
+                prefix = "-"
+            else:
+                base_sort_item = sort_item
+                prefix = ""
+
+            if sort_item and base_sort_item in self.db_field_map:
+                db_field = self.db_field_map[base_sort_item]
+                sort_list.append(prefix + db_field)
+
+                # Lookups spanning tables require that we query from those
+                # tables. Unless the column tells us which relations to
+                # use, we'll just use select_related so that we don't have
+                # to figure out the table relationships. We only do this if
+                # we have a lookup spanning tables.
+                if '.' in db_field:
+                    related_sort_columns.append(
+                        self.get_column(base_sort_item))
+
+        if sort_list:
+            query = query.order_by(*sort_list)
+
+        return query, sort_list, related_sort_columns
+
+    def precompute_objects(self):
+        """
+        Builds the queryset and stores the list of objects for use in
+        rendering the datagrid.
+        """
+        query, sort_list, related_sort_columns = self.get_sorted_queryset()
+
+        self.query_plan = self.plan_query(query, sort_list)
+
+        if self.query_plan['distinct']:
+            query = query.distinct()
+
+        self.id_list = []
+        count_task = None
+
+        if self.query_plan['pagination'] == 'keyset':
+            with self.timed_phase('page'):
+                self.page = self.get_keyset_page(query, sort_list)
+
+            object_list = self.page.object_list
+        elif self.query_plan['pagination'] == 'uncounted':
+            with self.timed_phase('page'):
+                self.page = self.get_uncounted_page(query)
+
+            object_list = self.page.object_list
+        else:
+            self.paginator = DataGridPaginator(query,
+                                               self.paginate_by,
+                                               self.paginate_orphans,
+                                               count_func=self.get_hit_count)
+
+            page_num = self.request.GET.get('page', 1)
+
+            # Accept either "last" or a valid page number.
+            if page_num == "last":
+                with self.timed_phase('count'):
+                    page_num = self.paginator.num_pages
+            elif (self.concurrent_count and
+                  self.count_strategy in (self.COUNT_EXACT,
+                                          self.COUNT_CACHED)):
+                # Count the results on another connection while we fetch
+                # the page. Since we don't know the count yet, we'll fetch
+                # enough objects for the page and any orphans, and trim the
+                # list once we know how many belong on the page. If the
+                # pool is busy, we'll count here first, as usual.
+                try:
+                    page_num = int(page_num)
+                except (TypeError, ValueError):
+                    raise Http404
+
+                if page_num < 1:
+                    raise Http404
+
+                count_task = get_query_thread_pool().submit(
+                    self._get_concurrent_count, query)
+                start = (page_num - 1) * self.paginate_by
+                end = start + self.paginate_by + self.paginate_orphans
+
+            if count_task is None:
+                try:
+                    with self.timed_phase('count'):
+                        self.page = self.paginator.page(page_num)
+                except InvalidPage:
+                    raise Http404
+
+                if self.paginator.count_is_estimate:
+                    # The estimate may be well off, so as with uncounted
+                    # pages, we fetch one more row than is shown to find out
+                    # if there's really a next page.
+                    start = (self.page.number - 1) * self.paginate_by
+                    end = start + self.paginate_by + 1
+                else:
+                    start = max(self.page.start_index() - 1, 0)
+                    end = self.page.end_index()
+
+            if self.query_plan['two_phase']:
+                # This can be slow when sorting across tables or when the
+                # results must be distinct. In that case, we'll request just
+                # the IDs and then fetch the actual details from that.
+                with self.timed_phase('ids'):
+                    self.id_list = list(query[start:end].values_list(
+                        'pk', flat=True))
+
+                # Make sure to unset the order. We can't meaningfully order
+                # these results in the query, as what we really want is to
+                # keep it in the order specified in id_list, and we certainly
+                # don't want the database to do any special ordering
+                # (possibly slowing things down). We'll set the order
+                # properly in a minute.
+                object_list = self.post_process_queryset(
+                    self.queryset.model.objects.filter(
+                        pk__in=self.id_list).order_by())
+            elif self.optimize_sorts and sort_list:
+                # The sort is cheap enough to do in a single query, but the
+                # columns still need a chance to augment the queryset.
+                object_list = self.post_process_queryset(query)[start:end]
+            else:
+                object_list = query[start:end]
 
-        for column in expand_columns:
-            column.width = expanded_column_width
+        object_list = self.apply_column_projection(object_list,
+                                                   related_sort_columns)
 
+        if count_task is None:
+            self.page.object_list = object_list
 
-        # Now get the sorting order for the columns.
-        sort_str = self.request.GET.get('sort', profile_sort_list)
+        phase = self._start_phase('objects')
+
+        if self.id_list:
+            # The database will give us the items in a more or less random
+            # order, since it doesn't know to keep it in the order provided by
+            # the ID list. This will place the results back in the order we
+            # expect.
+            index = dict([(id, pos) for (pos, id) in enumerate(self.id_list)])
+            queryset = object_list
+            object_list = [None] * len(self.id_list)
+
+            for obj in list(queryset):
+                object_list[index[obj.pk]] = obj
+        else:
+            # Grab the whole list at once. We know it won't be too large,
+            # and it will prevent one query per row.
+            object_list = list(object_list)
+
+        self._end_phase(phase)
+
+        if count_task is not None:
+            # Now that the page has been fetched, wait for the count, and
+            # build the real page from that.
+            with self.timed_phase('count'):
+                try:
+                    count = count_task.wait(self.concurrent_count_timeout)
+                except QueryTimeoutError:
+                    logging.warning('Timed out waiting for the concurrent '
+                                    'count in datagrid %r. Counting in the '
+                                    'request thread instead.',
+                                    self.__class__)
+                    count = self._get_concurrent_count(query)
+                except DatabaseError, e:
+                    logging.warning('The concurrent count in datagrid %r '
+                                    'failed: %s. Counting in the request '
+                                    'thread instead.',
+                                    self.__class__, e)
+                    count = self._get_concurrent_count(query)
+
+                self.paginator.set_count(*count)
+
+            try:
+                self.page = self.paginator.page(page_num)
+            except InvalidPage:
+                raise Http404
+
+            num_objects = max(self.page.end_index() - start, 0)
+            object_list = object_list[:num_objects]
+            self.id_list = self.id_list[:num_objects]
+            self.page.object_list = object_list
+        elif self.paginator and self.paginator.count_is_estimate:
+            has_next = len(object_list) > self.paginate_by
+            object_list = object_list[:self.paginate_by]
+            self.id_list = self.id_list[:self.paginate_by]
+            self.page = UncountedPage(object_list, self.page.number,
+                                      self.paginate_by, len(object_list),
+                                      has_next)
+
+        self.page_objects = [obj for obj in object_list if obj is not None]
+
+        if self.json_column_ids is not None:
+            # Only some of the columns will be rendered.
+            self.rows = []
+        elif self.streaming:
+            # The rows will be rendered a chunk at a time as they're sent,
+            # unless the template asks for all of them.
+            self.rows = None
+        else:
+            self.rows = self.render_rows(self.page_objects)
+
+    def _get_rows(self):
+        if self._rows is None:
+            self._rows = self.render_rows(self.page_objects)
+
+        return self._rows
+
+    def _set_rows(self, rows):
+        self._rows = rows
+    rows = property(_get_rows, _set_rows)
+
+    def render_rows(self, object_list):
+        """
+        Renders the cells for each object and returns the list of rows.
+
+        If a row cache version is available for an object (see
+        get_row_cache_version()), the rendered cells for cacheable columns
+        are stored in the cache, and reused until the object's version
+        changes. Rows found in the cache skip rendering entirely, aside from
+        any columns that aren't cacheable.
+        """
+        phase = self._start_phase('render_rows')
+        cacheable_columns = [column for column in self.columns
+                             if column.cacheable]
+        row_cache_keys = {}
+        cached_rows = {}
+
+        if cacheable_columns:
+            for obj in object_list:
+                version = self.get_row_cache_version(obj)
+
+                if version is not None:
+                    row_cache_keys[obj.pk] = \
+                        self.get_row_cache_key(obj, version)
+
+        if row_cache_keys:
+            cached_by_key = cache.get_many(row_cache_keys.values())
+
+            for pk, key in row_cache_keys.iteritems():
+                if key in cached_by_key:
+                    cached_rows[pk] = cached_by_key[key]
+
+            self.row_cache_hits += len(cached_rows)
+            self.row_cache_misses += len(row_cache_keys) - len(cached_rows)
+
+        # Give the columns a chance to fetch any data they need for all
+        # the objects at once, rather than once per row. Cacheable columns
+        # only need this for the rows that weren't in the cache.
+        uncached_objects = [obj for obj in object_list
+                            if obj.pk not in cached_rows]
+
+        for column in self.columns:
+            if column.cacheable:
+                objects = uncached_objects
+            else:
+                objects = object_list
+
+            if objects:
+                column.prefetch(objects)
+
+        rows = []
+        new_cached_rows = {}
+
+        for obj in object_list:
+            cached_cells = cached_rows.get(obj.pk, {})
+            new_cells = {}
+            cells = []
+
+            for column in self.columns:
+                if column.id in cached_cells:
+                    cell = mark_safe(cached_cells[column.id])
+                else:
+                    cell = column.render_cell(obj)
+
+                    if column.cacheable:
+                        new_cells[column.id] = unicode(cell)
+
+                cells.append(cell)
+
+            if new_cells and obj.pk in row_cache_keys:
+                new_cells.update(cached_cells)
+                new_cached_rows[row_cache_keys[obj.pk]] = new_cells
+
+            rows.append({
+                'object': obj,
+                'cells': cells,
+            })
+
+        if new_cached_rows:
+            cache.set_many(new_cached_rows, self.row_cache_expiration)
+
+        self._end_phase(phase)
+
+        return rows
+
+    def get_row_cache_version(self, obj):
+        """
+        Returns the version of an object used for caching its rendered row.
+
+        By default, this returns the value of the field named by
+        row_cache_version_field, such as a modification timestamp. If that
+        isn't set, or this returns None, the row won't be cached.
+
+        Subclasses can override this to compute a version some other way.
+        """
+        if self.row_cache_version_field:
+            return getattr(obj, self.row_cache_version_field, None)
+
+        return None
+
+    def get_row_cache_key(self, obj, version):
+        """
+        Returns the cache key for an object's rendered row.
+
+        The key is based on the grid class, the active columns, the current
+        language, and the object's ID and version. Subclasses whose cells
+        depend on anything else, such as the user viewing the grid, must
+        override this to include it in the key.
+
+        The variable parts of the key are hashed, since versions such as
+        timestamps or non-ASCII strings can't be used in cache keys as-is.
+        """
+        key = u'\x00'.join([
+            u','.join([column.id for column in self.columns]),
+            force_unicode(get_language()),
+            force_unicode(obj.pk),
+            force_unicode(version),
+        ])
+
+        return make_cache_key('datagrid-row:%s.%s:%s' % (
+            self.__class__.__module__, self.__class__.__name__,
+            new_md5(key.encode('utf-8')).hexdigest()))
+
+    def plan_query(self, query, sort_list):
+        """
+        Decides how the objects for the grid should be queried.
+
+        This returns a dictionary describing the plan, which is also
+        available as the grid's query_plan attribute for debugging. It
+        contains:
+
+            * 'pagination':        'keyset', 'uncounted' or 'offset'.
+            * 'distinct':          Whether DISTINCT must be applied. This is
+                                   only needed when the queryset or the sort
+                                   fields join tables that may match more
+                                   than one row per object.
+            * 'related_sort':      Whether any sort fields span tables.
+            * 'multivalued_joins': Whether the queryset or sort fields
+                                   introduce joins that may match more than
+                                   one row per object.
+            * 'two_phase':         Whether the IDs for the page are fetched
+                                   first, followed by the objects. This is
+                                   done when sorting across tables or when
+                                   DISTINCT is needed, as long as
+                                   optimize_sorts is set. Otherwise, the
+                                   objects are fetched in a single query.
+        """
+        multivalued_joins = self._has_multivalued_joins(query)
+        related_sort = False
+
+        for sort_item in sort_list:
+            field = sort_item.lstrip('-')
+
+            if '.' in field:
+                # This is a raw table.column reference. We don't know how
+                # that table was joined, so we have to assume the worst.
+                related_sort = True
+                multivalued_joins = True
+            else:
+                spans_tables, multivalued = \
+                    self._inspect_lookup(query.model, field)
+                related_sort = related_sort or spans_tables
+                multivalued_joins = multivalued_joins or multivalued
+
+        # Seeking only works if each object appears once in the results,
+        # and every sort value can be compared.
+        if (self.use_keyset_pagination and not multivalued_joins and
+            self._can_seek(query.model, sort_list)):
+            pagination = 'keyset'
+        elif (self.count_strategy == self.COUNT_NONE or
+              self.json_column_ids):
+            # Fetching the cells of added columns doesn't need the count.
+            pagination = 'uncounted'
+        else:
+            pagination = 'offset'
+
+        return {
+            'pagination': pagination,
+            'distinct': multivalued_joins,
+            'related_sort': related_sort,
+            'multivalued_joins': multivalued_joins,
+            'two_phase': (pagination != 'offset' or
+                          bool(self.optimize_sorts and sort_list and
+                               (related_sort or multivalued_joins))),
+        }
+
+    def _has_multivalued_joins(self, query):
+        """
+        Returns whether a queryset may contain more than one row per object.
+
+        This is the case if the queryset is already distinct, uses extra
+        tables, or joins a table on anything other than its primary key
+        (such as through a reverse ForeignKey or a ManyToManyField).
+        """
+        sql_query = query.query
+
+        if sql_query.distinct or sql_query.extra_tables:
+            return True
+
+        for join in sql_query.alias_map.itervalues():
+            if join[LHS_ALIAS] is None:
+                # This is the base table.
+                continue
+
+            if join[RHS_JOIN_COL] != _get_table_pk_column(join[TABLE_NAME]):
+                return True
+
+        return False
+
+    def _inspect_lookup(self, model, lookup):
+        """
+        Inspects a field lookup used for sorting.
+
+        This returns a tuple of (spans_tables, multivalued), indicating
+        whether the lookup follows any relations, and whether any of them
+        may match more than one row per object. Lookups that can't be
+        resolved (such as names from extra()) are assumed to be local.
+        """
+        opts = model._meta
+        spans_tables = False
+
+        for part in lookup.split('__'):
+            if part == 'pk':
+                break
+
+            try:
+                field, field_model, direct, m2m = opts.get_field_by_name(part)
+            except FieldDoesNotExist:
+                break
+
+            if m2m or not direct:
+                return True, True
+
+            if not field.rel:
+                break
+
+            spans_tables = True
+            opts = field.rel.to._meta
+
+        return spans_tables, False
+
+    def apply_column_projection(self, queryset, related_sort_columns=[]):
+        """
+        Limits the fields and relations fetched to what the columns need.
+
+        The relations declared by the active columns (and any sort columns
+        that span tables) are passed to select_related(). If a column
+        sorting across tables doesn't declare its relations, every relation
+        will be joined instead.
+
+        If every active column declares its required fields, only those
+        fields (along with the grid's own required_fields and the
+        row_cache_version_field) will be fetched.
+        """
+        relations = set()
+        join_all_relations = False
+
+        for column in self.columns:
+            if column.required_relations:
+                relations.update(column.required_relations)
+
+        for column in related_sort_columns:
+            if column.required_relations is None:
+                join_all_relations = True
+            else:
+                relations.update(column.required_relations)
+
+        if join_all_relations:
+            # We don't know which relations are used, so we can't safely
+            # restrict the fields fetched either.
+            return queryset.select_related(depth=1)
+
+        if relations:
+            queryset = queryset.select_related(*relations)
+
+        fields = set(self.required_fields)
+
+        for column in self.columns:
+            if column.required_fields is None:
+                return queryset
+
+            fields.update(column.required_fields)
+
+        # The relations followed by select_related() must be fetched as well.
+        fields.update([relation.split('__')[0] for relation in relations])
+
+        # So must the field used to version cached rows, since it's checked
+        # for every row.
+        if self.row_cache_version_field:
+            fields.add(self.row_cache_version_field)
+
+        return queryset.only(*fields)
+
+    def get_keyset_page(self, query, sort_list):
+        """
+        Returns a KeysetPage for the current request.
+
+        Rather than counting and skipping rows with an OFFSET, this seeks
+        directly to the rows following (or preceding) the sort values
+        stored in the 'after' (or 'before') cursor, using the sort fields
+        and the primary key. The cost of fetching a page is then the same
+        no matter how deep into the results it is.
+
+        A page value of "last" is handled by reversing the sort order.
+        """
+        fields, descending, pk_index = self._get_keyset_fields(sort_list)
+        order = [
+            '%s%s' % (desc and '-' or '', field)
+            for field, desc in zip(fields, descending)
+        ]
+
+        after = self.request.GET.get('after', None)
+        before = self.request.GET.get('before', None)
+        reverse = bool(before) or (not after and
+                                   self.request.GET.get('page') == 'last')
+        cursor_values = None
+
+        if after or before:
+            cursor_values = self._decode_keyset_cursor(after or before,
+                                                       order)
+
+            if cursor_values is None:
+                # The sort order has changed since the cursor was made, so
+                # start from the beginning.
+                after = before = None
+                reverse = False
+
+        if reverse:
+            descending = [not desc for desc in descending]
+
+        query = query.order_by(*[
+            '%s%s' % (desc and '-' or '', field)
+            for field, desc in zip(fields, descending)
+        ])
+
+        if cursor_values is not None:
+            query = query.filter(self._build_keyset_q(fields, descending,
+                                                      cursor_values))
+
+        rows = list(query.values_list(*fields)
+                    [:self.paginate_by + 1])
+        has_more = len(rows) > self.paginate_by
+        rows = rows[:self.paginate_by]
+
+        if reverse:
+            rows.reverse()
+            has_next = bool(before)
+            has_previous = has_more
+        else:
+            has_next = has_more
+            has_previous = bool(after)
+
+        next_cursor = None
+        previous_cursor = None
+
+        if rows:
+            if has_next:
+                next_cursor = self._encode_keyset_cursor(order, rows[-1])
+
+            if has_previous:
+                previous_cursor = self._encode_keyset_cursor(order, rows[0])
+
+        self.id_list = [row[pk_index] for row in rows]
+
+        return KeysetPage(self._get_object_list_for_ids(), next_cursor,
+                          previous_cursor)
+
+    def get_uncounted_page(self, query):
+        """
+        Returns an UncountedPage for the current request.
+
+        This fetches the IDs for one more row than will be shown, in order
+        to find out if there's a next page without having to count all the
+        results.
+        """
+        page_num = self.request.GET.get('page', 1)
+
+        try:
+            page_num = int(page_num)
+        except (TypeError, ValueError):
+            if page_num != 'last':
+                raise Http404
+
+            # We have no idea where the last page is without counting, so
+            # we do it the slow way. Uncounted pages don't fold orphans into
+            # the previous page, so neither can this.
+            page_num = max(1, (query.count() - 1) / self.paginate_by + 1)
+
+        if page_num < 1:
+            raise Http404
+
+        start = (page_num - 1) * self.paginate_by
+        id_list = list(query.values_list('pk', flat=True)
+                       [start:start + self.paginate_by + 1])
+
+        if not id_list and page_num > 1:
+            raise Http404
+
+        self.id_list = id_list[:self.paginate_by]
+
+        return UncountedPage(self._get_object_list_for_ids(), page_num,
+                             self.paginate_by, len(self.id_list),
+                             len(id_list) > self.paginate_by)
+
+    def get_hit_count(self, queryset):
+        """
+        Returns the number of hits for the queryset based on count_strategy.
+
+        This returns a tuple of (count, is_estimate). If the count is None,
+        the paginator will perform an exact count.
+        """
+        if self.count_strategy == self.COUNT_CACHED:
+            return self._get_cached_count(queryset), False
+        elif self.count_strategy == self.COUNT_ESTIMATED:
+            count = self._get_estimated_count(queryset)
+
+            return count, count is not None
+
+        return None, False
+
+    def _get_concurrent_count(self, queryset):
+        """
+        Returns the hit count and whether it's an estimate, performing an
+        exact count if the count strategy doesn't provide one.
+
+        This is called from the query thread pool when using
+        concurrent_count.
+        """
+        count, is_estimate = self.get_hit_count(queryset)
+
+        if count is None:
+            count = queryset.count()
+
+        return count, is_estimate
+
+    def _get_cached_count(self, queryset):
+        """
+        Returns the exact count for a queryset, caching it in the cache.
+
+        The count is stored under the current count generation, so that
+        calling invalidate_cached_counts() will force a new count.
+        """
+        try:
+            sql = unicode(queryset.query)
+        except EmptyResultSet:
+            return 0
+
+        generation_key = (self.count_generation_key or
+                          get_count_generation_key(queryset.model))
+        generation_cache_key = make_cache_key(generation_key)
+        generation = cache.get(generation_cache_key)
+
+        if generation is None:
+            generation = int(time.time())
+            cache.add(generation_cache_key, generation,
+                      self.count_cache_expiration)
+
+        key = make_cache_key('datagrid-count:%s:%s:%s' % (
+            generation_key, generation,
+            new_md5(sql.encode('utf-8')).hexdigest()))
+        count = cache.get(key)
+
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_cache_expiration)
+
+        return count
+
+    def _get_estimated_count(self, queryset):
+        """
+        Returns the database planner's estimate of the number of results.
+
+        This is supported on PostgreSQL and MySQL. On other databases, this
+        returns None, and an exact count will be used instead.
+        """
+        connection = connections[queryset.db]
+
+        if connection.vendor not in ('postgresql', 'mysql'):
+            return None
+
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN %s' % sql, params)
+
+        if connection.vendor == 'postgresql':
+            m = re.search(r'rows=(\d+)', cursor.fetchone()[0])
+
+            if m:
+                return int(m.group(1))
+        else:
+            columns = [column[0] for column in cursor.description]
+            row = cursor.fetchone()
+
+            if row and 'rows' in columns:
+                return int(row[columns.index('rows')])
+
+        return None
+
+    def _get_object_list_for_ids(self):
+        """
+        Returns a queryset for the objects in id_list.
+
+        The queryset is unordered. The results are put back into the order
+        of id_list by precompute_objects.
+        """
+        if self.optimize_sorts:
+            return self.post_process_queryset(
+                self.queryset.model.objects.filter(
+                    pk__in=self.id_list).order_by())
+        else:
+            return self.queryset.filter(pk__in=self.id_list).order_by()
+
+    def _get_keyset_fields(self, sort_list):
+        """
+        Returns the fields to seek on for a sort order.
+
+        This returns a tuple of (fields, descending, pk_index). The primary
+        key is always used as the final tie-breaker, so that every row has a
+        unique position in the results.
+        """
+        fields = [sort_item.lstrip('-') for sort_item in sort_list]
+        descending = [sort_item.startswith('-') for sort_item in sort_list]
 
-        if sort_str:
-            self.sort_list = sort_str.split(',')
+        if 'pk' in fields:
+            pk_index = fields.index('pk')
         else:
-            self.sort_list = self.default_sort
-            sort_str = ",".join(self.sort_list)
+            pk_index = len(fields)
+            fields.append('pk')
+            descending.append(bool(descending) and descending[-1])
 
+        return fields, descending, pk_index
 
-        # A subclass might have some work to do for loading and saving
-        # as well.
-        if self.load_extra_state(profile):
-            profile_dirty = True
+    def _can_seek(self, model, sort_list):
+        """
+        Returns whether rows can be seeked to using the sort fields.
 
+        This requires that every sort field be a non-NULL field on the
+        model or a model it references, since rows with NULL values can't
+        be compared. Sorting on a relation itself isn't supported either,
+        since that sorts by the related model's ordering rather than by
+        the value being compared.
+        """
+        for sort_item in sort_list:
+            opts = model._meta
+            field = None
 
-        # Now that we have all that, figure out if we need to save new
-        # settings back to the profile.
-        if profile:
-            if self.profile_columns_field and \
-               colnames_str != profile_columns_list:
-                setattr(profile, self.profile_columns_field, colnames_str)
-                profile_dirty = True
+            for part in sort_item.lstrip('-').split('__'):
+                if part == 'pk':
+                    field = None
+                    break
 
-            if self.profile_sort_field and sort_str != profile_sort_list:
-                setattr(profile, self.profile_sort_field, sort_str)
-                profile_dirty = True
+                try:
+                    field, field_model, direct, m2m = \
+                        opts.get_field_by_name(part)
+                except FieldDoesNotExist:
+                    return False
 
-            if profile_dirty:
-                profile.save()
+                if m2m or not direct or field.null:
+                    return False
 
-        self.state_loaded = True
+                if field.rel:
+                    opts = field.rel.to._meta
 
-        # Fetch the list of objects and have it ready.
-        self.precompute_objects()
+            if field is not None and field.rel:
+                return False
 
+        return True
 
-    def load_extra_state(self, profile):
+    def _build_keyset_q(self, fields, descending, values):
         """
-        Loads any extra state needed for this grid.
+        Builds a Q object matching all rows that sort after the given values.
 
-        This is used by subclasses that may have additional data to load
-        and save. This should return True if any profile-stored state has
-        changed, or False otherwise.
-        """
-        return False
+        For fields (a, b, pk), this results in:
 
-    def precompute_objects(self):
-        """
-        Builds the queryset and stores the list of objects for use in
-        rendering the datagrid.
+            a > A OR (a = A AND b > B) OR (a = A AND b = B AND pk > PK)
+
+        with the comparisons flipped for descending fields.
         """
-        query = self.queryset
-        use_select_related = False
+        q = None
 
-        # Generate the actual list of fields we'll be sorting by
-        sort_list = []
-        for sort_item in self.sort_list:
-            if sort_item[0] == "-":
-                base_sort_item = sort_item[1:]
-                prefix = "-"
+        for i, field in enumerate(fields):
+            if descending[i]:
+                lookup = '%s__lt' % field
             else:
-                base_sort_item = sort_item
-                prefix = ""
-
-            if sort_item and base_sort_item in self.db_field_map:
-                db_field = self.db_field_map[base_sort_item]
-                sort_list.append(prefix + db_field)
+                lookup = '%s__gt' % field
 
-                # Lookups spanning tables require that we query from those
-                # tables. In order to keep things simple, we'll just use
-                # select_related so that we don't have to figure out the
-                # table relationships. We only do this if we have a lookup
-                # spanning tables.
-                if '.' in db_field:
-                    use_select_related = True
+            clause = Q(**{lookup: values[i]})
 
-        if sort_list:
-            query = query.order_by(*sort_list)
+            for j in range(i):
+                clause &= Q(**{fields[j]: values[j]})
 
-        self.paginator = QuerySetPaginator(query.distinct(), self.paginate_by,
-                                           self.paginate_orphans)
+            if q is None:
+                q = clause
+            else:
+                q |= clause
 
-        page_num = self.request.GET.get('page', 1)
+        return q
 
-        # Accept either "last" or a valid page number.
-        if page_num == "last":
-            page_num = self.paginator.num_pages
+    def _encode_keyset_cursor(self, order, values):
+        """
+        Encodes a row's sort values into an opaque, signed cursor.
+        """
+        encoded_values = []
 
-        try:
-            self.page = self.paginator.page(page_num)
-        except InvalidPage:
-            raise Http404
+        for value in values:
+            if isinstance(value, (datetime.datetime, datetime.date,
+                                  datetime.time)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = unicode(value)
 
-        self.id_list = []
+            encoded_values.append(value)
 
-        if self.optimize_sorts and len(sort_list) > 0:
-            # This can be slow when sorting by multiple columns. If we
-            # have multiple items in the sort list, we'll request just the
-            # IDs and then fetch the actual details from that.
-            self.id_list = list(self.page.object_list.values_list(
-                'pk', flat=True))
-
-            # Make sure to unset the order. We can't meaningfully order these
-            # results in the query, as what we really want is to keep it in
-            # the order specified in id_list, and we certainly don't want
-            # the database to do any special ordering (possibly slowing things
-            # down). We'll set the order properly in a minute.
-            self.page.object_list = self.post_process_queryset(
-                self.queryset.model.objects.filter(
-                    pk__in=self.id_list).order_by())
+        return signing.dumps({
+            'order': order,
+            'values': encoded_values,
+        }, salt=self.KEYSET_CURSOR_SALT)
 
-        if use_select_related:
-            self.page.object_list = \
-                self.page.object_list.select_related(depth=1)
+    def _decode_keyset_cursor(self, cursor, order):
+        """
+        Decodes a cursor made by _encode_keyset_cursor.
 
-        if self.id_list:
-            # The database will give us the items in a more or less random
-            # order, since it doesn't know to keep it in the order provided by
-            # the ID list. This will place the results back in the order we
-            # expect.
-            index = dict([(id, pos) for (pos, id) in enumerate(self.id_list)])
-            object_list = [None] * len(self.id_list)
+        If the cursor was made for a different sort order, this returns None.
+        If the cursor is invalid, this raises Http404.
+        """
+        try:
+            data = signing.loads(cursor, salt=self.KEYSET_CURSOR_SALT)
+        except signing.BadSignature:
+            raise Http404
 
-            for obj in list(self.page.object_list):
-                object_list[index[obj.pk]] = obj
-        else:
-            # Grab the whole list at once. We know it won't be too large,
-            # and it will prevent one query per row.
-            object_list = list(self.page.object_list)
+        if data.get('order') != order:
+            return None
 
-        self.rows = [
-            {
-                'object': obj,
-                'cells': [column.render_cell(obj) for column in self.columns]
-            }
-            for obj in object_list if obj is not None
-        ]
+        return data['values']
 
     def post_process_queryset(self, queryset):
         """
@@ -683,6 +2704,229 @@ class DataGrid(object):
 
         return queryset
 
+    def get_url_params_except(self, *params):
+        """
+        Utility function to return a string containing URL parameters to
+        this page with the specified parameter filtered out. The parameters
+        used to request just the grid are always filtered out.
+
+        The result is computed once per set of parameters for each grid,
+        since it's needed for every column header and column toggle. Each
+        key and value is quoted, since values such as column filters may
+        contain any text.
+        """
+        try:
+            return self._url_params_cache[params]
+        except KeyError:
+            s = ''.join([
+                "%s=%s&" % (urlquote(key), urlquote(self.request.GET[key],
+                                                    safe=','))
+                for key in self.request.GET
+                if (key not in params and
+                    key not in self.GRID_ONLY_URL_PARAMS)
+            ])
+            self._url_params_cache[params] = s
+
+            return s
+
+    def get_column_header(self, column):
+        """
+        Returns the rendered header for a column.
+
+        The headers for all active columns are rendered at once, the first
+        time any of them is needed, and are then looked up from there.
+        """
+        if self._column_headers is None:
+            self._column_headers = self._render_column_headers(self.columns)
+
+        try:
+            return self._column_headers[column.id]
+        except KeyError:
+            header = self._render_column_headers([column])[column.id]
+            self._column_headers[column.id] = header
+
+            return header
+
+    def _render_column_headers(self, columns):
+        """
+        Renders the headers for a list of columns.
+
+        If use_header_cache is set, the headers are cached across requests,
+        keyed on everything that goes into rendering them, including the
+        sort state and the URL parameters.
+        """
+        contexts = {}
+        cache_keys = {}
+        headers = {}
+
+        for column in columns:
+            context = column.get_header_context()
+            contexts[column.id] = context
+
+            if self.use_header_cache:
+                cache_keys[column.id] = \
+                    self._get_column_header_cache_key(column, context)
+
+        if cache_keys:
+            cached_headers = cache.get_many(cache_keys.values())
+
+            for column_id, key in cache_keys.iteritems():
+                if key in cached_headers:
+                    headers[column_id] = mark_safe(cached_headers[key])
+
+        new_cached_headers = {}
+
+        for column in columns:
+            if column.id in headers:
+                continue
+
+            if not self.column_header_template_obj:
+                self.column_header_template_obj = \
+                    get_cached_template(self.column_header_template)
+
+            context = dict(contexts[column.id])
+            context.update({
+                'STATIC_URL': settings.STATIC_URL,
+                'column': column,
+            })
+
+            header = mark_safe(
+                self.column_header_template_obj.render(Context(context)))
+            headers[column.id] = header
+
+            if column.id in cache_keys:
+                new_cached_headers[cache_keys[column.id]] = unicode(header)
+
+        if new_cached_headers:
+            cache.set_many(new_cached_headers, self.header_cache_expiration)
+
+        return headers
+
+    def _get_column_header_cache_key(self, column, context):
+        """
+        Returns the cache key for a rendered column header.
+
+        The key is built from the text of each value, rather than repr(),
+        since the repr() of lazily translated strings includes their address
+        and would differ for every process and column.
+        """
+        parts = [
+            self.column_header_template, settings.STATIC_URL, get_language(),
+            column.id, column.label, column.sortable, column.image_url,
+            column.image_width, column.image_height, column.image_alt,
+        ]
+        parts += ['%s=%s' % (key, force_unicode(value))
+                  for key, value in sorted(context.iteritems())]
+        key = u'\x00'.join([force_unicode(part) for part in parts])
+
+        return make_cache_key('datagrid-header:%s' %
+                              new_md5(key.encode('utf-8')).hexdigest())
+
+    @contextmanager
+    def timed_phase(self, name):
+        """
+        Times a phase of loading or rendering the grid.
+
+        This is a context manager. The time taken, and the number of
+        queries performed if they're being counted, are added to timings
+        under the given name. Subclasses can use this to time their own
+        work.
+        """
+        phase = self._start_phase(name)
+
+        try:
+            yield
+        finally:
+            self._end_phase(phase)
+
+    def _start_phase(self, name):
+        if self.queryset is not None:
+            connection = connections[self.queryset.db]
+        else:
+            connection = connections[DEFAULT_DB_ALIAS]
+
+        old_use_debug_cursor = connection.use_debug_cursor
+
+        if self.count_queries:
+            connection.use_debug_cursor = True
+
+        if (connection.use_debug_cursor or
+            (connection.use_debug_cursor is None and settings.DEBUG)):
+            num_queries = len(connection.queries)
+        else:
+            num_queries = None
+
+        return (name, connection, old_use_debug_cursor, num_queries,
+                time.time())
+
+    def _end_phase(self, phase):
+        name, connection, old_use_debug_cursor, num_queries, start = phase
+        elapsed = time.time() - start
+        connection.use_debug_cursor = old_use_debug_cursor
+
+        if num_queries is not None:
+            num_queries = len(connection.queries) - num_queries
+
+        timing = self.timings.setdefault(name, {
+            'time': 0.0,
+            'queries': None,
+        })
+        timing['time'] += elapsed
+
+        if num_queries is not None:
+            timing['queries'] = (timing['queries'] or 0) + num_queries
+
+        _add_timing_stats(self.__class__, name, elapsed, num_queries)
+
+    def _finish_timings(self):
+        """
+        Logs the timings for the grid, if log_timings is set.
+
+        This is called once the grid has been rendered.
+        """
+        if not self.log_timings or not self.timings:
+            return
+
+        items = []
+
+        for name, timing in self.timings.iteritems():
+            if timing['queries'] is None:
+                items.append('%s %.1fms' % (name, timing['time'] * 1000))
+            else:
+                items.append('%s %.1fms (%d queries)' %
+                             (name, timing['time'] * 1000, timing['queries']))
+
+        logging.info('Datagrid %s.%s timings for %s: %s',
+                     self.__class__.__module__, self.__class__.__name__,
+                     self.request.path, ', '.join(items))
+
+    def get_server_timing(self):
+        """
+        Returns the timings in the format of a Server-Timing header.
+        """
+        items = []
+
+        for name, timing in self.timings.iteritems():
+            item = '%s;dur=%.1f' % (name, timing['time'] * 1000)
+
+            if timing['queries'] is not None:
+                item += ';desc="%d queries"' % timing['queries']
+
+            items.append(item)
+
+        return ', '.join(items)
+
+    def add_server_timing(self, response):
+        """
+        Adds a Server-Timing header to a response, if use_server_timing is
+        set.
+
+        Streamed responses only include the phases completed before the
+        response started.
+        """
+        if self.use_server_timing and self.timings:
+            response['Server-Timing'] = self.get_server_timing()
+
     def render_listview(self):
         """
         Renders the standard list view of the grid.
@@ -691,46 +2935,225 @@ class DataGrid(object):
         """
         self.load_state()
 
+        context = self._get_pagination_context()
+        context['datagrid'] = self
+        context.update(self.extra_context)
+
+        with self.timed_phase('listview'):
+            listview = mark_safe(
+                get_cached_template(self.listview_template).render(
+                    RequestContext(self.request, context)))
+
+        if not self.streaming:
+            self._finish_timings()
+
+        return listview
+
+    def _get_pagination_context(self):
+        """
+        Returns the template context describing the current page.
+        """
         context = {
-            'datagrid': self,
             'is_paginated': self.page.has_other_pages(),
             'results_per_page': self.paginate_by,
             'has_next': self.page.has_next(),
             'has_previous': self.page.has_previous(),
-            'page': self.page.number,
-            'next': self.page.next_page_number(),
-            'previous': self.page.previous_page_number(),
-            'last_on_page': self.page.end_index(),
-            'first_on_page': self.page.start_index(),
-            'pages': self.paginator.num_pages,
-            'hits': self.paginator.count,
-            'page_range': self.paginator.page_range,
         }
-        context.update(self.extra_context)
 
-        return mark_safe(render_to_string(self.listview_template,
-            RequestContext(self.request, context)))
+        if isinstance(self.page, KeysetPage):
+            context.update({
+                'is_keyset_paginated': True,
+                'next_cursor': self.page.next_cursor,
+                'previous_cursor': self.page.previous_cursor,
+            })
+        else:
+            context.update({
+                'page': self.page.number,
+                'next': self.page.next_page_number(),
+                'previous': self.page.previous_page_number(),
+                'last_on_page': self.page.end_index(),
+                'first_on_page': self.page.start_index(),
+            })
+
+            if self.paginator:
+                context.update({
+                    'pages': self.paginator.num_pages,
+                    'hits': self.paginator.count,
+                    'hits_estimated': self.paginator.count_is_estimate,
+                    'page_range': self.paginator.page_range,
+                })
 
-    def render_listview_to_response(self, request=None):
+        return context
+
+    def get_json_data(self, column_ids=None):
+        """
+        Returns the grid's rows and column metadata, for rendering on the
+        client.
+
+        The result is a dictionary containing:
+
+            * 'id':         The ID of the grid.
+            * 'filters':    The current filters, mapping column IDs to
+                            values.
+            * 'columns':    A list of the active columns, each with its
+                            'id', 'label', 'width' and whether it's the
+                            'last' column. Columns whose cells are included
+                            also have their rendered 'header'.
+            * 'rows':       A list of the rows on the page, each with the
+                            object's 'id' and the rendered 'cells'.
+            * 'pagination': The current page, number of pages and so on,
+                            as used by the paginator.
+            * 'paginator':  The rendered paginator, if there's more than
+                            one page.
+
+        If column_ids is provided, only the cells for those columns are
+        rendered, and the pagination information is left out. This is used
+        to fetch just the values for a column that was added to the grid.
+        The results aren't counted in this case, and if column_ids is
+        empty (when columns are only removed or reordered), no objects are
+        fetched at all. The grid's active columns, and the profile, are
+        updated as usual.
+        """
+        self.json_column_ids = column_ids
+        self.load_state()
+
+        if column_ids is None:
+            columns = self.columns
+            rows = [(row['object'], row['cells']) for row in self.rows]
+        else:
+            columns = [column for column in self.columns
+                       if column.id in column_ids]
+
+            with self.timed_phase('render_rows'):
+                if self.page_objects:
+                    for column in columns:
+                        column.prefetch(self.page_objects)
+
+                rows = [
+                    (obj, [column.render_cell(obj) for column in columns])
+                    for obj in self.page_objects
+                ]
+
+        data = {
+            'id': self.id,
+            'filters': self.filters,
+            'columns': [],
+            'rows': [
+                {
+                    'id': obj.pk,
+                    'cells': [force_unicode(cell) for cell in cells],
+                }
+                for obj, cells in rows
+            ],
+        }
+
+        for column in self.columns:
+            column_data = {
+                'id': column.id,
+                'label': force_unicode(column.detailed_label),
+                'width': column.width,
+                'last': column.last,
+            }
+
+            if column in columns:
+                column_data['header'] = force_unicode(column.get_header())
+
+            data['columns'].append(column_data)
+
+        if column_ids is None:
+            pagination = self._get_pagination_context()
+            data['pagination'] = pagination
+
+            if pagination['is_paginated']:
+                context = dict(pagination)
+                context.update(self.extra_context)
+                data['paginator'] = \
+                    get_cached_template('datagrid/paginator.html').render(
+                        Context(paginator(context)))
+
+        self._finish_timings()
+
+        return data
+
+    def render_json_to_response(self, column_ids=None):
+        """
+        Renders the grid's data as JSON to a response, preventing caching
+        in the process.
+
+        See get_json_data() for the contents.
+        """
+        data = self.get_json_data(column_ids)
+        response = HttpResponse(simplejson.dumps(data),
+                                mimetype='application/json')
+        patch_cache_control(response, no_cache=True, no_store=True, max_age=0,
+                            must_revalidate=True)
+        self.add_server_timing(response)
+        return response
+
+    def render_listview_to_response(self, request=None, stream=False):
         """
         Renders the listview to a response, preventing caching in the
         process.
+
+        If stream is True, the response's content is generated as it's
+        sent. See render_streaming().
         """
-        response = HttpResponse(unicode(self.render_listview()))
+        if stream:
+            content = self.render_streaming(self.render_listview)
+        else:
+            content = unicode(self.render_listview())
+
+        response = HttpResponse(content)
         patch_cache_control(response, no_cache=True, no_store=True, max_age=0,
                             must_revalidate=True)
+        self.add_server_timing(response)
         return response
 
-    def render_to_response(self, template_name, extra_context={}):
+    def render_to_response(self, template_name, extra_context={},
+                           stream=False):
         """
         Renders a template containing this datagrid as a context variable.
+
+        If stream is True, the response's content is generated as it's
+        sent. See render_streaming().
+
+        If the caller is requesting just this grid (using the 'gridonly'
+        and 'datagrid-id' URL parameters), only the grid is rendered. With
+        'gridformat=json', the grid's data is returned as JSON instead (see
+        get_json_data()), optionally limited to the comma-separated column
+        IDs in 'gridcolumns'.
+
+        If the 'export' URL parameter is set to one of EXPORT_MIMETYPES,
+        the grid is exported in that format instead. See
+        render_export_to_response().
         """
+        export_format = self.request.GET.get('export', None)
+
+        if (export_format and
+            self.request.GET.get('datagrid-id', self.id) == self.id):
+            return self.render_export_to_response(export_format)
+
+        gridonly = (self.request.GET.get('gridonly', False) and
+                    self.request.GET.get('datagrid-id', None) == self.id)
+
+        if gridonly and self.request.GET.get('gridformat', None) == 'json':
+            column_ids = self.request.GET.get('gridcolumns', None)
+
+            if column_ids is not None:
+                column_ids = [column_id
+                              for column_id in column_ids.split(',')
+                              if column_id]
+
+            return self.render_json_to_response(column_ids)
+
+        if stream:
+            self.streaming = True
+
         self.load_state()
 
         # If the caller is requesting just this particular grid, return it.
-        if self.request.GET.get('gridonly', False) and \
-           self.request.GET.get('datagrid-id', None) == self.id:
-            return self.render_listview_to_response()
+        if gridonly:
+            return self.render_listview_to_response(stream=stream)
 
         context = {
             'datagrid': self
@@ -738,8 +3161,243 @@ class DataGrid(object):
         context.update(extra_context)
         context.update(self.extra_context)
 
-        return render_to_response(template_name, RequestContext(self.request,
-                                                                context))
+        if stream:
+            response = HttpResponse(self.render_streaming(
+                lambda: get_template(template_name).render(
+                    RequestContext(self.request, context))))
+        else:
+            response = render_to_response(
+                template_name, RequestContext(self.request, context))
+
+        self.add_server_timing(response)
+
+        return response
+
+    def render_export_to_response(self, export_format):
+        """
+        Renders every object in the grid to a response, for download.
+
+        The export uses the active columns and sort order, rendering each
+        column's data as plain text through Column.render_text(). The
+        format can be EXPORT_CSV, where the first row contains the column
+        labels, or EXPORT_NDJSON, with one JSON object per line mapping
+        column IDs to values.
+
+        The response is generated as it's sent, export_chunk_size objects
+        at a time. Only the IDs of the matching objects are fetched all at
+        once.
+
+        Any columns, sort order or filters passed for the export are used
+        for it, but aren't saved to the profile.
+        """
+        if export_format not in self.EXPORT_MIMETYPES:
+            raise Http404
+
+        self.exporting = True
+        self.load_state()
+
+        if export_format == self.EXPORT_CSV:
+            content = self._iter_export_csv()
+        else:
+            content = self._iter_export_ndjson()
+
+        mimetype = '%s; charset=utf-8' % self.EXPORT_MIMETYPES[export_format]
+        response = HttpResponse(content, mimetype=mimetype)
+        response['Content-Disposition'] = \
+            'attachment; filename=%s.%s' % (slugify(self.title) or self.id,
+                                            export_format)
+        patch_cache_control(response, no_cache=True, no_store=True, max_age=0,
+                            must_revalidate=True)
+        self.add_server_timing(response)
+
+        return response
+
+    def iter_export_objects(self):
+        """
+        Yields every object in the grid, in lists of export_chunk_size.
+
+        The IDs for each chunk are fetched in the current sort order by
+        seeking past the sort values of the previous chunk, so that neither
+        the full list of IDs nor deep offsets are needed. If the sort fields
+        can't be seeked on (for instance, if they may be NULL), the chunks
+        are fetched by offset instead. The objects are then fetched a chunk
+        at a time, with the columns' augment_queryset() and prefetch()
+        applied to each chunk.
+        """
+        query, sort_list, related_sort_columns = self.get_sorted_queryset()
+        distinct = self.plan_query(query, sort_list)['distinct']
+
+        if distinct:
+            query = query.distinct()
+
+        chunk_size = max(self.export_chunk_size, 1)
+        seek = not distinct and self._can_seek(query.model, sort_list)
+
+        if seek:
+            fields, descending, pk_index = self._get_keyset_fields(sort_list)
+            query = query.order_by(*[
+                '%s%s' % (desc and '-' or '', field)
+                for field, desc in zip(fields, descending)
+            ])
+            chunk_query = query
+        else:
+            start = 0
+
+        while True:
+            with self.timed_phase('ids'):
+                if seek:
+                    rows = list(chunk_query.values_list(*fields)
+                                [:chunk_size])
+                    self.id_list = [row[pk_index] for row in rows]
+
+                    if rows:
+                        chunk_query = query.filter(self._build_keyset_q(
+                            fields, descending, rows[-1]))
+                else:
+                    self.id_list = list(query.values_list('pk', flat=True)
+                                        [start:start + chunk_size])
+                    start += chunk_size
+
+            if not self.id_list:
+                break
+
+            queryset = self.apply_column_projection(
+                self._get_object_list_for_ids(), related_sort_columns)
+
+            index = dict([(id, pos) for (pos, id) in enumerate(self.id_list)])
+            objects = [None] * len(self.id_list)
+
+            with self.timed_phase('objects'):
+                for obj in queryset:
+                    objects[index[obj.pk]] = obj
+
+            objects = [obj for obj in objects if obj is not None]
+
+            # Don't hold on to data for previous chunks.
+            for column in self.columns:
+                column.data_cache = {}
+
+                if objects:
+                    column.prefetch(objects)
+
+            yield objects
+
+            if len(self.id_list) < chunk_size:
+                break
+
+        self.id_list = []
+        self._finish_timings()
+
+    def _iter_export_csv(self):
+        buf = StringIO()
+        writer = csv.writer(buf)
+
+        writer.writerow([
+            force_unicode(column.detailed_label or column.label or
+                          column.id).encode('utf-8')
+            for column in self.columns
+        ])
+
+        for objects in self.iter_export_objects():
+            for obj in objects:
+                writer.writerow([column.render_text(obj).encode('utf-8')
+                                 for column in self.columns])
+
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+        yield buf.getvalue()
+
+    def _iter_export_ndjson(self):
+        for objects in self.iter_export_objects():
+            yield ''.join([
+                simplejson.dumps(dict([
+                    (column.id, column.render_text(obj))
+                    for column in self.columns
+                ])) + '\n'
+                for obj in objects
+            ])
+
+    def render_streaming(self, render_func):
+        """
+        Returns an iterator over the content rendered by render_func, with
+        the grid's rows rendered as they're needed.
+
+        render_func is called with the grid in streaming mode, where the
+        listview template outputs rows_placeholder in place of the rows. The
+        iterator yields everything before that, then the rows in chunks of
+        stream_chunk_size, and then the rest of the content (such as the
+        paginator). Only one chunk of rendered rows is held in memory at a
+        time, which keeps large pages from spiking memory usage and gets
+        the start of the page to the browser sooner.
+
+        Custom listview templates that don't output rows_placeholder are
+        rendered in full, as if streaming wasn't requested. The rows are
+        rendered when the template first accesses them, so render_func is
+        still only called once.
+
+        Note that middleware that accesses the response's content, such as
+        GZipMiddleware, will consume the whole iterator before sending it.
+        """
+        self.streaming = True
+        content = unicode(render_func())
+
+        if self.rows_placeholder not in content:
+            self.streaming = False
+            self._finish_timings()
+
+            return [content]
+
+        before, after = content.split(self.rows_placeholder, 1)
+
+        return self._iter_streaming(before, after)
+
+    def _iter_streaming(self, before, after):
+        yield before
+
+        for chunk in self.iter_rendered_rows():
+            yield chunk
+
+        yield after
+
+        self._finish_timings()
+
+    def iter_rendered_rows(self):
+        """
+        Yields the HTML for the grid's rows, stream_chunk_size rows at a
+        time.
+
+        This produces the same HTML as the rows in the standard listview
+        template. Rows that haven't yet been rendered are rendered a chunk
+        at a time, and aren't kept afterward.
+        """
+        chunk_size = max(self.stream_chunk_size, 1)
+
+        for start in xrange(0, len(self.page_objects), chunk_size):
+            end = start + chunk_size
+
+            if self._rows:
+                rows = self._rows[start:end]
+            else:
+                rows = self.render_rows(self.page_objects[start:end])
+
+            yield u''.join([
+                self._render_row_html(row, start + i)
+                for i, row in enumerate(rows)
+            ])
+
+    def _render_row_html(self, row, row_num):
+        if row_num % 2 == 0:
+            row_class = 'odd'
+        else:
+            row_class = 'even'
+
+        return (u'\n    <tr class="%s" data-object-id="%s">\n%s\n    </tr>\n'
+                % (row_class,
+                   conditional_escape(row['object'].pk),
+                   u''.join([u'\n     %s' % conditional_escape(cell)
+                             for cell in row['cells']])))
 
     @staticmethod
     def link_to_object(obj, value):
@@ -38,21 +38,50 @@ def paginator(context, adjacent_pages=3):
     """
     Renders a paginator used for jumping between pages of results.
     """
+    if context.get('is_keyset_paginated', False):
+        # Keyset-paginated grids don't know their page number, so we can
+        # only offer first/previous/next/last navigation.
+        return {
+            'is_keyset_paginated': True,
+            'next_cursor': context['next_cursor'],
+            'previous_cursor': context['previous_cursor'],
+            'has_next': context['has_next'],
+            'has_previous': context['has_previous'],
+            'show_first': context['has_previous'],
+            'show_last': context['has_next'],
+            'extra_query': context.get('extra_query', None),
+        }
+
+    pages = context.get('pages', None)
+    hits_estimated = context.get('hits_estimated', False)
+
+    if pages is None or hits_estimated:
+        # The grid didn't count the results, or only estimated them, so all
+        # we know for sure is whether there's a next page. An estimated page
+        # count is only used to offer more pages when there is one.
+        if context['has_next']:
+            last_page = max(pages or 0, context['page'] + 1)
+        else:
+            last_page = context['page']
+    else:
+        last_page = pages
+
     page_nums = range(max(1, context['page'] - adjacent_pages),
-                      min(context['pages'], context['page'] + adjacent_pages)
-                      + 1)
+                      min(last_page, context['page'] + adjacent_pages) + 1)
 
     return {
-        'hits': context['hits'],
+        'hits': context.get('hits', None),
+        'hits_estimated': hits_estimated,
         'results_per_page': context['results_per_page'],
         'page': context['page'],
-        'pages': context['pages'],
+        'pages': pages,
         'page_numbers': page_nums,
         'next': context['next'],
         'previous': context['previous'],
         'has_next': context['has_next'],
         'has_previous': context['has_previous'],
         'show_first': 1 not in page_nums,
-        'show_last': context['pages'] not in page_nums,
+        'show_last': (pages is not None and not hits_estimated and
+                      pages not in page_nums),
         'extra_query': context.get('extra_query', None),
     }
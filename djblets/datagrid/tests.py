@@ -24,13 +24,36 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 
+import os
+import shutil
+import tempfile
+import threading
+import time
 from datetime import datetime, timedelta
 
 from django.conf import settings
-from django.contrib.auth.models import Group, User
-from django.http import HttpRequest
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db import connections, DatabaseError
+from django.http import Http404, HttpRequest, QueryDict
+from django.template import Context, Template
+from django.template.loader import get_template
+from django.utils import simplejson
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext_lazy as _
 
-from djblets.datagrid.grids import Column, DataGrid, DateTimeSinceColumn
+from djblets.datagrid.grids import Column, DataGrid, DateTimeSinceColumn, \
+                                   clear_template_cache, \
+                                   ForeignKeyColumn, QueryThreadPool, \
+                                   QueryTimeoutError, \
+                                   flush_deferred_profile_saves, \
+                                   get_cached_template, get_timing_stats, \
+                                   reset_timing_stats, \
+                                   invalidate_cached_counts, \
+                                   _deferred_profile_saves, \
+                                   _get_deferred_profile_state_key
 from djblets.testing.testcases import TestCase
 
 
@@ -52,6 +75,41 @@ class GroupDataGrid(DataGrid):
         ]
 
 
+class PermissionDataGrid(DataGrid):
+    name = Column("Name", sortable=True)
+    content_type = ForeignKeyColumn("Content Type", related_field="model",
+                                    sortable=True)
+
+    def __init__(self, request):
+        DataGrid.__init__(self, request, Permission.objects.all(),
+                          "All Permissions")
+        self.default_sort = ["name"]
+        self.default_columns = [
+            "name", "content_type"
+        ]
+
+
+class ProjectedPermissionDataGrid(PermissionDataGrid):
+    name = Column("Name", sortable=True, required_fields=["name"])
+    content_type = ForeignKeyColumn("Content Type", related_field="model",
+                                    sortable=True,
+                                    required_fields=["content_type"],
+                                    required_relations=["content_type"])
+    codename = Column("Code Name", sortable=True)
+
+
+class FilteredGroupDataGrid(GroupDataGrid):
+    objid = Column("ID", link=True, sortable=True, field_name="id",
+                   filter_type=Column.FILTER_RANGE)
+    name = Column("Group Name", link=True, sortable=True, expand=True,
+                  filter_type=Column.FILTER_PREFIX)
+
+
+class CachedGroupDataGrid(GroupDataGrid):
+    def get_row_cache_version(self, obj):
+        return obj.name
+
+
 class ColumnsTest(TestCase):
     def testDateTimeSinceColumn(self):
         """Testing DateTimeSinceColumn"""
@@ -133,3 +191,1318 @@ class DataGridTest(TestCase):
 
         # Exercise the code paths when rendering
         self.datagrid.render_listview()
+
+    def testFilters(self):
+        """Testing datagrids with column filters"""
+        groups = list(Group.objects.order_by('pk'))
+        self.request.GET['filter-name'] = "Group 1"
+        self.request.GET['filter-objid'] = "%s.." % groups[14].pk
+        datagrid = FilteredGroupDataGrid(self.request)
+        datagrid.load_state()
+
+        self.assertEqual(datagrid.filters, {
+            'name': "Group 1",
+            'objid': "%s.." % groups[14].pk,
+        })
+        self.assertEqual(datagrid.paginator.count, 5)
+        self.assertEqual([row['object'].name for row in datagrid.rows],
+                         ["Group 15", "Group 16", "Group 17", "Group 18",
+                          "Group 19"])
+        self.assertEqual(datagrid.get_column('name').filter_value, "Group 1")
+
+        # The filters are kept in the URLs for the grid.
+        self.assertTrue('filter-name=Group%201&' in
+                        datagrid.get_column('objid').toggle_url)
+        filter_url = datagrid.get_column('name').get_filter_url("G")
+        self.assertTrue(filter_url.endswith("&filter-name=G"))
+        self.assertTrue("filter-objid=%s..&" % groups[14].pk in filter_url)
+
+    def testFiltersQuoted(self):
+        """Testing datagrid URLs keeping filter values with special
+        characters
+        """
+        value = "a&b c%+#"
+        self.request.GET.update({
+            'sort': 'name',
+            'filter-name': value,
+        })
+        datagrid = FilteredGroupDataGrid(self.request)
+        datagrid.load_state()
+
+        self.assertEqual(datagrid.filters, {'name': value})
+
+        urls = [
+            datagrid.get_column('objid').toggle_url,
+            datagrid.get_column('name').get_header_context()['sort_url'],
+            datagrid.get_column('name').get_header_context()['unsort_url'],
+            datagrid.get_column('objid').get_filter_url("1.."),
+        ]
+
+        for url in urls:
+            self.assertTrue(url.startswith('?'))
+            self.assertEqual(QueryDict(url[1:])['filter-name'], value)
+
+    def testFiltersKeysetCursor(self):
+        """Testing datagrid filter URLs resetting keyset pagination"""
+        self.request.GET.update({
+            'sort': 'name',
+            'after': 'abc',
+            'before': 'def',
+            'page': '2',
+        })
+        datagrid = FilteredGroupDataGrid(self.request)
+
+        filter_url = datagrid.get_column('name').get_filter_url("G")
+        self.assertEqual(filter_url, "?sort=name&filter-name=G")
+
+    def testFiltersInvalid(self):
+        """Testing datagrids with invalid column filters"""
+        self.request.GET['filter-objid'] = "abc"
+        self.request.GET['filter-nonexistent'] = "1"
+        datagrid = FilteredGroupDataGrid(self.request)
+        datagrid.load_state()
+
+        self.assertEqual(datagrid.filters, {})
+        self.assertEqual(datagrid.get_column('objid').filter_value, None)
+        self.assertEqual(datagrid.paginator.count, 99)
+
+        # Each end of a range is checked.
+        self.request.GET['filter-objid'] = "1..abc"
+        datagrid = FilteredGroupDataGrid(self.request)
+        datagrid.load_state()
+        self.assertEqual(datagrid.filters, {})
+
+        # Filters on fields that don't exist are ignored as well.
+        class BadFieldGroupDataGrid(GroupDataGrid):
+            name = Column("Group Name", db_field="nonexistent",
+                          filter_type=Column.FILTER_PREFIX)
+
+        request = HttpRequest()
+        request.user = self.user
+        request.GET['filter-name'] = "Group 1"
+        datagrid = BadFieldGroupDataGrid(request)
+        datagrid.load_state()
+
+        self.assertEqual(datagrid.filters, {})
+        self.assertEqual(datagrid.paginator.count, 99)
+
+        # Columns without a filter_type can't be filtered.
+        self.request.GET['filter-name'] = "Group 1"
+        self.datagrid.load_state()
+        self.assertEqual(self.datagrid.filters, {})
+
+    def testFiltersProfile(self):
+        """Testing saving datagrid column filters to the profile"""
+        # Any model will do as a profile.
+        profile = Group.objects.create(name="Profile")
+        self.user.get_profile = lambda: Group.objects.get(pk=profile.pk)
+
+        attrs = {'profile_filters_field': 'name'}
+
+        self._load_grid(FilteredGroupDataGrid, {'filter-name': "Group 2"},
+                        **attrs)
+        self.assertEqual(Group.objects.get(pk=profile.pk).name,
+                         "name=Group+2")
+
+        datagrid = self._load_grid(FilteredGroupDataGrid, **attrs)
+        self.assertEqual(datagrid.filters, {'name': "Group 2"})
+        self.assertEqual(datagrid.paginator.count, 10)
+
+        # Invalid values aren't saved.
+        self._load_grid(FilteredGroupDataGrid, {'filter-objid': "abc"},
+                        **attrs)
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "")
+
+        # An empty value removes the filter.
+        self._load_grid(FilteredGroupDataGrid, {'filter-name': "Group 2"},
+                        **attrs)
+        self._load_grid(FilteredGroupDataGrid, {'filter-name': ""}, **attrs)
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "")
+        self.assertEqual(
+            self._load_grid(FilteredGroupDataGrid, **attrs).filters, {})
+
+    def testKeysetPagination(self):
+        """Testing datagrids with keyset pagination"""
+        datagrid = self._load_grid(params={'sort': 'name'},
+                                   use_keyset_pagination=True)
+        self.assertEqual(len(datagrid.rows), datagrid.paginate_by)
+        self.assertEqual(datagrid.rows[0]['object'].name, "Group 01")
+        self.assertEqual(datagrid.rows[-1]['object'].name, "Group 50")
+        self.assertFalse(datagrid.page.has_previous())
+        self.assertTrue(datagrid.page.has_next())
+        datagrid.render_listview()
+
+        datagrid = self._load_grid(params={
+            'sort': 'name',
+            'after': datagrid.page.next_cursor,
+        }, use_keyset_pagination=True)
+        self.assertEqual(len(datagrid.rows), 49)
+        self.assertEqual(datagrid.rows[0]['object'].name, "Group 51")
+        self.assertEqual(datagrid.rows[-1]['object'].name, "Group 99")
+        self.assertTrue(datagrid.page.has_previous())
+        self.assertFalse(datagrid.page.has_next())
+
+        datagrid = self._load_grid(params={
+            'sort': 'name',
+            'before': datagrid.page.previous_cursor,
+        }, use_keyset_pagination=True)
+        self.assertEqual(len(datagrid.rows), datagrid.paginate_by)
+        self.assertEqual(datagrid.rows[0]['object'].name, "Group 01")
+        self.assertFalse(datagrid.page.has_previous())
+        self.assertTrue(datagrid.page.has_next())
+
+        datagrid = self._load_grid(params={'sort': '-name', 'page': 'last'},
+                                   use_keyset_pagination=True)
+        self.assertEqual(len(datagrid.rows), datagrid.paginate_by)
+        self.assertEqual(datagrid.rows[0]['object'].name, "Group 50")
+        self.assertEqual(datagrid.rows[-1]['object'].name, "Group 01")
+        self.assertTrue(datagrid.page.has_previous())
+        self.assertFalse(datagrid.page.has_next())
+        datagrid.render_listview()
+
+    def _load_grid(self, grid_class=GroupDataGrid, params={}, **attrs):
+        """Loads a grid for a new request.
+
+        The request has the given URL parameters, and the keyword arguments
+        are set as attributes on the grid before its state is loaded.
+        """
+        request = HttpRequest()
+        request.user = self.user
+        request.GET.update(params)
+
+        datagrid = grid_class(request)
+
+        for name, value in attrs.iteritems():
+            setattr(datagrid, name, value)
+
+        datagrid.load_state()
+
+        return datagrid
+
+    def _load_all_pages(self, grid_class, **params):
+        """Returns the objects on every page of a keyset-paginated grid."""
+        objects = []
+
+        while True:
+            datagrid = self._load_grid(grid_class, params,
+                                       use_keyset_pagination=True,
+                                       paginate_by=10)
+
+            objects += [row['object'] for row in datagrid.rows]
+
+            if not datagrid.page.has_next():
+                return datagrid, objects
+
+            if datagrid.query_plan['pagination'] == 'keyset':
+                params['after'] = datagrid.page.next_cursor
+            else:
+                params['page'] = str(datagrid.page.number + 1)
+
+    def testKeysetPaginationNullableSort(self):
+        """Testing datagrids with keyset pagination sorted by a nullable
+        field
+        """
+        class LogEntryDataGrid(DataGrid):
+            object_id = Column("Object ID", sortable=True)
+
+            def __init__(self, request):
+                DataGrid.__init__(self, request, LogEntry.objects.all(),
+                                  "Log Entries")
+                self.default_sort = []
+                self.default_columns = ["object_id"]
+
+        user = User.objects.create(username="logger")
+
+        for i in range(25):
+            if i % 3:
+                object_id = str(i % 4)
+            else:
+                object_id = None
+
+            LogEntry.objects.create(user=user, object_id=object_id,
+                                    object_repr="Entry %d" % i,
+                                    action_flag=1)
+
+        datagrid, objects = self._load_all_pages(LogEntryDataGrid,
+                                                 sort='object_id')
+
+        self.assertEqual(datagrid.query_plan['pagination'], 'offset')
+        self.assertEqual(sorted([obj.pk for obj in objects]),
+                         sorted(LogEntry.objects.values_list('pk',
+                                                             flat=True)))
+
+    def testKeysetPaginationRelatedSort(self):
+        """Testing datagrids with keyset pagination sorted across a
+        multi-valued relation
+        """
+        class MemberGroupDataGrid(GroupDataGrid):
+            member = Column("Member", sortable=True,
+                            db_field="user__username")
+
+        for i in range(9):
+            user = User.objects.create(username="member%d" % i)
+            user.groups = Group.objects.filter(pk__in=range(i, 99, 9))
+
+        datagrid, objects = self._load_all_pages(MemberGroupDataGrid,
+                                                 sort='member')
+
+        self.assertEqual(datagrid.query_plan['pagination'], 'offset')
+        self.assertEqual(sorted([obj.pk for obj in objects]),
+                         sorted(Group.objects.values_list('pk', flat=True)))
+
+    def testKeysetPaginationSortChange(self):
+        """Testing datagrids with keyset pagination and a stale cursor"""
+        self.datagrid.use_keyset_pagination = True
+        self.request.GET['sort'] = 'name'
+        self.datagrid.load_state()
+
+        request = HttpRequest()
+        request.user = self.user
+        request.GET.update({
+            'sort': '-name',
+            'after': self.datagrid.page.next_cursor,
+        })
+
+        datagrid = GroupDataGrid(request)
+        datagrid.use_keyset_pagination = True
+        datagrid.load_state()
+
+        self.assertEqual(datagrid.rows[0]['object'].name, "Group 99")
+        self.assertFalse(datagrid.page.has_previous())
+
+    def testCachedCount(self):
+        """Testing datagrids with cached hit counts"""
+        invalidate_cached_counts(Group)
+
+        self.datagrid.count_strategy = DataGrid.COUNT_CACHED
+        self.datagrid.load_state()
+        self.assertEqual(self.datagrid.paginator.count, 99)
+
+        Group.objects.create(name="Group 100")
+
+        datagrid = GroupDataGrid(self.request)
+        datagrid.count_strategy = DataGrid.COUNT_CACHED
+        datagrid.load_state()
+        self.assertEqual(datagrid.paginator.count, 99)
+
+        invalidate_cached_counts(Group)
+
+        datagrid = GroupDataGrid(self.request)
+        datagrid.count_strategy = DataGrid.COUNT_CACHED
+        datagrid.load_state()
+        self.assertEqual(datagrid.paginator.count, 100)
+        datagrid.render_listview()
+
+    def testEstimatedCountFallback(self):
+        """Testing datagrids with estimated hit counts on unsupported
+        databases
+        """
+        self.datagrid.count_strategy = DataGrid.COUNT_ESTIMATED
+        self.datagrid.load_state()
+        self.assertEqual(self.datagrid.paginator.count, 99)
+        self.assertFalse(self.datagrid.paginator.count_is_estimate)
+
+    def testEstimatedCountPagination(self):
+        """Testing datagrids only using estimated hit counts for display"""
+        class EstimatedGroupDataGrid(GroupDataGrid):
+            def get_hit_count(self, queryset):
+                return self.estimate, True
+
+        self.request.GET['sort'] = 'name'
+
+        # An estimate that's too low mustn't hide the next page.
+        datagrid = EstimatedGroupDataGrid(self.request)
+        datagrid.estimate = 10
+        datagrid.load_state()
+
+        self.assertEqual(len(datagrid.rows), datagrid.paginate_by)
+        self.assertTrue(datagrid.page.has_next())
+        self.assertTrue(datagrid.paginator.count_is_estimate)
+        datagrid.render_listview()
+
+        # Nor should one that's too high offer a next page that's empty.
+        self.request.GET['page'] = '2'
+        datagrid = EstimatedGroupDataGrid(self.request)
+        datagrid.estimate = 1000
+        datagrid.load_state()
+
+        self.assertEqual(len(datagrid.rows), 49)
+        self.assertEqual(datagrid.rows[0]['object'].name, "Group 51")
+        self.assertFalse(datagrid.page.has_next())
+        self.assertTrue(datagrid.page.has_previous())
+        self.assertEqual(datagrid.page.end_index(), 99)
+        datagrid.render_listview()
+
+    def testUncountedPagination(self):
+        """Testing datagrids without hit counts"""
+        self.datagrid.count_strategy = DataGrid.COUNT_NONE
+        self.request.GET['sort'] = 'name'
+        self.datagrid.load_state()
+
+        self.assertEqual(self.datagrid.paginator, None)
+        self.assertEqual(len(self.datagrid.rows), self.datagrid.paginate_by)
+        self.assertTrue(self.datagrid.page.has_next())
+        self.assertFalse(self.datagrid.page.has_previous())
+        self.datagrid.render_listview()
+
+        request = HttpRequest()
+        request.user = self.user
+        request.GET.update({
+            'sort': 'name',
+            'page': '2',
+        })
+
+        datagrid = GroupDataGrid(request)
+        datagrid.count_strategy = DataGrid.COUNT_NONE
+        datagrid.load_state()
+
+        self.assertEqual(len(datagrid.rows), 49)
+        self.assertEqual(datagrid.rows[0]['object'].name, "Group 51")
+        self.assertFalse(datagrid.page.has_next())
+        self.assertTrue(datagrid.page.has_previous())
+        self.assertEqual(datagrid.page.start_index(), 51)
+        self.assertEqual(datagrid.page.end_index(), 99)
+        datagrid.render_listview()
+
+    def testUncountedPaginationLastPage(self):
+        """Testing datagrids without hit counts jumping to the last page"""
+        Group.objects.filter(name__gt="Group 52").delete()
+
+        self.request.GET.update({
+            'sort': 'name',
+            'page': 'last',
+        })
+        self.datagrid.count_strategy = DataGrid.COUNT_NONE
+        self.datagrid.load_state()
+
+        # The two rows past the first page aren't orphans of it, since
+        # uncounted pages always hold paginate_by rows.
+        self.assertEqual(self.datagrid.page.number, 2)
+        self.assertEqual(len(self.datagrid.rows), 2)
+        self.assertEqual(self.datagrid.rows[0]['object'].name, "Group 51")
+        self.assertFalse(self.datagrid.page.has_next())
+
+        Group.objects.filter(name__gt="Group 50").delete()
+
+        datagrid = GroupDataGrid(self.request)
+        datagrid.count_strategy = DataGrid.COUNT_NONE
+        datagrid.load_state()
+
+        self.assertEqual(datagrid.page.number, 1)
+        self.assertEqual(len(datagrid.rows), datagrid.paginate_by)
+        self.assertFalse(datagrid.page.has_next())
+
+    def testColumnRegistry(self):
+        """Testing datagrid column registry"""
+        self.assertEqual([column.id for column in self.datagrid.all_columns],
+                         ["name", "objid"])
+        self.assertTrue('_column_map' in GroupDataGrid.__dict__)
+        self.assertEqual(self.datagrid.get_column("name").id, "name")
+        self.assertEqual(self.datagrid.get_column("load_state"), None)
+
+        self.request.GET['columns'] = "objid,load_state"
+        self.datagrid.load_state()
+
+        self.assertEqual(self.datagrid.columns, [self.datagrid.objid])
+
+    def testColumnStateIsolation(self):
+        """Testing datagrid column state isolation between grids"""
+        request = HttpRequest()
+        request.user = self.user
+        request.GET['columns'] = "name"
+        datagrid = GroupDataGrid(request)
+
+        self.request.GET['columns'] = "objid,name"
+        self.datagrid.load_state()
+        datagrid.load_state()
+
+        self.assertFalse(GroupDataGrid.name.active)
+        self.assertEqual(GroupDataGrid.name.datagrid, None)
+
+        self.assertTrue(self.datagrid.name.active)
+        self.assertTrue(self.datagrid.objid.active)
+        self.assertTrue(self.datagrid.name.last)
+        self.assertEqual(self.datagrid.name.datagrid, self.datagrid)
+
+        self.assertTrue(datagrid.name.active)
+        self.assertFalse(datagrid.objid.active)
+        self.assertEqual(datagrid.name.datagrid, datagrid)
+
+        self.assertEqual(len(self.datagrid.rows[0]['cells']), 2)
+        self.assertEqual(len(datagrid.rows[0]['cells']), 1)
+
+    def testConcurrentRendering(self):
+        """Testing concurrent rendering of datagrids in multiple threads"""
+        # Threads normally get their own database connections, which won't
+        # see the in-memory test database. Share ours, like Django's
+        # LiveServerTestCase does.
+        connection = connections['default']
+        old_allow_thread_sharing = connection.allow_thread_sharing
+        connection.allow_thread_sharing = True
+
+        configurations = [
+            ("objid", "objid", "Group 01"),
+            ("name", "-name", "Group 99"),
+            ("name,objid", "name", "Group 01"),
+            ("objid,name", "-objid", "Group 99"),
+        ]
+        errors = []
+
+        def render_grids(columns, sort, first_name):
+            connections['default'] = connection
+
+            try:
+                for i in range(5):
+                    request = HttpRequest()
+                    request.user = self.user
+                    request.GET.update({
+                        'columns': columns,
+                        'sort': sort,
+                    })
+
+                    datagrid = GroupDataGrid(request)
+                    datagrid.render_listview()
+
+                    column_ids = [column.id for column in datagrid.columns]
+                    self.assertEqual(column_ids, columns.split(','))
+                    self.assertEqual(datagrid.rows[0]['object'].name,
+                                     first_name)
+
+                    for column in datagrid.columns:
+                        self.assertEqual(column.datagrid, datagrid)
+                        self.assertTrue(column.active)
+                        self.assertEqual(column.last,
+                                         column is datagrid.columns[-1])
+
+                    for row in datagrid.rows:
+                        self.assertEqual(len(row['cells']),
+                                         len(column_ids))
+            except Exception, e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=render_grids, args=configuration)
+            for configuration in configurations * 2
+        ]
+
+        try:
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+        finally:
+            connection.allow_thread_sharing = old_allow_thread_sharing
+
+        self.assertEqual(errors, [])
+
+    def testForeignKeyColumnPrefetch(self):
+        """Testing ForeignKeyColumn fetching related objects in one query"""
+        datagrid = PermissionDataGrid(self.request)
+        datagrid.paginate_by = Permission.objects.count()
+
+        # One query each for the count, the page of objects, and the
+        # content types.
+        self.assertNumQueries(3, datagrid.load_state)
+
+        self.assertTrue(len(datagrid.rows) > 1)
+
+        for row in datagrid.rows:
+            permission = row['object']
+            self.assertEqual(datagrid.content_type.render_data(permission),
+                             permission.content_type.model)
+
+    def testColumnProjection(self):
+        """Testing datagrids fetching only the fields columns require"""
+        datagrid = ProjectedPermissionDataGrid(self.request)
+
+        # One query each for the count and the page of objects. The content
+        # types are fetched along with the page.
+        self.assertNumQueries(2, datagrid.load_state)
+
+        permission = datagrid.rows[0]['object']
+        self.assertTrue('name' in permission.__dict__)
+        self.assertTrue('content_type_id' in permission.__dict__)
+        self.assertFalse('codename' in permission.__dict__)
+        self.assertEqual(datagrid.content_type.render_data(permission),
+                         permission.content_type.model)
+
+    def testColumnProjectionRowCache(self):
+        """Testing datagrids fetching the row cache version field along with
+        projected columns
+        """
+        cache.clear()
+
+        # Cache keys are based on the current site, which is looked up
+        # once and then cached.
+        Site.objects.get_current()
+
+        datagrid = ProjectedPermissionDataGrid(self.request)
+        datagrid.row_cache_version_field = 'codename'
+
+        # Looking up the version of each row mustn't trigger a query for
+        # the deferred field.
+        self.assertNumQueries(2, datagrid.load_state)
+
+        permission = datagrid.rows[0]['object']
+        self.assertTrue('codename' in permission.__dict__)
+        self.assertEqual(datagrid.row_cache_misses, len(datagrid.rows))
+
+    def testColumnProjectionUndeclaredFields(self):
+        """Testing datagrids fetching all fields when a column doesn't
+        declare its required fields
+        """
+        self.request.GET['columns'] = "name,codename"
+        datagrid = ProjectedPermissionDataGrid(self.request)
+        datagrid.load_state()
+
+        permission = datagrid.rows[0]['object']
+        self.assertTrue('codename' in permission.__dict__)
+        self.assertEqual(datagrid.codename.render_data(permission),
+                         permission.codename)
+
+    def testQueryPlanLocalSort(self):
+        """Testing datagrid query plans when sorting by local fields"""
+        self.request.GET['sort'] = "name,objid"
+        self.datagrid.load_state()
+
+        self.assertFalse(self.datagrid.query_plan['distinct'])
+        self.assertFalse(self.datagrid.query_plan['related_sort'])
+        self.assertFalse(self.datagrid.query_plan['two_phase'])
+        self.assertEqual(self.datagrid.id_list, [])
+        self.assertEqual(self.datagrid.rows[0]['object'].name, "Group 01")
+
+    def testQueryPlanRelatedSort(self):
+        """Testing datagrid query plans when sorting across tables"""
+        class SortedPermissionDataGrid(PermissionDataGrid):
+            content_type = ForeignKeyColumn("Content Type", sortable=True,
+                                            db_field="content_type__model")
+
+        self.request.GET['sort'] = "content_type,name"
+        datagrid = SortedPermissionDataGrid(self.request)
+        datagrid.load_state()
+
+        self.assertFalse(datagrid.query_plan['distinct'])
+        self.assertTrue(datagrid.query_plan['related_sort'])
+        self.assertTrue(datagrid.query_plan['two_phase'])
+        self.assertEqual(len(datagrid.id_list), len(datagrid.rows))
+
+    def testQueryPlanMultiValuedJoin(self):
+        """Testing datagrid query plans with multi-valued joins"""
+        group = Group.objects.get(name="Group 01")
+
+        for i in range(3):
+            user = User.objects.create(username="user%d" % i)
+            user.groups.add(group)
+
+        self.request.GET['sort'] = "name"
+        datagrid = GroupDataGrid(self.request)
+        datagrid.queryset = Group.objects.filter(user__isnull=False)
+        datagrid.load_state()
+
+        self.assertTrue(datagrid.query_plan['distinct'])
+        self.assertTrue(datagrid.query_plan['two_phase'])
+        self.assertEqual(len(datagrid.rows), 1)
+        self.assertEqual(datagrid.paginator.count, 1)
+
+    def testRowCache(self):
+        """Testing datagrids caching rendered rows across requests"""
+        cache.clear()
+        self.request.GET['sort'] = "objid"
+
+        datagrid = CachedGroupDataGrid(self.request)
+        datagrid.load_state()
+        self.assertEqual(datagrid.row_cache_hits, 0)
+        self.assertEqual(datagrid.row_cache_misses, datagrid.paginate_by)
+        rendered_rows = [row['cells'] for row in datagrid.rows]
+
+        datagrid = CachedGroupDataGrid(self.request)
+        datagrid.load_state()
+        self.assertEqual(datagrid.row_cache_hits, datagrid.paginate_by)
+        self.assertEqual(datagrid.row_cache_misses, 0)
+        self.assertEqual([row['cells'] for row in datagrid.rows],
+                         rendered_rows)
+
+        group = datagrid.rows[0]['object']
+        group.name = "Renamed Group"
+        group.save()
+
+        datagrid = CachedGroupDataGrid(self.request)
+        datagrid.load_state()
+        self.assertEqual(datagrid.row_cache_hits, datagrid.paginate_by - 1)
+        self.assertEqual(datagrid.row_cache_misses, 1)
+        self.assertTrue("Renamed Group" in datagrid.rows[0]['cells'][1])
+        datagrid.render_listview()
+
+    def testRowCacheDateTimeVersion(self):
+        """Testing datagrids caching rendered rows with a timestamp version"""
+        class UserDataGrid(DataGrid):
+            username = Column("Username", sortable=True)
+
+            def __init__(self, request):
+                DataGrid.__init__(self, request, User.objects.all(),
+                                  "All Users")
+                self.default_sort = ["username"]
+                self.default_columns = ["username"]
+                self.row_cache_version_field = 'last_login'
+
+        for i in range(3):
+            User.objects.create(username="user%d" % i,
+                                last_login=datetime(2012, 1, 1, 12, 0, i))
+
+        self._assertRowCacheUsed(UserDataGrid, 3)
+
+    def testRowCacheUnicodeVersion(self):
+        """Testing datagrids caching rendered rows with a non-ASCII version"""
+        class UnicodeCachedGroupDataGrid(GroupDataGrid):
+            def get_row_cache_version(self, obj):
+                return u'\xe9 %s' % obj.name
+
+        self.request.GET['sort'] = "objid"
+        self._assertRowCacheUsed(UnicodeCachedGroupDataGrid,
+                                 self.datagrid.paginate_by)
+
+    def _assertRowCacheUsed(self, datagrid_class, num_rows):
+        cache.clear()
+
+        datagrid = datagrid_class(self.request)
+        datagrid.load_state()
+        self.assertEqual(datagrid.row_cache_misses, num_rows)
+
+        # The keys must be usable with memcached, which doesn't allow
+        # spaces, control characters or non-ASCII characters.
+        for row in datagrid.rows:
+            obj = row['object']
+            key = datagrid.get_row_cache_key(
+                obj, datagrid.get_row_cache_version(obj))
+            self.assertTrue(isinstance(key, str))
+            self.assertTrue(len(key) <= 250)
+
+            for c in key:
+                self.assertTrue(33 <= ord(c) < 127)
+
+        datagrid = datagrid_class(self.request)
+        datagrid.load_state()
+        self.assertEqual(datagrid.row_cache_hits, num_rows)
+        self.assertEqual(datagrid.row_cache_misses, 0)
+
+    def testRowCacheDisabled(self):
+        """Testing datagrids without a row cache version"""
+        self.datagrid.load_state()
+        self.assertEqual(self.datagrid.row_cache_hits, 0)
+        self.assertEqual(self.datagrid.row_cache_misses, 0)
+
+    def testDefaultCellRenderer(self):
+        """Testing datagrid default cell rendering matches the template"""
+        template = get_template('datagrid/cell.html')
+        column = self.datagrid.get_column("name")
+
+        for last in (False, True):
+            for cell_clickable in (False, True):
+                for url in ('', '/groups/?a=1&b="2"', "/groups/'x'/"):
+                    for css_class in ('', 'name <x>'):
+                        column.last = last
+                        column.cell_clickable = cell_clickable
+
+                        data = '<b>Group & "Co"</b>'
+                        expected = template.render(Context({
+                            'column': column,
+                            'css_class': css_class,
+                            'url': url,
+                            'data': mark_safe(data),
+                        }))
+
+                        self.assertEqual(
+                            column.render_default_cell(data, url, css_class),
+                            expected)
+
+    def testCustomCellTemplate(self):
+        """Testing datagrids with a custom cell template"""
+        self.datagrid.cell_template = 'custom_cell.html'
+        self.datagrid.cell_template_obj = Template('<td>{{data}}</td>')
+        self.request.GET['sort'] = "objid"
+        self.datagrid.load_state()
+
+        self.assertEqual(self.datagrid.rows[0]['cells'][0], '<td>1</td>')
+
+    def testColumnHeaders(self):
+        """Testing datagrid column header sort state and URLs"""
+        self.request.GET.update({
+            'sort': "name,objid",
+            'page': "2",
+        })
+        self.datagrid.load_state()
+
+        context = self.datagrid.name.get_header_context()
+        self.assertTrue(context['in_sort'])
+        self.assertTrue(context['sort_ascending'])
+        self.assertTrue(context['sort_primary'])
+        self.assertEqual(context['sort_url'], "?page=2&sort=-name,objid")
+        self.assertEqual(context['unsort_url'], "?page=2&sort=objid")
+
+        context = self.datagrid.objid.get_header_context()
+        self.assertTrue(context['in_sort'])
+        self.assertFalse(context['sort_primary'])
+        self.assertEqual(context['sort_url'], "?page=2&sort=objid,name")
+
+        header = self.datagrid.name.get_header()
+        self.assertTrue('href="?page=2&amp;sort=-name,objid"' in header)
+        self.assertTrue('sort_asc_primary.png"' in header)
+        self.assertTrue(self.datagrid.name.get_header() is header)
+
+        self.assertEqual(self.datagrid.name.toggle_url,
+                         "?sort=name,objid&page=2&columns=objid")
+
+    def testColumnHeaderCache(self):
+        """Testing datagrids caching column headers across requests"""
+        cache.clear()
+        self.request.GET['sort'] = "name"
+
+        self.datagrid.use_header_cache = True
+        self.datagrid.load_state()
+        header = self.datagrid.name.get_header()
+
+        # The second grid must not need to render anything.
+        datagrid = GroupDataGrid(self.request)
+        datagrid.use_header_cache = True
+        datagrid.column_header_template_obj = Template('{{unused}}')
+        datagrid.load_state()
+
+        self.assertEqual(datagrid.name.get_header(), header)
+
+    def testColumnHeaderCacheLazyLabels(self):
+        """Testing datagrids caching column headers with lazily translated
+        labels across column instances
+        """
+        def make_grid_class():
+            class LazyGroupDataGrid(GroupDataGrid):
+                name = Column(_("Group Name"), link=True, sortable=True,
+                              expand=True)
+
+            return LazyGroupDataGrid
+
+        cache.clear()
+        self.request.GET['sort'] = "name"
+
+        datagrid = make_grid_class()(self.request)
+        datagrid.use_header_cache = True
+        datagrid.load_state()
+        header = datagrid.name.get_header()
+
+        # The labels are separate translation proxies, but are the same
+        # text, so the header must be found in the cache.
+        datagrid = make_grid_class()(self.request)
+        datagrid.use_header_cache = True
+        datagrid.column_header_template_obj = Template('{{unused}}')
+        datagrid.load_state()
+
+        self.assertEqual(datagrid.name.get_header(), header)
+
+    def testStreamingRender(self):
+        """Testing streaming datagrid rendering"""
+        self.request.GET['sort'] = "objid"
+        expected = self.datagrid.render_listview_to_response().content
+
+        request = HttpRequest()
+        request.user = self.user
+        request.GET['sort'] = "objid"
+        request.datagrid_count = 0
+        datagrid = GroupDataGrid(request)
+        datagrid.stream_chunk_size = 7
+
+        response = datagrid.render_listview_to_response(stream=True)
+        chunks = list(response)
+
+        # The part before the rows, 8 chunks of rows, and the rest.
+        self.assertEqual(len(chunks), 10)
+        self.assertEqual(''.join(chunks), expected)
+
+        # Rows are identified by their objects, for the client-side code.
+        self.assertTrue('<tr class="odd" data-object-id="1">' in expected)
+        # The rows were rendered as they were sent, and weren't kept.
+        self.assertEqual(datagrid._rows, None)
+        self.assertTrue('no-store' in response['Cache-Control'])
+
+    def testStreamingRenderWithoutPlaceholder(self):
+        """Testing streaming datagrid rendering with an unsupported template"""
+        self.datagrid.streaming = True
+        self.datagrid.load_state()
+        renders = []
+
+        def render():
+            renders.append(render)
+
+            return '%d rows' % len(self.datagrid.rows)
+
+        content = self.datagrid.render_streaming(render)
+
+        self.assertEqual(list(content), ['50 rows'])
+        self.assertFalse(self.datagrid.streaming)
+        self.assertEqual(len(renders), 1)
+
+    def testExportCSV(self):
+        """Testing exporting datagrids as CSV"""
+        self.request.GET.update({
+            'export': 'csv',
+            'sort': '-objid',
+        })
+        self.datagrid.export_chunk_size = 10
+
+        response = self.datagrid.render_to_response('unused.html')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename=all-groups.csv')
+
+        chunks = list(response)
+        self.assertEqual(len(chunks), 11)
+
+        lines = ''.join(chunks).splitlines()
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(lines[0], 'ID,Group Name')
+        self.assertEqual(lines[1], '99,Group 99')
+        self.assertEqual(lines[-1], '1,Group 01')
+
+    def testExportProfileUnchanged(self):
+        """Testing exporting datagrids without saving state to the profile"""
+        # Any model will do as a profile.
+        profile = Group.objects.create(name="Profile")
+        self.user.get_profile = lambda: Group.objects.get(pk=profile.pk)
+
+        self.request.GET.update({
+            'export': 'csv',
+            'sort': '-name',
+            'columns': 'name',
+        })
+        datagrid = GroupDataGrid(self.request)
+        datagrid.profile_sort_field = 'name'
+        datagrid.profile_columns_field = 'name'
+        response = datagrid.render_to_response('unused.html')
+
+        self.assertEqual(datagrid.sort_list, ['-name'])
+        self.assertEqual(response.content.splitlines()[0], 'Group Name')
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "Profile")
+
+    def testExportNDJSON(self):
+        """Testing exporting datagrids as NDJSON"""
+        self.request.GET.update({
+            'export': 'ndjson',
+            'sort': 'name',
+            'columns': 'name',
+        })
+
+        response = self.datagrid.render_export_to_response('ndjson')
+        lines = ''.join(response).splitlines()
+
+        self.assertEqual(len(lines), 99)
+        self.assertEqual(simplejson.loads(lines[0]), {'name': 'Group 01'})
+        self.assertEqual(self.datagrid.page, None)
+
+    def testExportChunksSeek(self):
+        """Testing exporting datagrids in chunks seeked by sort values"""
+        class AppPermissionDataGrid(PermissionDataGrid):
+            app_label = Column("App", sortable=True,
+                               db_field="content_type__app_label")
+
+        self.request.GET['sort'] = '-app_label'
+        datagrid = AppPermissionDataGrid(self.request)
+        datagrid.export_chunk_size = 7
+        datagrid.load_state()
+
+        # Many permissions share an app, so the chunks must be seeked to
+        # using the primary key as well.
+        chunks = list(datagrid.iter_export_objects())
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(max([len(chunk) for chunk in chunks]) <= 7)
+        self.assertEqual(
+            [obj.pk for chunk in chunks for obj in chunk],
+            list(Permission.objects.order_by('-content_type__app_label', '-pk')
+                 .values_list('pk', flat=True)))
+
+    def testExportText(self):
+        """Testing exporting datagrid columns with HTML as plain text"""
+        class HTMLColumn(Column):
+            def render_data(self, obj):
+                return '<a href="/">%s &amp; more</a>' % obj.name
+
+        group = Group.objects.get(name='Group 01')
+        self.assertEqual(HTMLColumn('HTML').render_text(group),
+                         'Group 01 & more')
+
+    def testJSONData(self):
+        """Testing fetching datagrid data as JSON"""
+        self.request.GET.update({
+            'gridonly': '1',
+            'gridformat': 'json',
+            'datagrid-id': self.datagrid.id,
+            'sort': 'objid',
+        })
+
+        response = self.datagrid.render_to_response('unused.html')
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        data = simplejson.loads(response.content)
+        self.assertEqual(data['id'], self.datagrid.id)
+        self.assertEqual([column['id'] for column in data['columns']],
+                         ['objid', 'name'])
+        self.assertTrue(data['columns'][1]['last'])
+        self.assertTrue('?sort=-objid"' in data['columns'][0]['header'])
+        self.assertEqual(len(data['rows']), 50)
+        self.assertEqual(data['rows'][0]['id'], 1)
+        self.assertEqual(data['rows'][0]['cells'],
+                         self.datagrid.rows[0]['cells'])
+        self.assertEqual(data['pagination']['pages'], 2)
+        self.assertTrue('page=2' in data['paginator'])
+
+    def testJSONDataLazyLabels(self):
+        """Testing fetching datagrid data as JSON with lazily translated
+        column labels
+        """
+        class LazyGroupDataGrid(GroupDataGrid):
+            objid = Column(_("ID"), sortable=True, field_name="id")
+            name = Column(_("Group Name"), detailed_label=_("Name"),
+                          link=True, sortable=True, expand=True)
+
+        datagrid = LazyGroupDataGrid(self.request)
+        self.request.GET.update({
+            'gridonly': '1',
+            'gridformat': 'json',
+            'datagrid-id': datagrid.id,
+        })
+
+        data = simplejson.loads(
+            datagrid.render_to_response('unused.html').content)
+
+        self.assertEqual([column['label'] for column in data['columns']],
+                         ["ID", "Name"])
+        self.assertTrue('Group Name' in data['columns'][1]['header'])
+
+    def testJSONDataAddedColumn(self):
+        """Testing fetching JSON data for a datagrid column being added"""
+        self.request.GET.update({
+            'gridonly': '1',
+            'gridformat': 'json',
+            'datagrid-id': self.datagrid.id,
+            'columns': 'objid,name',
+            'gridcolumns': 'name',
+        })
+
+        data = simplejson.loads(
+            self.datagrid.render_to_response('unused.html').content)
+
+        self.assertEqual(len(data['columns']), 2)
+        self.assertFalse('header' in data['columns'][0])
+        self.assertTrue('header' in data['columns'][1])
+        self.assertEqual(len(data['rows']), 50)
+        self.assertEqual(len(data['rows'][0]['cells']), 1)
+        self.assertTrue('Group 01' in data['rows'][0]['cells'][0])
+        self.assertFalse('pagination' in data)
+        self.assertEqual(self.datagrid.rows, [])
+
+        # The results shouldn't have been counted.
+        self.assertEqual(self.datagrid.query_plan['pagination'], 'uncounted')
+        self.assertEqual(self.datagrid.paginator, None)
+
+    def testJSONDataRemovedColumn(self):
+        """Testing fetching JSON data for a datagrid column being removed"""
+        self.request.GET['columns'] = 'name'
+
+        # Nothing needs to be fetched when columns are only removed.
+        self.assertNumQueries(0, self.datagrid.get_json_data, [])
+
+        data = self.datagrid.get_json_data([])
+
+        self.assertEqual([column['id'] for column in data['columns']],
+                         ['name'])
+        self.assertEqual(data['rows'], [])
+        self.assertFalse('pagination' in data)
+
+    def testDeferredProfileSaves(self):
+        """Testing deferred saving of datagrid state to the profile"""
+        cache.clear()
+
+        # Any model will do as a profile.
+        profile = Group.objects.create(name="Profile")
+        self.user.get_profile = lambda: Group.objects.get(pk=profile.pk)
+
+        attrs = {
+            'profile_sort_field': 'name',
+            'defer_profile_saves': True,
+        }
+
+        self._load_grid(params={'sort': "objid"}, **attrs)
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "Profile")
+
+        flush_deferred_profile_saves()
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "objid")
+
+        # This is within the save window, so it's held in the cache.
+        self._load_grid(params={'sort': "-objid"}, **attrs)
+        flush_deferred_profile_saves()
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "objid")
+        self.assertEqual(self._load_grid(**attrs).sort_list, ["-objid"])
+
+        # Once the window has passed, the next request writes it.
+        cache.delete('%s:flushed' % _get_deferred_profile_state_key(profile))
+        self._load_grid(params={'sort': "name"}, **attrs)
+        flush_deferred_profile_saves()
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "name")
+
+    def testDeferredProfileSavesTrailingChange(self):
+        """Testing deferred saving of the last datagrid state change in a
+        burst to the profile
+        """
+        cache.clear()
+
+        profile = Group.objects.create(name="Profile")
+        self.user.get_profile = lambda: Group.objects.get(pk=profile.pk)
+
+        attrs = {
+            'profile_sort_field': 'name',
+            'defer_profile_saves': True,
+        }
+
+        self._load_grid(params={'sort': "objid"}, **attrs)
+        flush_deferred_profile_saves()
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "objid")
+
+        self._load_grid(params={'sort': "-objid"}, **attrs)
+        flush_deferred_profile_saves()
+        self._load_grid(params={'sort': "name"}, **attrs)
+        flush_deferred_profile_saves()
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "objid")
+
+        # The user doesn't load the grid again, but once the window has
+        # passed, the next request to finish writes the last change.
+        key = _get_deferred_profile_state_key(profile)
+        model, pk, window, fields, retry_at = _deferred_profile_saves[key]
+        _deferred_profile_saves[key] = (model, pk, window, fields, 0)
+        cache.delete('%s:flushed' % key)
+
+        flush_deferred_profile_saves()
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "name")
+
+    def testDeferredProfileSavesErrors(self):
+        """Testing deferred saving of datagrid state to the profile when a
+        write fails
+        """
+        cache.clear()
+
+        profile1 = Group.objects.create(name="Profile 1")
+        profile2 = Group.objects.create(name="Profile 2")
+        _deferred_profile_saves.update({
+            'bad-key': (Group, profile1.pk, 30, {'nonexistent': "x"}, 0),
+            'good-key': (Group, profile2.pk, 30, {'name': "objid"}, 0),
+        })
+
+        # The test's connection is already open, so it mustn't be closed.
+        connection = connections['default']
+        closes = []
+        connection.close = lambda: closes.append(connection)
+
+        try:
+            flush_deferred_profile_saves()
+        finally:
+            del connection.close
+
+        self.assertEqual(Group.objects.get(pk=profile1.pk).name, "Profile 1")
+        self.assertEqual(Group.objects.get(pk=profile2.pk).name, "objid")
+        self.assertEqual(closes, [])
+
+    def testDeferredProfileSavesLostProcess(self):
+        """Testing deferred saving of datagrid state to the profile after
+        the process holding the changes has gone away
+        """
+        cache.clear()
+
+        profile = Group.objects.create(name="Profile")
+        self.user.get_profile = lambda: Group.objects.get(pk=profile.pk)
+
+        attrs = {
+            'profile_sort_field': 'name',
+            'defer_profile_saves': True,
+        }
+
+        self._load_grid(params={'sort': "objid"}, **attrs)
+        flush_deferred_profile_saves()
+        self._load_grid(params={'sort': "-objid"}, **attrs)
+
+        # The process exits before the window has passed.
+        key = _get_deferred_profile_state_key(profile)
+        _deferred_profile_saves.clear()
+        cache.delete('%s:flushed' % key)
+
+        # The changes are still in the cache, and the next request to load
+        # the profile writes them.
+        self._load_grid(**attrs)
+        flush_deferred_profile_saves()
+        self.assertEqual(Group.objects.get(pk=profile.pk).name, "-objid")
+        self.assertEqual(cache.get(key), None)
+
+    def testConcurrentCount(self):
+        """Testing datagrids counting results concurrently"""
+        connection = connections['default']
+        old_allow_thread_sharing = connection.allow_thread_sharing
+        connection.allow_thread_sharing = True
+        count_threads = []
+
+        class ConcurrentCountDataGrid(GroupDataGrid):
+            def get_hit_count(self, queryset):
+                count_threads.append(threading.currentThread())
+
+                # The test database only exists on our connection.
+                old_connection = connections['default']
+                connections['default'] = connection
+
+                try:
+                    return queryset.count(), False
+                finally:
+                    connections['default'] = old_connection
+
+        try:
+            datagrid = self._load_grid(ConcurrentCountDataGrid,
+                                       {'sort': 'objid', 'page': '1'},
+                                       concurrent_count=True)
+            self.assertEqual(len(datagrid.rows), 50)
+            self.assertEqual(datagrid.paginator.count, 99)
+            self.assertEqual(datagrid.page.number, 1)
+            self.assertTrue(datagrid.page.has_next())
+
+            datagrid = self._load_grid(ConcurrentCountDataGrid,
+                                       {'sort': 'objid', 'page': '2'},
+                                       concurrent_count=True)
+            self.assertEqual(len(datagrid.rows), 49)
+            self.assertEqual(datagrid.rows[-1]['object'].name, 'Group 99')
+            self.assertFalse(datagrid.page.has_next())
+
+            self.assertRaises(Http404, self._load_grid,
+                              ConcurrentCountDataGrid,
+                              {'sort': 'objid', 'page': '3'},
+                              concurrent_count=True)
+        finally:
+            connection.allow_thread_sharing = old_allow_thread_sharing
+
+        self.assertEqual(len(count_threads), 3)
+        self.assertFalse(threading.currentThread() in count_threads)
+
+    def testConcurrentCountDatabaseError(self):
+        """Testing datagrids counting results in the request thread when the
+        concurrent count fails
+        """
+        main_thread = threading.currentThread()
+        count_threads = []
+
+        class FailingCountDataGrid(GroupDataGrid):
+            def get_hit_count(self, queryset):
+                count_threads.append(threading.currentThread())
+
+                if threading.currentThread() is not main_thread:
+                    raise DatabaseError('server has gone away')
+
+                return GroupDataGrid.get_hit_count(self, queryset)
+
+        datagrid = self._load_grid(FailingCountDataGrid,
+                                   {'sort': 'objid', 'page': '2'},
+                                   concurrent_count=True)
+        self.assertEqual(datagrid.paginator.count, 99)
+        self.assertEqual(len(datagrid.rows), 49)
+        self.assertEqual(len(count_threads), 2)
+        self.assertFalse(count_threads[0] is main_thread)
+        self.assertTrue(count_threads[1] is main_thread)
+        datagrid.render_listview()
+
+    def testQueryThreadPool(self):
+        """Testing the datagrid query thread pool with busy threads"""
+        pool = QueryThreadPool(1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def busy():
+            started.set()
+            release.wait()
+
+            return 'done'
+
+        task = pool.submit(busy)
+        started.wait()
+
+        # The only thread is busy, so the caller must run this itself.
+        self.assertEqual(pool.submit(lambda: None), None)
+        self.assertRaises(QueryTimeoutError, task.wait, 0.01)
+
+        release.set()
+        self.assertEqual(task.wait(), 'done')
+
+        # Once the thread is free, it's reused.
+        while pool._num_idle == 0:
+            time.sleep(0.01)
+
+        self.assertEqual(pool.submit(lambda: 'again').wait(), 'again')
+        self.assertEqual(len(pool._threads), 1)
+
+    def testTimings(self):
+        """Testing datagrid phase timings"""
+        reset_timing_stats()
+        self.request.GET['sort'] = 'objid'
+        self.datagrid.count_queries = True
+        self.datagrid.use_server_timing = True
+
+        response = self.datagrid.render_listview_to_response()
+
+        timings = self.datagrid.timings
+        self.assertEqual(timings.keys(),
+                         ['state', 'count', 'objects', 'render_rows',
+                          'listview'])
+        self.assertEqual(timings['count']['queries'], 1)
+        self.assertEqual(timings['objects']['queries'], 1)
+        self.assertEqual(timings['render_rows']['queries'], 0)
+
+        self.assertTrue(response['Server-Timing'].startswith('state;dur='))
+        self.assertTrue('count;dur=' in response['Server-Timing'])
+        self.assertTrue('desc="1 queries"' in response['Server-Timing'])
+
+        GroupDataGrid(self.request).render_listview()
+
+        stats = get_timing_stats()['djblets.datagrid.tests.GroupDataGrid']
+        self.assertEqual(stats['objects']['count'], 2)
+        self.assertEqual(stats['objects']['total_queries'], 1)
+        self.assertTrue(stats['objects']['max_time'] <=
+                        stats['objects']['total_time'])
+
+    def testTemplateCache(self):
+        """Testing the datagrid template cache"""
+        template_dir = tempfile.mkdtemp()
+        path = os.path.join(template_dir, 'datagrid-test.html')
+        old_template_dirs = settings.TEMPLATE_DIRS
+        old_debug = settings.DEBUG
+        settings.TEMPLATE_DIRS = (template_dir,)
+        clear_template_cache()
+
+        try:
+            fp = open(path, 'w')
+            fp.write('one')
+            fp.close()
+
+            template = get_cached_template('datagrid-test.html')
+            self.assertEqual(template.render(Context()), 'one')
+            self.assertTrue(get_cached_template('datagrid-test.html') is
+                            template)
+
+            fp = open(path, 'w')
+            fp.write('two')
+            fp.close()
+            mtime = os.path.getmtime(path) + 10
+            os.utime(path, (mtime, mtime))
+
+            # Changes are only picked up in DEBUG mode.
+            settings.DEBUG = False
+            self.assertTrue(get_cached_template('datagrid-test.html') is
+                            template)
+
+            settings.DEBUG = True
+            template = get_cached_template('datagrid-test.html')
+            self.assertEqual(template.render(Context()), 'two')
+        finally:
+            settings.TEMPLATE_DIRS = old_template_dirs
+            settings.DEBUG = old_debug
+            clear_template_cache()
+            shutil.rmtree(template_dir)
@@ -12,11 +12,13 @@ jQuery.fn.datagrid = function() {
     var editButton = $("#" + gridId + "-edit");
     var menu = $("#" + gridId + "-menu");
     var editColumns = $("th.edit-columns", this);
-    var summaryCells = $("td.summary", this);
+    var table = $("table:first", this);
+    var checkmark = $(".datagrid-menu-checkbox img:first", menu).clone();
 
     /* State */
     var activeColumns = [];
     var activeMenu = null;
+    var gridQuery = window.location.search || "?";
     var columnMidpoints = [];
     var dragColumn = null;
     var dragColumnsChanged = false;
@@ -29,28 +31,7 @@ jQuery.fn.datagrid = function() {
         activeColumns.push(this.className);
     });
 
-    $("th", this)
-        /* Make the columns unselectable. */
-        .disableSelection()
-
-        /* Make the columns draggable. */
-        .not(".edit-columns").draggable({
-            appendTo: "body",
-            axis: "x",
-            containment: $("thead:first", this),
-            cursor: "move",
-            helper: function() {
-                return $("<div/>")
-                    .addClass("datagrid-header-drag datagrid-header")
-                    .width($(this).width())
-                    .height($(this).height())
-                    .css("top", $(this).offset().top)
-                    .html($(this).html());
-            },
-            start: startColumnDrag,
-            stop: endColumnDrag,
-            drag: onColumnDrag
-        });
+    setupHeaders($("th", this));
 
     /* Register callbacks for the columns. */
     $("tr", menu).each(function(i) {
@@ -68,23 +49,192 @@ jQuery.fn.datagrid = function() {
         toggleColumnsMenu();
     });
 
+    setupCells($("td", this));
+    setupPaginator();
+
+    $(document.body).click(hideColumnsMenu);
+
+
+    /********************************************************************
+     * Rendering
+     ********************************************************************/
+
     /*
+     * Sets up the behavior for column headers.
+     *
+     * @param {jQuery} headers  The header elements.
+     */
+    function setupHeaders(headers) {
+        headers
+            /* Make the columns unselectable. */
+            .disableSelection()
+
+            /* Make the columns draggable. */
+            .not(".edit-columns").draggable({
+                appendTo: "body",
+                axis: "x",
+                containment: $("thead:first", that),
+                cursor: "move",
+                helper: function() {
+                    return $("<div/>")
+                        .addClass("datagrid-header-drag datagrid-header")
+                        .width($(this).width())
+                        .height($(this).height())
+                        .css("top", $(this).offset().top)
+                        .html($(this).html());
+                },
+                start: startColumnDrag,
+                stop: endColumnDrag,
+                drag: onColumnDrag
+            });
+    }
+
+    /*
+     * Sets up the behavior for cells.
+     *
      * Attaches click event listener to all summary td elements,
      * following href of child anchors if present.  This is being
      * done to complement the "cursor:pointer" style that is
      * already applied to the same elements. (Bug #1022)
+     *
+     * @param {jQuery} cells  The cell elements.
+     */
+    function setupCells(cells) {
+        cells.filter(".summary").click(
+            function(evt) {
+                evt.stopPropagation();
+                var cellHref = $("a", evt.target).attr("href");
+                if (cellHref){
+                    window.location.href = cellHref;
+                }
+            }
+        );
+    }
+
+    /*
+     * Sets up the paginator to load other pages in place.
      */
-    summaryCells.click(
-        function(evt) {
-            evt.stopPropagation();
-            var cellHref = $("a", evt.target).attr("href");
-            if (cellHref){
-                window.location.href = cellHref;
+    function setupPaginator() {
+        $("div.paginator a", that).click(function() {
+            var href = $(this).attr("href");
+
+            if (href.charAt(0) != "?") {
+                return true;
             }
+
+            loadGrid(href);
+            return false;
+        });
+    }
+
+    /*
+     * Fetches the grid's data from the server as JSON.
+     *
+     * @param {string}   query      The query string for the page of the
+     *                              grid to fetch, starting with "?".
+     * @param {string}   extra      Additional URL parameters.
+     * @param {function} onSuccess  Optional callback with the grid data.
+     */
+    function fetchGridData(query, extra, onSuccess) {
+        var url = window.location.pathname + query +
+                  "&gridonly=1&gridformat=json&datagrid-id=" + gridId +
+                  extra;
+
+        jQuery.getJSON(url, onSuccess);
+    }
+
+    /*
+     * Loads a page of the grid and renders it in place.
+     *
+     * @param {string} query  The query string for the page, starting
+     *                        with "?".
+     */
+    function loadGrid(query) {
+        fetchGridData(query, "", function(data) {
+            gridQuery = query;
+            renderGrid(data);
+        });
+    }
+
+    /*
+     * Renders the grid from the data returned by the server.
+     *
+     * This replaces the columns, headers, rows and paginator.
+     *
+     * @param {object} data  The grid data.
+     */
+    function renderGrid(data) {
+        var customizeCol = $("col.datagrid-customize", table);
+        var editHeader = $("th.edit-columns", table);
+        var tbody = $("tbody:first", table);
+
+        $("col", table).not(".datagrid-customize").remove();
+        $("th", table).not(".edit-columns").remove();
+        activeColumns = [];
+
+        $(data.columns).each(function(i, column) {
+            activeColumns.push(column.id);
+            $("<col/>").addClass(column.id).insertBefore(customizeCol);
+            setupHeaders($(column.header).insertBefore(editHeader));
+        });
+
+        tbody.empty();
+
+        $(data.rows).each(function(i, row) {
+            $("<tr/>")
+                .addClass(i % 2 == 0 ? "odd" : "even")
+                .attr("data-object-id", row.id)
+                .append(row.cells.join(""))
+                .appendTo(tbody);
+        });
+
+        setupCells($("td", tbody));
+
+        $("div.paginator", that).remove();
+
+        if (data.paginator) {
+            table.after(data.paginator);
+            setupPaginator();
         }
-    );
 
-    $(document.body).click(hideColumnsMenu);
+        updateColumns(data.columns);
+    }
+
+    /*
+     * Updates the widths of the columns and the column menu.
+     *
+     * @param {Array} columns  The column information from the grid data.
+     */
+    function updateColumns(columns) {
+        var colTags = $("col", table);
+
+        $(columns).each(function(i, column) {
+            if (column.width) {
+                $(colTags[i]).attr("width", column.width + "%");
+            } else {
+                $(colTags[i]).removeAttr("width");
+            }
+        });
+
+        $("tr", menu).each(function() {
+            var checkbox = $(".datagrid-menu-checkbox", this).empty();
+
+            if (jQuery.inArray(this.className, activeColumns) != -1) {
+                checkbox.append(checkmark.clone());
+            }
+        });
+    }
+
+    /*
+     * Sets which cell in each row is the last, spanning the edit column.
+     */
+    function updateLastCells() {
+        $("tbody:first tr", table).each(function() {
+            for (var i = 0; i < this.cells.length; i++) {
+                this.cells[i].colSpan = (i == this.cells.length - 1 ? 2 : 1);
+            }
+        });
+    }
 
 
     /********************************************************************
@@ -124,29 +274,93 @@ jQuery.fn.datagrid = function() {
      * Saves the new columns list on the server.
      *
      * @param {string}   columnsStr  The columns to display.
-     * @param {function} onSuccess   Optional callback on successful save.
+     * @param {function} onSuccess   Optional callback with the grid data.
+     * @param {string}   addedColumn Optional ID of a column whose cells
+     *                               should be returned.
      */
-    function saveColumns(columnsStr, onSuccess) {
-        var search = window.location.search || "?";
-        var url = window.location.pathname + search +
-                  "&gridonly=1&datagrid-id=" + gridId +
-                  "&columns=" + columnsStr;
-
-        jQuery.get(url, onSuccess);
+    function saveColumns(columnsStr, onSuccess, addedColumn) {
+        fetchGridData(gridQuery,
+                      "&columns=" + columnsStr +
+                      "&gridcolumns=" + (addedColumn || ""),
+                      onSuccess);
     }
 
     /*
      * Toggles the visibility of a column. This will build the resulting
-     * columns string and request a save of the columns, followed by a
-     * reload of the page.
+     * columns string and request a save of the columns. When removing a
+     * column, its cells are removed right away, and the server only
+     * saves the new list. When adding a column, only the new column's
+     * cells are fetched and added to the grid.
      *
      * @param {string}  columnId  The ID of the column to toggle.
      */
     function toggleColumn(columnId) {
-        saveColumns(serializeColumns(columnId), function(html) {
-            that.replaceWith(html);
-            $("#" + gridId).datagrid();
-        });
+        var index = jQuery.inArray(columnId, activeColumns);
+
+        if (index != -1) {
+            var columnsStr = serializeColumns(columnId);
+
+            $($("col", table)[index]).remove();
+            $($("th", table)[index]).remove();
+            $("tbody:first tr", table).each(function() {
+                $(this.cells[index]).remove();
+            });
+
+            activeColumns.splice(index, 1);
+            updateLastCells();
+            updateColumns([]);
+
+            saveColumns(columnsStr, function(data) {
+                /* The server computes the new column widths. */
+                updateColumns(data.columns);
+            });
+        } else {
+            saveColumns(serializeColumns(columnId), function(data) {
+                var rows = $("tbody:first tr", table);
+                var cellsById = {};
+                var newCells = [];
+
+                $(data.rows).each(function(i, row) {
+                    cellsById[row.id] = row.cells[0];
+                });
+
+                rows.each(function() {
+                    var objectId = $(this).attr("data-object-id");
+
+                    if (!objectId ||
+                        !cellsById.hasOwnProperty(objectId)) {
+                        return false;
+                    }
+
+                    newCells.push(cellsById[objectId]);
+                });
+
+                if (rows.length != data.rows.length ||
+                    newCells.length != rows.length) {
+                    /*
+                     * The objects on the page have changed. Render it from
+                     * scratch.
+                     */
+                    loadGrid(gridQuery);
+                    return;
+                }
+
+                $("<col/>").addClass(columnId)
+                    .insertBefore($("col.datagrid-customize", table));
+                setupHeaders(
+                    $(data.columns[data.columns.length - 1].header)
+                        .insertBefore($("th.edit-columns", table)));
+
+                rows.each(function(i) {
+                    var cell = $(newCells[i]).appendTo(this);
+                    setupCells(cell);
+                });
+
+                activeColumns.push(columnId);
+                updateLastCells();
+                updateColumns(data.columns);
+            }, columnId);
+        }
     }
 
     /*
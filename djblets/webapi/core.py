@@ -25,10 +25,13 @@
 #
 
 
-from cStringIO import StringIO
-from xml.sax.saxutils import XMLGenerator
+import re
+import uuid
+from types import GeneratorType
+from xml.sax.saxutils import escape, quoteattr
 
 from django.conf import settings
+from django.db.models.query import QuerySet
 from django.http import HttpResponse
 from django.utils import simplejson
 from django.utils.encoding import force_unicode
@@ -55,8 +58,18 @@ class WebAPIEncoder(object):
     WEB_API_ENCODERS = (
         'myproject.webapi.MyEncoder',
     )
+
+    Encoders that only encode certain types of objects should list them
+    in handled_types. The encoder will then only be called for objects of
+    those types (or subclasses of them), rather than for every object that
+    needs to be encoded. Subclasses that override encode() are tried for
+    every object, unless they list their own handled_types.
     """
 
+    # The types of objects this encoder can encode. If None, the encoder
+    # will be tried for every object.
+    handled_types = None
+
     def encode(self, o, *args, **kwargs):
         """
         Encodes an object.
@@ -67,6 +80,96 @@ class WebAPIEncoder(object):
         """
         return None
 
+    def handles_type(self, cls):
+        """
+        Returns whether this encoder may be able to encode a class's objects.
+
+        The result is cached for each class, so it must not change over
+        time.
+        """
+        if self.handled_types is None:
+            return True
+
+        for klass in self.__class__.__mro__:
+            if 'handled_types' in klass.__dict__:
+                break
+            elif 'encode' in klass.__dict__:
+                # A subclass has overridden encode() without listing the
+                # types it handles, so it may handle anything.
+                return True
+
+        return issubclass(cls, self.handled_types)
+
+
+class MultiEncoder(WebAPIEncoder):
+    """
+    Encodes objects using the first of a list of encoders that can.
+
+    The encoders that may handle each class of object are worked out the
+    first time an object of that class is encoded, and cached, so that
+    each object is only passed to the encoders that handle its type (and
+    those that don't list any types).
+    """
+    def __init__(self, encoders):
+        self.encoders = encoders
+        self._class_encoders = {}
+
+    def get_encoders_for_class(self, cls):
+        """
+        Returns the encoders to try, in order, for objects of a class.
+        """
+        try:
+            return self._class_encoders[cls]
+        except KeyError:
+            encoders = [encoder for encoder in self.encoders
+                        if encoder.handles_type(cls)]
+            self._class_encoders[cls] = encoders
+
+            return encoders
+
+    def encode(self, o, *args, **kwargs):
+        for encoder in self.get_encoders_for_class(o.__class__):
+            result = encoder.encode(o, *args, **kwargs)
+
+            if result is not None:
+                return result
+
+        return None
+
+
+class RawJSON(object):
+    """
+    A fragment of JSON that has already been encoded.
+
+    When found in a payload, the JSON is written to JSON responses as-is,
+    rather than being encoded again. This allows parts of payloads that
+    rarely change to be encoded once, stored (for instance, in the cache),
+    and spliced into later responses.
+
+    The JSON must be valid, and should be encoded the same way as the rest
+    of the payload (see from_object()). For XML responses, the JSON is
+    decoded and then encoded as XML.
+    """
+    def __init__(self, json):
+        self.json = json
+
+    @classmethod
+    def from_object(cls, o, *args, **kwargs):
+        """
+        Returns a RawJSON for an object, using the registered encoders.
+
+        Any additional arguments are passed to the encoders.
+        """
+        adapter = JSONEncoderAdapter(get_registered_multi_encoder())
+
+        return cls(adapter.encode(o, *args, **kwargs))
+
+    def get_data(self):
+        """
+        Returns the decoded data from the JSON.
+        """
+        return simplejson.loads(self.json)
+
 
 class JSONEncoderAdapter(simplejson.JSONEncoder):
     """
@@ -76,16 +179,31 @@ class JSONEncoderAdapter(simplejson.JSONEncoder):
     simplejson.JSONEncoder. This is used internally when generating JSON
     from a WebAPIEncoder, but can be used in other projects for more specific
     purposes as well.
+
+    RawJSON fragments are encoded as marker strings, which are then
+    replaced by the fragments' JSON in the result.
     """
 
     def __init__(self, encoder, *args, **kwargs):
         simplejson.JSONEncoder.__init__(self, *args, **kwargs)
         self.encoder = encoder
+        self.raw_json_marker = '__djblets_raw_json_%s_' % uuid.uuid4().hex
+        self._raw_json_re = re.compile(r'"%s(\d+)"' % self.raw_json_marker)
 
     def encode(self, o, *args, **kwargs):
         self.encode_args = args
         self.encode_kwargs = kwargs
-        return super(JSONEncoderAdapter, self).encode(o)
+        self._raw_json_fragments = []
+
+        content = super(JSONEncoderAdapter, self).encode(o)
+
+        if self._raw_json_fragments:
+            content = self._raw_json_re.sub(
+                lambda m: self._raw_json_fragments[int(m.group(1))],
+                content)
+            self._raw_json_fragments = []
+
+        return content
 
     def default(self, o):
         """
@@ -93,6 +211,12 @@ class JSONEncoderAdapter(simplejson.JSONEncoder):
 
         If the encoder is unable to encode this object, a TypeError is raised.
         """
+        if isinstance(o, RawJSON):
+            self._raw_json_fragments.append(o.json)
+
+            return '%s%d' % (self.raw_json_marker,
+                             len(self._raw_json_fragments) - 1)
+
         result = self.encoder.encode(o, *self.encode_args, **self.encode_kwargs)
 
         if result is None:
@@ -106,90 +230,142 @@ class XMLEncoderAdapter(object):
     Adapts a WebAPIEncoder to output XML.
 
     This takes an existing encoder and adapts it to output a simple XML format.
+
+    The XML can be generated in chunks, using iter_encode(), so that it can
+    be streamed. Lists can be passed as iterators (such as generators),
+    which will be consumed as the XML is generated. If compact is True, the
+    XML won't be indented.
     """
+    # The number of pieces of XML (tags, text and whitespace) to generate
+    # before yielding a chunk.
+    chunk_size = 4096
+
+    _START = 0
+    _END = 1
+    _VALUE = 2
+    _ITEMS = 3
 
     def __init__(self, encoder, *args, **kwargs):
         self.encoder = encoder
+        self.compact = kwargs.pop('compact', False)
 
     def encode(self, o, *args, **kwargs):
-        self.level = 0
-        self.doIndent = False
-
-        stream = StringIO()
-        self.xml = XMLGenerator(stream, settings.DEFAULT_CHARSET)
-        self.xml.startDocument()
-        self.startElement("rsp")
-        self.__encode(o, *args, **kwargs)
-        self.endElement("rsp")
-        self.xml.endDocument()
-        self.xml = None
-
-        return stream.getvalue()
-
-    def __encode(self, o, *args, **kwargs):
-        if isinstance(o, dict):
-            for key, value in o.iteritems():
-                attrs = {}
-
-                if isinstance(key, (int, long)):
-                    attrs['value'] = str(key)
-                    key = 'int'
-
-                self.startElement(key, attrs)
-                self.__encode(value, *args, **kwargs)
-                self.endElement(key)
-        elif isinstance(o, (tuple, list)):
-            self.startElement("array")
-
-            for i in o:
-                self.startElement("item")
-                self.__encode(i, *args, **kwargs)
-                self.endElement("item")
-
-            self.endElement("array")
-        elif isinstance(o, basestring):
-            self.text(o)
-        elif isinstance(o, (int, long)):
-            self.text("%d" % o)
-        elif isinstance(o, bool):
-            if o:
-                self.text("True")
+        return ''.join(self.iter_encode(o, *args, **kwargs))
+
+    def iter_encode(self, o, *args, **kwargs):
+        """
+        Yields the encoded XML for an object in chunks.
+
+        The object is walked using a stack, rather than recursively, so
+        deeply nested objects can be encoded.
+        """
+        encoding = settings.DEFAULT_CHARSET
+        indent = not self.compact
+        level = 0
+        do_indent = False
+        buf = [u'<?xml version="1.0" encoding="%s"?>\n' % encoding]
+
+        # Each entry is an action, with the next one to perform at the end.
+        stack = [
+            (self._END, 'rsp'),
+            (self._VALUE, o),
+            (self._START, 'rsp', {}),
+        ]
+
+        while stack:
+            action = stack.pop()
+            action_type = action[0]
+
+            if action_type == self._START:
+                if do_indent:
+                    buf.append(u'\n' + u' ' * level)
+
+                name, attrs = action[1:]
+                buf.append(u'<' + name)
+
+                for attr_name, attr_value in attrs.items():
+                    buf.append(u' %s=%s' % (attr_name, quoteattr(attr_value)))
+
+                buf.append(u'>')
+                level += 1
+                do_indent = indent
+            elif action_type == self._END:
+                level -= 1
+
+                if do_indent:
+                    buf.append(u'\n' + u' ' * level)
+
+                buf.append(u'</%s>' % action[1])
+                do_indent = indent
+
+                if len(buf) >= self.chunk_size:
+                    yield u''.join(buf).encode(encoding, 'xmlcharrefreplace')
+                    buf = []
+            elif action_type == self._ITEMS:
+                items = action[1]
+
+                try:
+                    item = items.next()
+                except StopIteration:
+                    continue
+
+                stack.append(action)
+                stack.append((self._END, 'item'))
+                stack.append((self._VALUE, item))
+                stack.append((self._START, 'item', {}))
             else:
-                self.text("False")
-        elif o is None:
-            pass
-        else:
-            result = self.encoder.encode(o, *args, **kwargs)
+                value = action[1]
+
+                if isinstance(value, dict):
+                    actions = []
+
+                    for key, item in value.iteritems():
+                        attrs = {}
 
-            if result is None:
-                raise TypeError("%r is not XML serializable" % (o,))
+                        if isinstance(key, (int, long)):
+                            attrs['value'] = str(key)
+                            key = 'int'
 
-            return self.__encode(result, *args, **kwargs)
+                        actions.append((self._START, key, attrs))
+                        actions.append((self._VALUE, item))
+                        actions.append((self._END, key))
 
-    def startElement(self, name, attrs={}):
-        self.addIndent()
-        self.xml.startElement(name, attrs)
-        self.level += 1
-        self.doIndent = True
+                    actions.reverse()
+                    stack.extend(actions)
+                elif isinstance(value, (tuple, list, GeneratorType)):
+                    stack.append((self._END, 'array'))
+                    stack.append((self._ITEMS, iter(value)))
+                    stack.append((self._START, 'array', {}))
+                elif isinstance(value, basestring):
+                    if not isinstance(value, unicode):
+                        value = unicode(value, encoding)
 
-    def endElement(self, name):
-        self.level -= 1
-        self.addIndent()
-        self.xml.endElement(name)
-        self.doIndent = True
+                    buf.append(escape(value))
+                    do_indent = False
+                elif isinstance(value, (int, long)):
+                    buf.append(u"%d" % value)
+                    do_indent = False
+                elif value is None:
+                    pass
+                elif isinstance(value, RawJSON):
+                    stack.append((self._VALUE, value.get_data()))
+                else:
+                    result = self.encoder.encode(value, *args, **kwargs)
 
-    def text(self, value):
-        self.xml.characters(value)
-        self.doIndent = False
+                    if result is None:
+                        raise TypeError("%r is not XML serializable"
+                                        % (value,))
 
-    def addIndent(self):
-        if self.doIndent:
-            self.xml.ignorableWhitespace('\n' + ' ' * self.level)
+                    stack.append((self._VALUE, result))
+
+        yield u''.join(buf).encode(encoding, 'xmlcharrefreplace')
 
 
 class WebAPIResponse(HttpResponse):
     """
     An API response, formatted for the desired file format.
+
+    If compact_xml is True, XML responses won't be indented.
     """
     supported_mimetypes = [
         'application/json',
@@ -198,7 +374,7 @@ class WebAPIResponse(HttpResponse):
 
     def __init__(self, request, obj={}, stat='ok', api_format=None,
                  status=200, headers={}, encoders=[],
-                 mimetype=None, supported_mimetypes=None):
+                 mimetype=None, supported_mimetypes=None, compact_xml=False):
         if not api_format:
             if request.method == 'GET':
                 api_format = request.GET.get('api_format', None)
@@ -238,6 +414,7 @@ class WebAPIResponse(HttpResponse):
         self.content_set = False
         self.mimetype = mimetype
         self.encoders = encoders or get_registered_encoders()
+        self.compact_xml = compact_xml
 
         for header, value in headers.iteritems():
             self[header] = value
@@ -252,32 +429,8 @@ class WebAPIResponse(HttpResponse):
         the @webapi decorator can set the appropriate API format before
         the content is generated, but after the response is created.
         """
-        class MultiEncoder(WebAPIEncoder):
-            def __init__(self, encoders):
-                self.encoders = encoders
-
-            def encode(self, *args, **kwargs):
-                for encoder in self.encoders:
-                    result = encoder.encode(*args, **kwargs)
-
-                    if result is not None:
-                        return result
-
-                return None
-
         if not self.content_set:
-            adapter = None
-            encoder = MultiEncoder(self.encoders)
-
-            # See the note above about the check for text/plain.
-            if (self.mimetype == 'text/plain' or
-                is_mimetype_a(self.mimetype, 'application/json')):
-                adapter = JSONEncoderAdapter(encoder)
-            elif is_mimetype_a(self.mimetype, "application/xml"):
-                adapter = XMLEncoderAdapter(encoder)
-            else:
-                assert False
-
+            adapter = self.get_encoder_adapter()
             content = adapter.encode(self.api_data, request=self.request)
 
             if self.callback != None:
@@ -293,6 +446,27 @@ class WebAPIResponse(HttpResponse):
 
     content = property(_get_content, _set_content)
 
+    def get_encoder_adapter(self):
+        """
+        Returns the adapter used to encode the response's data.
+
+        This will be a JSONEncoderAdapter or XMLEncoderAdapter, depending
+        on the response's mimetype.
+        """
+        if self.encoders is get_registered_encoders():
+            encoder = get_registered_multi_encoder()
+        else:
+            encoder = MultiEncoder(self.encoders)
+
+        # See the note in __init__ about the check for text/plain.
+        if (self.mimetype == 'text/plain' or
+            is_mimetype_a(self.mimetype, 'application/json')):
+            return JSONEncoderAdapter(encoder)
+        elif is_mimetype_a(self.mimetype, "application/xml"):
+            return XMLEncoderAdapter(encoder, compact=self.compact_xml)
+        else:
+            assert False
+
 
 class WebAPIResponsePaginated(WebAPIResponse):
     """
@@ -302,13 +476,21 @@ class WebAPIResponsePaginated(WebAPIResponse):
 
     * start - The index of the first item (0-based index).
     * max-results - The maximum number of results to return in the request.
+
+    If stream is True, the results are fetched and serialized one at a
+    time as the response is sent, rather than all being held in memory
+    along with the encoded content. Accessing the content directly encodes
+    the whole response at once as usual.
     """
+    # Marks where the results go in the encoded response when streaming.
+    STREAM_RESULTS_MARKER = '__djblets_webapi_stream_results__'
+
     def __init__(self, request, queryset, results_key="results",
                  prev_key="prev", next_key="next",
                  total_results_key="total_results",
                  default_max_results=25, max_results_cap=200,
                  serialize_object_func=None,
-                 extra_data={}, *args, **kwargs):
+                 extra_data={}, stream=False, *args, **kwargs):
         try:
             start = int(request.GET.get('start', 0))
         except ValueError:
@@ -322,14 +504,13 @@ class WebAPIResponsePaginated(WebAPIResponse):
             max_results = default_max_results
 
         results = queryset[start:start + max_results]
+        total_results = queryset.count()
 
-        if serialize_object_func:
-            results = [serialize_object_func(obj)
-                       for obj in results]
+        if stream:
+            num_results = max(0, min(max_results, total_results - start))
         else:
-            results = list(results)
-
-        total_results = queryset.count()
+            results = self._serialize_results(results, serialize_object_func)
+            num_results = len(results)
 
         data = {
             results_key: results,
@@ -346,7 +527,7 @@ class WebAPIResponsePaginated(WebAPIResponse):
                         (full_path, max(start - max_results, 0), max_results),
             }
 
-        if start + len(results) < total_results:
+        if start + num_results < total_results:
             data['links'][next_key] = {
                 'method': 'GET',
                 'href': '%s?start=%s&max-results=%s' %
@@ -355,6 +536,83 @@ class WebAPIResponsePaginated(WebAPIResponse):
 
         WebAPIResponse.__init__(self, request, obj=data, *args, **kwargs)
 
+        self.streaming = stream
+        self.results_key = results_key
+        self._stream_results = results
+        self._serialize_object_func = serialize_object_func
+
+    def _get_content(self):
+        if self.streaming and not self.content_set:
+            self.api_data[self.results_key] = self._serialize_results(
+                self._stream_results, self._serialize_object_func)
+
+        return super(WebAPIResponsePaginated, self)._get_content()
+
+    content = property(_get_content, WebAPIResponse._set_content)
+
+    def __iter__(self):
+        if self.streaming and not self.content_set:
+            self._container = self._iter_content(self.get_encoder_adapter())
+            self._base_content_is_iter = True
+            self.content_set = True
+
+        return super(WebAPIResponsePaginated, self).__iter__()
+
+    def _iter_content(self, adapter):
+        """
+        Yields the content for the response, one result at a time.
+        """
+        if self.callback != None:
+            yield "%s(" % self.callback
+
+        if isinstance(adapter, JSONEncoderAdapter):
+            # The rest of the payload is encoded with a marker in place of
+            # the results, which is then replaced by each result as it's
+            # serialized.
+            self.api_data[self.results_key] = self.STREAM_RESULTS_MARKER
+            content = adapter.encode(self.api_data, request=self.request)
+            before, after = \
+                content.split('"%s"' % self.STREAM_RESULTS_MARKER, 1)
+
+            yield before + '['
+
+            for i, obj in enumerate(self._iter_results()):
+                if i > 0:
+                    yield ', '
+
+                yield adapter.encode(obj, request=self.request)
+
+            yield ']' + after
+        else:
+            # The XML adapter consumes the results as it encodes them.
+            self.api_data[self.results_key] = self._iter_results()
+
+            for chunk in adapter.iter_encode(self.api_data,
+                                             request=self.request):
+                yield chunk
+
+        if self.callback != None:
+            yield ");"
+
+    def _iter_results(self):
+        if isinstance(self._stream_results, QuerySet):
+            # Don't keep every object in the queryset's result cache.
+            objects = self._stream_results.iterator()
+        else:
+            objects = iter(self._stream_results)
+
+        for obj in objects:
+            if self._serialize_object_func:
+                obj = self._serialize_object_func(obj)
+
+            yield obj
+
+    def _serialize_results(self, results, serialize_object_func):
+        if serialize_object_func:
+            return [serialize_object_func(obj) for obj in results]
+        else:
+            return list(results)
+
 
 class WebAPIResponseError(WebAPIResponse):
     """
@@ -395,6 +653,7 @@ class WebAPIResponseFormError(WebAPIResponseError):
 
 
 __registered_encoders = None
+__registered_multi_encoder = None
 
 def get_registered_encoders():
     """
@@ -423,6 +682,22 @@ def get_registered_encoders():
     return __registered_encoders
 
 
+def get_registered_multi_encoder():
+    """
+    Returns a MultiEncoder for the registered Web API encoders.
+
+    This is shared by all responses using the registered encoders, so that
+    the encoders to use for each class are only worked out once.
+    """
+    global __registered_multi_encoder
+
+    if __registered_multi_encoder is None:
+        __registered_multi_encoder = \
+            MultiEncoder(get_registered_encoders())
+
+    return __registered_multi_encoder
+
+
 # Backwards-compatibility
 #
 # This must be done after the classes in order to avoid a
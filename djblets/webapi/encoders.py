@@ -1,3 +1,6 @@
+import datetime
+import decimal
+
 from django.contrib.auth.models import User, Group
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.query import QuerySet
@@ -9,6 +12,9 @@ class BasicAPIEncoder(WebAPIEncoder):
     """
     A basic encoder that encodes dates, times, QuerySets, Users, and Groups.
     """
+    handled_types = (QuerySet, User, Group, datetime.date, datetime.time,
+                     decimal.Decimal)
+
     def encode(self, o, *args, **kwargs):
         if isinstance(o, QuerySet):
             return list(o)
@@ -45,7 +51,7 @@ class ResourceAPIEncoder(WebAPIEncoder):
         resource = get_resource_for_object(o)
 
         if resource:
-            return resource.serialize_object(o, *args, **kwargs)
+            return resource.get_serialized_object(o, *args, **kwargs)
 
         try:
             return DjangoJSONEncoder().default(o)
@@ -1,24 +1,32 @@
+import re
+
 try:
     from hashlib import sha1
 except ImportError:
     from sha import sha as sha1
 
+from django.conf import settings
 from django.conf.urls.defaults import include, patterns, url
 from django.contrib.auth.models import User, Group
-from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.core.urlresolvers import get_script_prefix, reverse
 from django.db import models
 from django.db.models.query import QuerySet
 from django.http import HttpResponseNotAllowed, HttpResponse, \
                         HttpResponseNotModified
+from django.utils.encoding import force_unicode, iri_to_uri
+from django.utils.http import urlquote
 from django.views.decorators.vary import vary_on_headers
 
 from djblets.util.decorators import augment_method_from
 from djblets.util.http import get_modified_since, etag_if_none_match, \
                               set_last_modified, set_etag, \
                               get_http_requested_mimetype
-from djblets.util.misc import never_cache_patterns
+from djblets.util.misc import DEFAULT_EXPIRATION_TIME, make_cache_key, \
+                              never_cache_patterns
 from djblets.webapi.auth import check_login
-from djblets.webapi.core import WebAPIResponse, \
+from djblets.webapi.core import RawJSON, \
+                                WebAPIResponse, \
                                 WebAPIResponseError, \
                                 WebAPIResponsePaginated, \
                                 SPECIAL_PARAMS
@@ -131,6 +139,24 @@ class WebAPIResource(object):
     ``serialize_<fieldname>_field``. These functions take the object being
     serialized and must return a value that can be fed to the encoder.
 
+    Lists of objects are normally serialized in full before the response
+    is sent. Setting ``stream_list_responses`` will instead serialize each
+    object as the response is being sent, keeping only one object in
+    memory at a time. This can't be used along with middleware that needs
+    the full response content.
+
+    Serialized objects can also be cached, by setting
+    ``cache_serialized_objects``. The object is then serialized and encoded
+    as JSON once per version, and spliced into responses from the cache
+    (see ``get_serialized_object``). The version comes from
+    ``get_last_modified`` and ``get_etag`` (autogenerated ETags aren't
+    used, as they require serializing the object, unless ``get_etag`` is
+    overridden), and objects without one aren't cached. The cache key also
+    includes the request's host and scheme, the ``expand`` parameter and
+    the URL arguments. If a resource's payloads depend on anything else,
+    such as the user, or on related objects that may change separately, it
+    should override ``get_serialized_object_cache_key``.
+
 
     Handling Requests
     -----------------
@@ -323,6 +349,10 @@ class WebAPIResource(object):
     mimetype_item_resource_name = None
     allowed_list_mimetypes = list(WebAPIResponse.supported_mimetypes)
     allowed_item_mimetypes = list(WebAPIResponse.supported_mimetypes)
+    stream_list_responses = False
+    cache_serialized_objects = False
+    serialized_object_cache_expiration = \
+        getattr(settings, 'CACHE_EXPIRATION_TIME', DEFAULT_EXPIRATION_TIME)
 
     # State
     method_mapping = {
@@ -334,6 +364,10 @@ class WebAPIResource(object):
 
     _parent_resource = None
     _mimetypes_cache = None
+    _list_uri_template = None
+    _item_uri_template = None
+    _item_uri_templates = None
+    _uri_object_key_regexes = None
 
     def __init__(self):
         _name_to_resources[self.name] = self
@@ -636,8 +670,9 @@ class WebAPIResource(object):
             return HttpResponseNotModified()
 
         data = {
-            self.item_result_key: self.serialize_object(obj, request=request,
-                                                        *args, **kwargs),
+            self.item_result_key: self.get_serialized_object(obj,
+                                                             request=request,
+                                                             *args, **kwargs),
         }
 
         response = WebAPIResponse(request,
@@ -689,9 +724,11 @@ class WebAPIResource(object):
                                            *args, **kwargs).select_related(),
                 results_key=self.list_result_key,
                 serialize_object_func =
-                    lambda obj: get_resource_for_object(obj).serialize_object(
-                        obj, request=request, *args, **kwargs),
+                    lambda obj: get_resource_for_object(obj).\
+                        get_serialized_object(obj, request=request,
+                                              *args, **kwargs),
                 extra_data=data,
+                stream=self.stream_list_responses,
                 **self.build_response_args(request))
         else:
             return 200, data
@@ -764,13 +801,22 @@ class WebAPIResource(object):
         This is used to automatically build up the URL hierarchy for all
         objects. Projects should call this for top-level resources and
         return them in the ``urls.py`` files.
+
+        This also builds a template for the path to each object, relative
+        to the top-level resource, which is used by ``get_href``.
         """
+        if self._list_uri_template is None:
+            # This is a top-level resource.
+            self._list_uri_template = ''
+
         urlpatterns = never_cache_patterns('',
             url(r'^$', self, name=self._build_named_url(self.name_plural)),
         )
 
         for resource in self.list_child_resources:
             resource._parent_resource = self
+            resource._list_uri_template = \
+                self._list_uri_template + resource.uri_name + '/'
             child_regex = r'^' + resource.uri_name + '/'
             urlpatterns += patterns('',
                 url(child_regex, include(resource.get_url_patterns())),
@@ -781,8 +827,11 @@ class WebAPIResource(object):
             if self.uri_object_key:
                 base_regex = r'^(?P<%s>%s)/' % (self.uri_object_key,
                                                 self.uri_object_key_regex)
+                self._item_uri_template = '%s%%(%s)s/' % (
+                    self._list_uri_template, self.uri_object_key)
             elif self.singleton:
                 base_regex = r'^'
+                self._item_uri_template = self._list_uri_template
 
             urlpatterns += never_cache_patterns('',
                 url(base_regex + '$', self,
@@ -791,6 +840,8 @@ class WebAPIResource(object):
 
             for resource in self.item_child_resources:
                 resource._parent_resource = self
+                resource._list_uri_template = \
+                    self._item_uri_template + resource.uri_name + '/'
                 child_regex = base_regex + resource.uri_name + '/'
                 urlpatterns += patterns('',
                     url(child_regex, include(resource.get_url_patterns())),
@@ -886,6 +937,112 @@ class WebAPIResource(object):
 
         return data
 
+    def get_serialized_object(self, obj, *args, **kwargs):
+        """Returns the serialized object for use in a payload.
+
+        If ``cache_serialized_objects`` is set, this returns the object's
+        JSON from the cache, as a RawJSON, serializing and encoding the
+        object first if it isn't cached. Otherwise, this returns the
+        result of ``serialize_object``.
+        """
+        if self.cache_serialized_objects:
+            key = self.get_serialized_object_cache_key(obj, *args, **kwargs)
+
+            if key:
+                key = make_cache_key(key)
+                json = cache.get(key)
+
+                if json is None:
+                    json = RawJSON.from_object(
+                        self.serialize_object(obj, *args, **kwargs),
+                        request=kwargs.get('request', None)).json
+                    cache.set(key, json,
+                              self.serialized_object_cache_expiration)
+
+                return RawJSON(json)
+
+        return self.serialize_object(obj, *args, **kwargs)
+
+    def get_serialized_object_cache_key(self, obj, *args, **kwargs):
+        """Returns the cache key for a serialized object.
+
+        The key is based on the object's version (see
+        ``get_serialized_object_version``) and on the parts of the request
+        that affect the payload: the scheme, host, ``expand`` parameter and
+        the URL arguments that ``get_href`` would use for the object. Other
+        keyword arguments, such as ``api_format`` or the ``start`` and
+        ``max-results`` of a list page, are left out, so that an object is
+        cached once no matter which page or format it's shown in. This
+        returns None if the object can't be cached.
+        """
+        request = kwargs.get('request', None)
+
+        if request is None:
+            return None
+
+        version = self.get_serialized_object_version(request, obj)
+
+        if version is None:
+            return None
+
+        expand = request.GET.get('expand', request.POST.get('expand', ''))
+        request_key = '%s:%s:%s:%r' % (
+            request.is_secure(), request.get_host(), expand,
+            sorted(self._get_href_kwargs(obj, kwargs).items()))
+
+        return 'webapi-serialized-object:%s:%s:%s:%s' % (
+            self.name, obj.pk, version,
+            sha1(request_key.encode('utf-8')).hexdigest())
+
+    def _get_href_kwargs(self, obj, kwargs):
+        """Returns the URL arguments identifying an object.
+
+        This contains the object's own key, and the keys of its parents
+        found in the URL arguments for the request.
+        """
+        href_kwargs = {}
+
+        if self.uri_object_key:
+            href_kwargs[self.uri_object_key] = \
+                getattr(obj, self.model_object_key)
+
+        resource = self._parent_resource
+
+        while resource:
+            if resource.uri_object_key in kwargs:
+                href_kwargs[resource.uri_object_key] = \
+                    kwargs[resource.uri_object_key]
+
+            resource = resource._parent_resource
+
+        return href_kwargs
+
+    def get_serialized_object_version(self, request, obj):
+        """Returns a string identifying the version of an object.
+
+        This is built from ``get_last_modified`` and ``get_etag``. If
+        neither returns a value, this returns None.
+
+        The default ``get_etag`` isn't used when ``autogenerate_etags`` is
+        set and there's no ``etag_field``, since the ETag would then be
+        generated from the serialized object. An overridden ``get_etag`` is
+        always used.
+        """
+        parts = [self.get_last_modified(request, obj)]
+
+        if (self.etag_field or not self.autogenerate_etags or
+            self.__class__.get_etag.im_func is not
+            WebAPIResource.get_etag.im_func):
+            parts.append(self.get_etag(request, obj))
+
+        if not [part for part in parts if part is not None]:
+            return None
+
+        return sha1(':'.join([
+            force_unicode(part).encode('utf-8')
+            for part in parts
+        ])).hexdigest()
+
     def get_links(self, resources=[], obj=None, request=None,
                   *args, **kwargs):
         """Returns a dictionary of links coming off this resource.
@@ -982,8 +1139,112 @@ class WebAPIResource(object):
         }
         href_kwargs.update(self.get_href_parent_ids(obj))
 
-        return request.build_absolute_uri(
-            reverse(self._build_named_url(self.name), kwargs=href_kwargs))
+        return self._build_absolute_uri(request,
+                                        self._get_item_path(href_kwargs))
+
+    def _get_item_path(self, href_kwargs):
+        """Returns the path to an object, given its URL arguments.
+
+        The first time this is called, the path is looked up with
+        ``reverse()``, and compared against the template built in
+        ``get_url_patterns`` to find out where the resource tree lives.
+        Later paths are then built by filling in the template, rather than
+        calling ``reverse()`` again. If the path doesn't match the template,
+        ``reverse()`` will always be used.
+
+        ``reverse()`` is also used for any path with a value that doesn't
+        match its key's ``uri_object_key_regex``, or that needs quoting.
+        """
+        script_prefix = get_script_prefix()
+
+        if self._item_uri_templates is None:
+            self._item_uri_templates = {}
+
+        template = self._item_uri_templates.get(script_prefix)
+        uri_kwargs = self._get_item_uri_kwargs(href_kwargs)
+
+        if template and uri_kwargs is not None:
+            try:
+                return iri_to_uri(template % uri_kwargs)
+            except KeyError:
+                pass
+
+        path = reverse(self._build_named_url(self.name), kwargs=href_kwargs)
+
+        if template is None and uri_kwargs is not None:
+            template = False
+
+            if self._item_uri_template is not None:
+                try:
+                    relative_path = iri_to_uri(
+                        self._item_uri_template % uri_kwargs)
+                except KeyError:
+                    relative_path = None
+
+                if relative_path and path.endswith(relative_path):
+                    prefix = path[:len(path) - len(relative_path)]
+                    template = (prefix.replace('%', '%%') +
+                                self._item_uri_template)
+
+            self._item_uri_templates[script_prefix] = template
+
+        return path
+
+    def _get_item_uri_kwargs(self, href_kwargs):
+        """Returns the values to fill in to the URI template for an object.
+
+        Each value is quoted. This returns None if any value doesn't match
+        the ``uri_object_key_regex`` for its key, or if it contains
+        characters that need quoting beyond what ``iri_to_uri`` does. How
+        ``reverse()`` quotes those differs between Django versions, so it's
+        left to build those paths.
+        """
+        if self._uri_object_key_regexes is None:
+            regexes = {}
+            resource = self
+
+            while resource:
+                if resource.uri_object_key:
+                    regexes.setdefault(
+                        resource.uri_object_key,
+                        re.compile(r'^(?:%s)$' % resource.uri_object_key_regex,
+                                   re.UNICODE))
+
+                resource = resource._parent_resource
+
+            self._uri_object_key_regexes = regexes
+
+        uri_kwargs = {}
+
+        for key, value in href_kwargs.iteritems():
+            value = force_unicode(value)
+            regex = self._uri_object_key_regexes.get(key)
+
+            if regex is None or not regex.match(value):
+                return None
+
+            quoted_value = urlquote(value, safe='')
+
+            if quoted_value != iri_to_uri(value):
+                return None
+
+            uri_kwargs[key] = quoted_value
+
+        return uri_kwargs
+
+    def _build_absolute_uri(self, request, path):
+        """Returns the absolute URI for a path on the server.
+
+        This is equivalent to ``request.build_absolute_uri(path)``, but
+        the scheme and host are only looked up once per request.
+        """
+        try:
+            base_uri = request._djblets_webapi_base_uri
+        except AttributeError:
+            base_uri = request.build_absolute_uri('/')[:-1]
+            request._djblets_webapi_base_uri = base_uri
+
+        return base_uri + path
 
     def get_href_parent_ids(self, obj):
         """Returns a dictionary mapping parent object keys to their values for
@@ -22,12 +22,58 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+from datetime import datetime
+
+from django.conf.urls.defaults import include, patterns, url
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.core.urlresolvers import get_script_prefix, NoReverseMatch, \
+                                     reverse
 from django.test.client import RequestFactory
+from django.utils import simplejson
 
 from djblets.util.testing import TestCase
+from djblets.webapi.core import JSONEncoderAdapter, MultiEncoder, \
+                                RawJSON, WebAPIEncoder, WebAPIResponse, \
+                                WebAPIResponsePaginated, XMLEncoderAdapter
+from djblets.webapi.encoders import BasicAPIEncoder
 from djblets.webapi.resources import WebAPIResource, unregister_resource
 
 
+class HrefObject(object):
+    def __init__(self, pk, parent=None):
+        self.pk = pk
+        self.parent = parent
+
+
+class HrefChildResource(WebAPIResource):
+    name = 'hrefchild'
+    uri_object_key = 'child_id'
+    model_parent_key = 'parent'
+
+
+class HrefParentResource(WebAPIResource):
+    name = 'hrefparent'
+    uri_object_key = 'parent_id'
+    item_child_resources = [HrefChildResource()]
+
+
+class HrefNamedResource(WebAPIResource):
+    name = 'hrefnamed'
+    uri_object_key = 'name'
+    uri_object_key_regex = '[^/]+'
+
+
+href_parent_resource = HrefParentResource()
+href_child_resource = href_parent_resource.item_child_resources[0]
+href_named_resource = HrefNamedResource()
+
+urlpatterns = patterns('',
+    url(r'^api/', include(href_parent_resource.get_url_patterns())),
+    url(r'^api/named/', include(href_named_resource.get_url_patterns())),
+)
+
+
 class WebAPIResourceTests(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -170,3 +216,364 @@ class WebAPIResourceTests(TestCase):
         print response
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], response_mimetype)
+
+
+class WebAPIEncoderTests(TestCase):
+    def test_multi_encoder_dispatch(self):
+        """Testing MultiEncoder only calling encoders for the types they
+        handle
+        """
+        calls = []
+
+        class GroupEncoder(WebAPIEncoder):
+            handled_types = (Group,)
+
+            def encode(self, o, *args, **kwargs):
+                calls.append('group')
+                return {'name': o.name}
+
+        class AnyEncoder(WebAPIEncoder):
+            def encode(self, o, *args, **kwargs):
+                calls.append('any')
+                return {'any': True}
+
+        encoder = MultiEncoder([GroupEncoder(), AnyEncoder()])
+
+        self.assertEqual(encoder.encode(Group(name='group')),
+                         {'name': 'group'})
+        self.assertEqual(encoder.encode(User(username='user')),
+                         {'any': True})
+        self.assertEqual(calls, ['group', 'any'])
+        self.assertEqual(len(encoder.get_encoders_for_class(User)), 1)
+
+    def test_handles_type_with_overridden_encode(self):
+        """Testing WebAPIEncoder.handles_type with an overridden encode()"""
+        class CustomEncoder(BasicAPIEncoder):
+            def encode(self, o, *args, **kwargs):
+                return BasicAPIEncoder.encode(self, o, *args, **kwargs)
+
+        self.assertTrue(BasicAPIEncoder().handles_type(datetime))
+        self.assertFalse(BasicAPIEncoder().handles_type(Permission))
+        self.assertTrue(CustomEncoder().handles_type(Permission))
+
+
+class WebAPIResponsePaginatedTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+        for i in range(10):
+            Group.objects.create(name='group%02d' % i)
+
+    def test_stream(self):
+        """Testing WebAPIResponsePaginated with stream=True"""
+        request = self.factory.get('/api/groups/', {'max-results': 4})
+        queryset = Group.objects.order_by('name')
+        serialize = lambda group: {'name': group.name}
+
+        response = WebAPIResponsePaginated(request, queryset,
+                                           serialize_object_func=serialize,
+                                           extra_data={'links': {}},
+                                           api_format='json', stream=True)
+        expected = WebAPIResponsePaginated(request, queryset,
+                                           serialize_object_func=serialize,
+                                           extra_data={'links': {}},
+                                           api_format='json')
+
+        self.assertEqual(simplejson.loads(''.join(response)),
+                         simplejson.loads(expected.content))
+
+        data = simplejson.loads(expected.content)
+        self.assertEqual(data['results'], [
+            {'name': 'group00'},
+            {'name': 'group01'},
+            {'name': 'group02'},
+            {'name': 'group03'},
+        ])
+        self.assertEqual(data['total_results'], 10)
+        self.assertTrue('next' in data['links'])
+
+    def test_stream_xml(self):
+        """Testing WebAPIResponsePaginated with stream=True and XML"""
+        request = self.factory.get('/api/groups/')
+        response = WebAPIResponsePaginated(request,
+                                           Group.objects.order_by('name'),
+                                           extra_data={'links': {}},
+                                           api_format='xml', stream=True)
+        content = ''.join(response)
+
+        self.assertTrue('<name>group09</name>' in content)
+        self.assertTrue('<total_results>10</total_results>' in content)
+        self.assertEqual(content.count('<item>'), 10)
+
+
+class XMLEncoderAdapterTests(TestCase):
+    def test_encode(self):
+        """Testing XMLEncoderAdapter.encode"""
+        adapter = XMLEncoderAdapter(BasicAPIEncoder())
+        content = adapter.encode({
+            'stat': 'ok',
+            'items': [1, u'caf\xe9 & <bar>', None],
+        })
+
+        self.assertEqual(
+            content,
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<rsp>\n'
+            ' <items>\n'
+            '  <array>\n'
+            '   <item>1</item>\n'
+            '   <item>caf\xc3\xa9 &amp; &lt;bar&gt;</item>\n'
+            '   <item>\n'
+            '   </item>\n'
+            '  </array>\n'
+            ' </items>\n'
+            ' <stat>ok</stat>\n'
+            '</rsp>')
+
+    def test_encode_compact(self):
+        """Testing XMLEncoderAdapter.encode with compact=True"""
+        adapter = XMLEncoderAdapter(BasicAPIEncoder(), compact=True)
+
+        self.assertEqual(
+            adapter.encode({'links': {1: 'a'}}),
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<rsp><links><int value="1">a</int></links></rsp>')
+
+    def test_encode_deep(self):
+        """Testing XMLEncoderAdapter.encode with deeply nested data"""
+        data = {}
+        inner = data
+
+        for i in range(2000):
+            inner['child'] = {}
+            inner = inner['child']
+
+        adapter = XMLEncoderAdapter(BasicAPIEncoder(), compact=True)
+        content = adapter.encode(data)
+
+        self.assertEqual(content.count('<child>'), 2000)
+
+    def test_iter_encode(self):
+        """Testing XMLEncoderAdapter.iter_encode with iterators"""
+        adapter = XMLEncoderAdapter(BasicAPIEncoder())
+        adapter.chunk_size = 10
+        data = {'items': range(100)}
+
+        chunks = list(adapter.iter_encode({
+            'items': (i for i in range(100)),
+        }))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks), adapter.encode(data))
+
+
+class RawJSONTests(TestCase):
+    def test_json(self):
+        """Testing JSONEncoderAdapter with RawJSON"""
+        adapter = JSONEncoderAdapter(BasicAPIEncoder())
+        content = adapter.encode({
+            'user': RawJSON('{"username": "raw"}'),
+            'items': [RawJSON('1'), RawJSON('"\\\\1"')],
+        })
+
+        self.assertEqual(simplejson.loads(content), {
+            'user': {'username': 'raw'},
+            'items': [1, '\\1'],
+        })
+
+    def test_from_object(self):
+        """Testing RawJSON.from_object"""
+        group = Group(id=1, name='group')
+        raw_json = RawJSON.from_object(group)
+
+        self.assertEqual(simplejson.loads(raw_json.json),
+                         {'id': 1, 'name': 'group'})
+        self.assertEqual(raw_json.get_data(), {'id': 1, 'name': 'group'})
+
+    def test_response(self):
+        """Testing WebAPIResponse with RawJSON"""
+        request = RequestFactory().get('/api/')
+        data = {'group': RawJSON('{"name": "raw"}')}
+
+        response = WebAPIResponse(request, data, api_format='json')
+        self.assertEqual(simplejson.loads(response.content), {
+            'stat': 'ok',
+            'group': {'name': 'raw'},
+        })
+
+        response = WebAPIResponse(request, data, api_format='xml')
+        self.assertTrue('<group>\n  <name>raw</name>\n </group>' in
+                        response.content)
+
+
+class SerializedObjectCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.serialize_count = 0
+
+        tests = self
+
+        class TestGroupResource(WebAPIResource):
+            name = 'test-group'
+            model = Group
+            fields = ('id', 'name')
+            etag_field = 'name'
+            cache_serialized_objects = True
+
+            def serialize_object(self, *args, **kwargs):
+                tests.serialize_count += 1
+
+                return super(TestGroupResource, self).serialize_object(
+                    *args, **kwargs)
+
+        self.resource = TestGroupResource()
+
+    def tearDown(self):
+        unregister_resource(self.resource)
+
+    def test_cached(self):
+        """Testing WebAPIResource.get_serialized_object caching"""
+        group = Group.objects.create(name='group1')
+        request = self.factory.get('/api/groups/')
+
+        raw_json = self.resource.get_serialized_object(group, request=request)
+        self.assertTrue(isinstance(raw_json, RawJSON))
+        self.assertEqual(raw_json.get_data()['name'], 'group1')
+
+        raw_json = self.resource.get_serialized_object(group, request=request)
+        self.assertEqual(raw_json.get_data()['name'], 'group1')
+        self.assertEqual(self.serialize_count, 1)
+
+        # A new version is serialized again.
+        group.name = 'group2'
+        raw_json = self.resource.get_serialized_object(group, request=request)
+        self.assertEqual(raw_json.get_data()['name'], 'group2')
+        self.assertEqual(self.serialize_count, 2)
+
+        # So is a request for a different host.
+        request = self.factory.get('/api/groups/', HTTP_HOST='example.com')
+        raw_json = self.resource.get_serialized_object(group, request=request)
+        self.assertEqual(raw_json.get_data()['links']['self']['href'],
+                         'http://example.com/api/groups/')
+        self.assertEqual(self.serialize_count, 3)
+
+    def test_cached_across_list_pages(self):
+        """Testing WebAPIResource.get_serialized_object caching across list
+        pages and formats
+        """
+        group = Group.objects.create(name='group1')
+
+        for start, api_format in ((0, 'json'), (25, 'json'), (25, 'xml')):
+            request = self.factory.get('/api/groups/', {
+                'start': start,
+                'max-results': 25,
+                'api_format': api_format,
+            })
+            kwargs = {
+                'start': start,
+                'max-results': 25,
+                'api_format': api_format,
+            }
+
+            raw_json = self.resource.get_serialized_object(
+                group, request=request, **kwargs)
+            self.assertEqual(raw_json.get_data()['name'], 'group1')
+
+        self.assertEqual(self.serialize_count, 1)
+
+    def test_without_version(self):
+        """Testing WebAPIResource.get_serialized_object without a version"""
+        group = Group.objects.create(name='group1')
+        request = self.factory.get('/api/groups/')
+        self.resource.etag_field = None
+
+        data = self.resource.get_serialized_object(group, request=request)
+        self.assertEqual(data['name'], 'group1')
+        self.resource.get_serialized_object(group, request=request)
+        self.assertEqual(self.serialize_count, 2)
+
+    def test_overridden_etag(self):
+        """Testing WebAPIResource.get_serialized_object with an overridden
+        get_etag and autogenerate_etags
+        """
+        def get_etag(resource, request, obj):
+            return obj.name
+
+        # The resource class is created for each test, so it can be
+        # changed here.
+        resource = self.resource
+        resource.__class__.get_etag = get_etag
+        resource.etag_field = None
+        resource.autogenerate_etags = True
+
+        group = Group.objects.create(name='group1')
+        request = self.factory.get('/api/groups/')
+
+        resource.get_serialized_object(group, request=request)
+        group.name = 'group2'
+        raw_json = resource.get_serialized_object(group, request=request)
+        self.assertEqual(raw_json.get_data()['name'], 'group2')
+        self.assertEqual(self.serialize_count, 2)
+
+        raw_json = resource.get_serialized_object(group, request=request)
+        self.assertEqual(self.serialize_count, 2)
+
+
+class WebAPIResourceHrefTests(TestCase):
+    urls = 'djblets.webapi.tests'
+
+    def setUp(self):
+        self.request = RequestFactory().get('/api/')
+        href_child_resource._item_uri_templates = None
+
+    def test_get_href(self):
+        """Testing WebAPIResource.get_href"""
+        parent = HrefObject(1)
+
+        for i in range(1, 4):
+            self.assertEqual(
+                href_child_resource.get_href(HrefObject(i, parent),
+                                             self.request),
+                self.request.build_absolute_uri(
+                    reverse('hrefchild-resource',
+                            kwargs={'parent_id': 1, 'child_id': i})))
+
+        self.assertEqual(
+            href_child_resource._item_uri_templates[get_script_prefix()],
+            '/api/%(parent_id)s/hrefchilds/%(child_id)s/')
+
+    def test_get_href_quoted_keys(self):
+        """Testing WebAPIResource.get_href with keys that need quoting"""
+        href_named_resource._item_uri_templates = None
+
+        for name in ('abc', 'a?b#c', '50%', 'x&y', u'caf\xe9',
+                     'user@example.com', 'a b+c'):
+            self.assertEqual(
+                href_named_resource.get_href(HrefObject(name), self.request),
+                self.request.build_absolute_uri(
+                    reverse('hrefnamed-resource', kwargs={'name': name})))
+
+        self.assertEqual(
+            href_named_resource._item_uri_templates[get_script_prefix()],
+            '/api/named/%(name)s/')
+
+        # Keys that don't match the regex can't be used with the template.
+        self.assertRaises(NoReverseMatch, href_named_resource.get_href,
+                          HrefObject('a/b'), self.request)
+
+    def test_get_href_template_mismatch(self):
+        """Testing WebAPIResource.get_href with a non-matching URI template"""
+        old_template = href_child_resource._item_uri_template
+        href_child_resource._item_uri_template = 'other/%(child_id)s/'
+
+        try:
+            href = href_child_resource.get_href(
+                HrefObject(2, HrefObject(1)), self.request)
+        finally:
+            href_child_resource._item_uri_template = old_template
+
+        self.assertEqual(href, 'http://testserver/api/1/hrefchilds/2/')
+        self.assertEqual(
+            href_child_resource._item_uri_templates[get_script_prefix()],
+            False)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Benchmarks rendering datagrid cells.
+#
+# This renders a page's worth of linked cells, each with different data so
+# that none are served from the column's render cache, and reports the time
+# taken per cell using the direct rendering of the default cell template,
+# compared to rendering datagrid/cell.html with a RequestContext for every
+# cell, as was done before. The output of the two is also checked to be
+# identical.
+#
+# Usage: ./tests/benchmark-datagrid-cells.py [options]
+#
+# Run with --help for the options.
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+
+def setup_django():
+    os.environ['DJANGO_SETTINGS_MODULE'] = "tests.settings"
+
+
+class BenchmarkObject(object):
+    def __init__(self, pk):
+        self.pk = pk
+        self.name = 'Object %d <%d>' % (pk, pk)
+
+    def get_absolute_url(self):
+        return '/objects/%d/?view=full&id=%d' % (self.pk, self.pk)
+
+
+def define_datagrids():
+    from django.template.context import RequestContext
+    from django.utils.safestring import mark_safe
+
+    from djblets.datagrid.grids import Column, DataGrid, get_cached_template
+
+    class TemplateColumn(Column):
+        def render_default_cell(self, rendered_data, url, css_class):
+            # Render through the template engine, as every cell was before
+            # the default cell template was rendered directly.
+            ctx = RequestContext(self.datagrid.request, {
+                'column': self,
+                'css_class': css_class,
+                'url': url,
+                'data': mark_safe(rendered_data)
+            })
+
+            return mark_safe(get_cached_template(
+                self.datagrid.DEFAULT_CELL_TEMPLATE).render(ctx))
+
+    class BenchmarkDataGrid(DataGrid):
+        name = Column("Name", link=True, css_class='name')
+
+    class TemplateBenchmarkDataGrid(DataGrid):
+        name = TemplateColumn("Name", link=True, css_class='name')
+
+    return BenchmarkDataGrid, TemplateBenchmarkDataGrid
+
+
+def run(column, objects, iterations):
+    times = []
+
+    for i in xrange(iterations):
+        column.reset()
+        start = time.time()
+        cells = [column.render_cell(obj) for obj in objects]
+        times.append(time.time() - start)
+
+    return (min(times) / len(objects), sum(times) / len(times) / len(objects),
+            cells)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--cells', dest='num_cells', type='int',
+                      default=500,
+                      help='the number of cells rendered (default: %default)')
+    parser.add_option('--iterations', dest='iterations', type='int',
+                      default=3,
+                      help='the number of runs of each renderer '
+                           '(default: %default)')
+    options, args = parser.parse_args()
+
+    os.chdir(os.path.join(os.path.dirname(__file__), ".."))
+    sys.path.insert(0, os.getcwd())
+
+    setup_django()
+
+    from django.test.client import RequestFactory
+
+    grid_class, template_grid_class = define_datagrids()
+    request = RequestFactory().get('/objects/')
+    objects = [BenchmarkObject(i) for i in xrange(1, options.num_cells + 1)]
+
+    scenarios = [
+        ("Template", template_grid_class(request).get_column('name')),
+        ("Direct", grid_class(request).get_column('name')),
+    ]
+
+    print
+    print "%-10s %7s %16s %16s" % ("Renderer", "Cells", "Best (us/cell)",
+                                   "Mean (us/cell)")
+    print "-" * 52
+
+    template_cells = None
+
+    for name, column in scenarios:
+        best, mean, cells = run(column, objects, options.iterations)
+
+        if template_cells is None:
+            template_cells = cells
+        elif cells != template_cells:
+            print "%s output differs from the template output!" % name
+
+        print "%-10s %7d %16.1f %16.1f" % (name, len(objects),
+                                           best * 1000000, mean * 1000000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+# Benchmarks datagrid performance against large synthetic datasets.
+#
+# This generates a set of synthetic models in a local SQLite database
+# (kept between runs, since the larger datasets take a while to build),
+# and runs a series of common datagrid scenarios against each dataset
+# size, reporting the time taken and the number of queries performed.
+#
+# Usage: ./tests/benchmark-datagrid.py [options]
+#
+# Run with --help for the options.
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+
+DEFAULT_SIZES = [10000, 100000]
+NUM_CATEGORIES = 200
+
+
+def setup_django(db_path):
+    os.environ['DJANGO_SETTINGS_MODULE'] = "tests.settings"
+
+    from django.conf import settings
+
+    settings.DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': db_path,
+    }
+
+    # Query logging would keep every row we insert in memory. The grids
+    # count their own queries.
+    settings.DEBUG = False
+
+
+def define_models():
+    from django.db import models
+
+    class BenchmarkCategory(models.Model):
+        name = models.CharField(max_length=64)
+
+        class Meta:
+            app_label = 'datagrid_benchmark'
+
+        def __unicode__(self):
+            return self.name
+
+    class BenchmarkItem(models.Model):
+        name = models.CharField(max_length=64, db_index=True)
+        summary = models.CharField(max_length=255)
+        priority = models.IntegerField(db_index=True)
+        category = models.ForeignKey(BenchmarkCategory)
+        timestamp = models.DateTimeField(db_index=True)
+
+        class Meta:
+            app_label = 'datagrid_benchmark'
+
+        def get_absolute_url(self):
+            return '/items/%s/' % self.pk
+
+    return BenchmarkCategory, BenchmarkItem
+
+
+def create_tables(size, models):
+    """
+    Creates the tables for a dataset, if they don't already exist.
+
+    Each dataset size gets its own tables, so that they can all be kept
+    in the same database.
+    """
+    from django.core.management.color import no_style
+    from django.db import connection, transaction
+
+    style = no_style()
+    existing_tables = connection.introspection.table_names()
+    created = False
+
+    for model in models:
+        model._meta.db_table = 'datagrid_benchmark_%s_%s' % (
+            model._meta.object_name.lower(), size)
+
+        if model._meta.db_table not in existing_tables:
+            statements, pending = \
+                connection.creation.sql_create_model(model, style)
+            statements += connection.creation.sql_indexes_for_model(model,
+                                                                    style)
+            cursor = connection.cursor()
+
+            for statement in statements:
+                cursor.execute(statement)
+
+            created = True
+
+    if created:
+        transaction.commit_unless_managed()
+
+
+def populate(size, category_model, item_model):
+    """
+    Fills the tables for a dataset with synthetic rows.
+    """
+    from datetime import datetime, timedelta
+    from django.db import connection, transaction
+
+    if item_model.objects.count() == size:
+        return
+
+    print "Generating %d rows..." % size
+    start = time.time()
+
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s' % item_model._meta.db_table)
+    cursor.execute('DELETE FROM %s' % category_model._meta.db_table)
+
+    cursor.executemany(
+        'INSERT INTO %s (id, name) VALUES (%%s, %%s)'
+        % category_model._meta.db_table,
+        [(i, 'Category %03d' % i) for i in xrange(1, NUM_CATEGORIES + 1)])
+
+    base_time = datetime(2012, 1, 1)
+    batch_size = 10000
+
+    for batch_start in xrange(1, size + 1, batch_size):
+        rows = []
+
+        for i in xrange(batch_start, min(batch_start + batch_size, size + 1)):
+            # Spread the values around, so that sorting by them isn't
+            # the same as sorting by ID.
+            n = (i * 7919) % size
+
+            rows.append((i, 'Item %07d' % n, 'Summary of item %d' % i,
+                         n % 5, (n % NUM_CATEGORIES) + 1,
+                         base_time + timedelta(minutes=n)))
+
+        cursor.executemany(
+            'INSERT INTO %s (id, name, summary, priority, category_id, '
+            '                timestamp)'
+            ' VALUES (%%s, %%s, %%s, %%s, %%s, %%s)'
+            % item_model._meta.db_table,
+            rows)
+
+    transaction.commit_unless_managed()
+    cursor.execute('ANALYZE')
+
+    print "Generated in %.1fs" % (time.time() - start)
+
+
+def define_datagrid(item_model):
+    from djblets.datagrid.grids import Column, DataGrid, DateTimeColumn, \
+                                       ForeignKeyColumn
+
+    class BenchmarkDataGrid(DataGrid):
+        objid = Column("ID", field_name="id", sortable=True,
+                       required_fields=["id"])
+        name = Column("Name", link=True, sortable=True, expand=True,
+                      required_fields=["name"],
+                      filter_type=Column.FILTER_PREFIX)
+        summary = Column("Summary", required_fields=["summary"])
+        priority = Column("Priority", sortable=True,
+                          required_fields=["priority"],
+                          filter_type=Column.FILTER_EXACT)
+        category = ForeignKeyColumn("Category", related_field="name",
+                                    db_field="category__name", sortable=True,
+                                    required_fields=["category"],
+                                    required_relations=["category"])
+        timestamp = DateTimeColumn("Timestamp", sortable=True,
+                                   required_fields=["timestamp"])
+
+        def __init__(self, request):
+            DataGrid.__init__(self, request, item_model.objects.all(),
+                              "Items")
+            self.default_sort = ["objid"]
+            self.default_columns = [
+                "objid", "name", "priority", "category", "timestamp",
+            ]
+            self.count_queries = True
+
+    return BenchmarkDataGrid
+
+
+def get_scenarios(size, per_page):
+    deep_page = size / per_page / 2
+
+    return [
+        ("Single sort", {'sort': 'name'}, None),
+        ("Multi-column sort", {'sort': '-priority,name'}, None),
+        ("Related sort", {'sort': 'category,-objid'}, None),
+        ("Deep page", {'sort': 'name', 'page': str(deep_page)}, None),
+        ("Last page", {'sort': 'name', 'page': 'last'}, None),
+        ("Filtered page", {
+            'sort': 'name',
+            'filter-name': 'Item 00',
+            'filter-priority': '1',
+        }, None),
+        ("Keyset page", {'sort': 'name'},
+         lambda grid: setattr(grid, 'use_keyset_pagination', True)),
+        ("Uncounted page", {'sort': 'name'},
+         lambda grid: setattr(grid, 'count_strategy', grid.COUNT_NONE)),
+        ("Column toggle", {
+            'sort': 'name',
+            'columns': 'objid,name,priority,category,timestamp,summary',
+            'gridonly': '1',
+            'gridformat': 'json',
+            'gridcolumns': 'summary',
+            'datagrid-id': 'datagrid-0',
+        }, None),
+    ]
+
+
+def run_scenario(grid_class, params, setup_func, per_page, iterations):
+    from django.contrib.auth.models import AnonymousUser
+    from django.http import HttpRequest
+
+    times = []
+
+    for i in xrange(iterations):
+        request = HttpRequest()
+        request.user = AnonymousUser()
+        request.GET.update(params)
+
+        start = time.time()
+        grid = grid_class(request)
+        grid.paginate_by = per_page
+
+        if setup_func:
+            setup_func(grid)
+
+        if 'gridonly' in params:
+            grid.render_to_response('unused.html')
+        else:
+            grid.render_listview_to_response()
+
+        times.append(time.time() - start)
+
+    queries = sum([timing['queries'] or 0
+                   for timing in grid.timings.itervalues()])
+    slowest = max(grid.timings.iteritems(), key=lambda item: item[1]['time'])
+
+    return min(times), sum(times) / len(times), queries, slowest[0]
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', dest='sizes',
+                      default=','.join([str(size) for size in DEFAULT_SIZES]),
+                      help='comma-separated dataset sizes (default: %default;'
+                           ' 1000000 is also useful)')
+    parser.add_option('--db', dest='db_path', default='datagrid-benchmark.db',
+                      help='the SQLite database holding the datasets '
+                           '(default: %default)')
+    parser.add_option('--iterations', dest='iterations', type='int',
+                      default=5,
+                      help='the number of runs of each scenario '
+                           '(default: %default)')
+    parser.add_option('--per-page', dest='per_page', type='int', default=50,
+                      help='the number of rows on each page '
+                           '(default: %default)')
+    options, args = parser.parse_args()
+    db_path = os.path.abspath(options.db_path)
+
+    os.chdir(os.path.join(os.path.dirname(__file__), ".."))
+    sys.path.insert(0, os.getcwd())
+
+    setup_django(db_path)
+    category_model, item_model = define_models()
+    grid_class = define_datagrid(item_model)
+
+    print
+    print "%-20s %9s %10s %10s %8s  %s" % ("Scenario", "Rows", "Best (ms)",
+                                          "Mean (ms)", "Queries", "Slowest")
+    print "-" * 78
+
+    for size in [int(size) for size in options.sizes.split(',')]:
+        create_tables(size, [category_model, item_model])
+        populate(size, category_model, item_model)
+
+        for name, params, setup_func in get_scenarios(size,
+                                                      options.per_page):
+            best, mean, queries, slowest = run_scenario(
+                grid_class, params, setup_func, options.per_page,
+                options.iterations)
+
+            print "%-20s %9d %10.1f %10.1f %8d  %s" % (
+                name, size, best * 1000, mean * 1000, queries, slowest)
+
+        print
+
+
+if __name__ == "__main__":
+    main()
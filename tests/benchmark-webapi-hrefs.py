@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# Benchmarks building the URLs to Web API resources.
+#
+# This builds a small resource tree (a list of parents, each with a list
+# of children), and reports the time taken per object to build the href
+# for a child, and to serialize a child with its links, using the URI
+# templates built by get_url_patterns(), compared to calling reverse()
+# and request.build_absolute_uri() for every object.
+#
+# Usage: ./tests/benchmark-webapi-hrefs.py [options]
+#
+# Run with --help for the options.
+
+import os
+import sys
+import time
+import types
+from optparse import OptionParser
+
+
+def setup_django():
+    os.environ['DJANGO_SETTINGS_MODULE'] = "tests.settings"
+
+
+class BenchmarkObject(object):
+    def __init__(self, pk, name, parent=None):
+        self.pk = pk
+        self.name = name
+        self.parent = parent
+
+
+def define_resources():
+    from django.conf.urls.defaults import include, patterns, url
+    from django.core.urlresolvers import reverse
+
+    from djblets.webapi.resources import WebAPIResource
+
+    class BenchmarkChildResource(WebAPIResource):
+        name = 'benchmarkchild'
+        uri_object_key = 'child_id'
+        model_parent_key = 'parent'
+        fields = ('name', 'parent')
+        allowed_methods = ('GET', 'PUT', 'DELETE')
+
+        def serialize_parent_field(self, obj):
+            return self._parent_resource.get_href(obj.parent, self.request)
+
+    class LegacyBenchmarkChildResource(BenchmarkChildResource):
+        def get_href(self, obj, request, *args, **kwargs):
+            href_kwargs = {
+                self.uri_object_key: getattr(obj, self.model_object_key),
+            }
+            href_kwargs.update(self.get_href_parent_ids(obj))
+
+            return request.build_absolute_uri(
+                reverse(self._build_named_url(self.name), kwargs=href_kwargs))
+
+    class BenchmarkParentResource(WebAPIResource):
+        name = 'benchmarkparent'
+        uri_object_key = 'parent_id'
+        item_child_resources = [BenchmarkChildResource()]
+
+    parent_resource = BenchmarkParentResource()
+    child_resource = parent_resource.item_child_resources[0]
+
+    urls = types.ModuleType('benchmark_webapi_urls')
+    urls.urlpatterns = patterns('',
+        url(r'^api/', include(parent_resource.get_url_patterns())),
+    )
+    sys.modules[urls.__name__] = urls
+
+    from django.conf import settings
+    settings.ROOT_URLCONF = urls.__name__
+
+    legacy_child_resource = LegacyBenchmarkChildResource()
+    legacy_child_resource._parent_resource = parent_resource
+
+    return child_resource, legacy_child_resource
+
+
+def run(func, objects, iterations):
+    times = []
+
+    for i in xrange(iterations):
+        start = time.time()
+
+        for obj in objects:
+            func(obj)
+
+        times.append(time.time() - start)
+
+    return min(times) / len(objects), sum(times) / len(times) / len(objects)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--objects', dest='num_objects', type='int',
+                      default=2000,
+                      help='the number of objects (default: %default)')
+    parser.add_option('--iterations', dest='iterations', type='int',
+                      default=5,
+                      help='the number of runs of each scenario '
+                           '(default: %default)')
+    options, args = parser.parse_args()
+
+    os.chdir(os.path.join(os.path.dirname(__file__), ".."))
+    sys.path.insert(0, os.getcwd())
+
+    setup_django()
+
+    from django.test.client import RequestFactory
+
+    child_resource, legacy_child_resource = define_resources()
+    request = RequestFactory().get('/api/')
+
+    parents = [BenchmarkObject(i, 'Parent %d' % i) for i in xrange(1, 11)]
+    objects = [
+        BenchmarkObject(i, 'Child %d' % i, parents[i % len(parents)])
+        for i in xrange(1, options.num_objects + 1)
+    ]
+
+    child_resource.request = request
+    legacy_child_resource.request = request
+
+    # Make sure both build the same URLs.
+    assert ([child_resource.get_href(obj, request) for obj in objects] ==
+            [legacy_child_resource.get_href(obj, request) for obj in objects])
+
+    scenarios = [
+        ("get_href, reverse()",
+         lambda obj: legacy_child_resource.get_href(obj, request)),
+        ("get_href, template",
+         lambda obj: child_resource.get_href(obj, request)),
+        ("serialize, reverse()",
+         lambda obj: legacy_child_resource.serialize_object(
+             obj, request=request)),
+        ("serialize, template",
+         lambda obj: child_resource.serialize_object(obj, request=request)),
+    ]
+
+    print
+    print "%-22s %9s %14s %14s" % ("Scenario", "Objects", "Best (us/obj)",
+                                   "Mean (us/obj)")
+    print "-" * 62
+
+    for name, func in scenarios:
+        best, mean = run(func, objects, options.iterations)
+
+        print "%-22s %9d %14.1f %14.1f" % (name, len(objects),
+                                           best * 1000000, mean * 1000000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#
+# Benchmarks the Web API XML encoder.
+#
+# This encodes synthetic list payloads of various sizes with the current
+# XMLEncoderAdapter (both indented and compact), and with the previous,
+# recursive adapter based on XMLGenerator, reporting the time taken and
+# the size of the output. The output of the two adapters is also checked
+# to be identical.
+#
+# Usage: ./tests/benchmark-webapi-xml.py [options]
+#
+# Run with --help for the options.
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+
+DEFAULT_SIZES = [200, 2000, 20000]
+
+
+def setup_django():
+    os.environ['DJANGO_SETTINGS_MODULE'] = "tests.settings"
+
+
+def get_legacy_adapter_class():
+    """
+    Returns the XMLEncoderAdapter implementation prior to the iterative
+    encoder, for comparison.
+    """
+    from cStringIO import StringIO
+    from xml.sax.saxutils import XMLGenerator
+
+    from django.conf import settings
+
+    class LegacyXMLEncoderAdapter(object):
+        def __init__(self, encoder, *args, **kwargs):
+            self.encoder = encoder
+
+        def encode(self, o, *args, **kwargs):
+            self.level = 0
+            self.doIndent = False
+
+            stream = StringIO()
+            self.xml = XMLGenerator(stream, settings.DEFAULT_CHARSET)
+            self.xml.startDocument()
+            self.startElement("rsp")
+            self.__encode(o, *args, **kwargs)
+            self.endElement("rsp")
+            self.xml.endDocument()
+            self.xml = None
+
+            return stream.getvalue()
+
+        def __encode(self, o, *args, **kwargs):
+            if isinstance(o, dict):
+                for key, value in o.iteritems():
+                    attrs = {}
+
+                    if isinstance(key, (int, long)):
+                        attrs['value'] = str(key)
+                        key = 'int'
+
+                    self.startElement(key, attrs)
+                    self.__encode(value, *args, **kwargs)
+                    self.endElement(key)
+            elif isinstance(o, (tuple, list)):
+                self.startElement("array")
+
+                for i in o:
+                    self.startElement("item")
+                    self.__encode(i, *args, **kwargs)
+                    self.endElement("item")
+
+                self.endElement("array")
+            elif isinstance(o, basestring):
+                self.text(o)
+            elif isinstance(o, (int, long)):
+                self.text("%d" % o)
+            elif o is None:
+                pass
+            else:
+                result = self.encoder.encode(o, *args, **kwargs)
+
+                if result is None:
+                    raise TypeError("%r is not XML serializable" % (o,))
+
+                return self.__encode(result, *args, **kwargs)
+
+        def startElement(self, name, attrs={}):
+            self.addIndent()
+            self.xml.startElement(name, attrs)
+            self.level += 1
+            self.doIndent = True
+
+        def endElement(self, name):
+            self.level -= 1
+            self.addIndent()
+            self.xml.endElement(name)
+            self.doIndent = True
+
+        def text(self, value):
+            self.xml.characters(value)
+            self.doIndent = False
+
+        def addIndent(self):
+            if self.doIndent:
+                self.xml.ignorableWhitespace('\n' + ' ' * self.level)
+
+    return LegacyXMLEncoderAdapter
+
+
+def build_payload(size):
+    from datetime import datetime, timedelta
+
+    base_time = datetime(2012, 1, 1)
+
+    return {
+        'stat': 'ok',
+        'total_results': size,
+        'links': {
+            'self': {
+                'method': 'GET',
+                'href': 'http://example.com/api/items/',
+            },
+        },
+        'items': [
+            {
+                'id': i,
+                'summary': u'Summary of item %d <with> "markup" & caf\xe9' % i,
+                'timestamp': base_time + timedelta(minutes=i),
+                'tags': ['tag%d' % (i % 10), 'tag%d' % (i % 7)],
+                'links': {
+                    'self': {
+                        'method': 'GET',
+                        'href': 'http://example.com/api/items/%d/' % i,
+                        'title': 'Item %d' % i,
+                    },
+                },
+            }
+            for i in xrange(size)
+        ],
+    }
+
+
+def run_encoder(encode_func, payload, iterations):
+    times = []
+
+    for i in xrange(iterations):
+        start = time.time()
+        content = encode_func(payload)
+        times.append(time.time() - start)
+
+    return min(times), sum(times) / len(times), len(content), content
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--sizes', dest='sizes',
+                      default=','.join([str(size) for size in DEFAULT_SIZES]),
+                      help='comma-separated numbers of items in each list '
+                           '(default: %default)')
+    parser.add_option('--iterations', dest='iterations', type='int',
+                      default=5,
+                      help='the number of runs of each encoder '
+                           '(default: %default)')
+    options, args = parser.parse_args()
+
+    os.chdir(os.path.join(os.path.dirname(__file__), ".."))
+    sys.path.insert(0, os.getcwd())
+
+    setup_django()
+
+    from djblets.webapi.core import XMLEncoderAdapter
+    from djblets.webapi.encoders import BasicAPIEncoder
+
+    encoder = BasicAPIEncoder()
+    legacy_adapter = get_legacy_adapter_class()(encoder)
+    adapter = XMLEncoderAdapter(encoder)
+    compact_adapter = XMLEncoderAdapter(encoder, compact=True)
+
+    encoders = [
+        ("Legacy", legacy_adapter.encode),
+        ("Iterative", adapter.encode),
+        ("Iterative, compact", compact_adapter.encode),
+        ("Iterative, chunked",
+         lambda payload: ''.join(adapter.iter_encode(payload))),
+    ]
+
+    print
+    print "%-20s %7s %10s %10s %11s" % ("Encoder", "Items", "Best (ms)",
+                                        "Mean (ms)", "Size (KB)")
+    print "-" * 62
+
+    for size in [int(size) for size in options.sizes.split(',')]:
+        payload = build_payload(size)
+        legacy_content = None
+
+        for name, encode_func in encoders:
+            best, mean, content_len, content = \
+                run_encoder(encode_func, payload, options.iterations)
+
+            if legacy_content is None:
+                legacy_content = content
+            elif (encode_func != compact_adapter.encode and
+                  content != legacy_content):
+                print "%s output differs from the legacy output!" % name
+
+            print "%-20s %7d %10.1f %10.1f %11.1f" % (
+                name, size, best * 1000, mean * 1000, content_len / 1024.0)
+
+        print
+
+
+if __name__ == "__main__":
+    main()